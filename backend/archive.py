@@ -0,0 +1,182 @@
+"""
+Потоковая выдача набора фото одним ZIP-архивом.
+
+zipfile пишет архив в несикабельный файловый объект в отдельном потоке: размеры и CRC
+каждого файла уходят в data descriptor после его содержимого, поэтому архив не нужно
+ни буферизовать целиком, ни собирать во временном файле. Готовые чанки передаются
+в event loop через ограниченную очередь - если клиент читает медленно, поток ждет.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterable, Iterator, NamedTuple
+from fastapi import HTTPException, status
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Сколько архивов может собираться одновременно; сверх этого запросы сразу получают 503
+ARCHIVE_MAX_JOBS = int(os.getenv("ARCHIVE_MAX_JOBS", 2))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", 1024 * 1024))
+# Сколько готовых чанков может ждать отправки клиенту, на каждый архив
+ARCHIVE_QUEUE_CHUNKS = int(os.getenv("ARCHIVE_QUEUE_CHUNKS", 8))
+
+# Уже сжатые форматы кладутся в архив без сжатия
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# Отдельный пул, чтобы долгие выгрузки не занимали потоки, нужные загрузкам
+_archive_executor = ThreadPoolExecutor(max_workers=ARCHIVE_MAX_JOBS, thread_name_prefix="archive")
+# Счетчик меняется только в потоке event loop, блокировка не нужна
+_jobs_in_flight = 0
+
+
+class ArchiveEntry(NamedTuple):
+    path: str
+    arcname: str
+
+
+class _ArchiveCancelled(Exception):
+    pass
+
+
+class _ChunkWriter:
+    """
+    Несикабельный файловый объект для zipfile.
+    Копит мелкие записи в буфер и отдает его в asyncio-очередь чанками по ARCHIVE_CHUNK_SIZE.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ARCHIVE_QUEUE_CHUNKS)
+        self.cancelled = threading.Event()
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= ARCHIVE_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            self.put(chunk)
+
+    def call(self, coro):
+        """Выполняет корутину в event loop из рабочего потока и ждет результата."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                if self.cancelled.is_set():
+                    future.cancel()
+                    raise _ArchiveCancelled()
+
+    def iterate(self, chunks: AsyncIterator[bytes]) -> Iterator[bytes]:
+        """Читает асинхронный поток чанков из рабочего потока."""
+        while True:
+            try:
+                yield self.call(anext(chunks))
+            except StopAsyncIteration:
+                return
+
+    def put(self, item):
+        """Кладет элемент в очередь из рабочего потока, ожидая свободного места."""
+        self.call(self.queue.put(item))
+
+
+def _write_archive(writer: _ChunkWriter, entries: Iterable[ArchiveEntry]):
+    try:
+        # allowZip64: размеры отдельных файлов известны заранее, zipfile сам включает ZIP64 где нужно
+        with zipfile.ZipFile(writer, mode="w", allowZip64=True) as archive:
+            for entry in entries:
+                path = writer.call(storage.backend.local_path(entry.path))
+                try:
+                    if path is not None:
+                        info = zipfile.ZipInfo.from_file(path, entry.arcname)
+                    else:
+                        # Файл не на локальном диске: читаем его из хранилища через event loop
+                        size = writer.call(storage.backend.size(entry.path))
+                        if size is None:
+                            raise FileNotFoundError(entry.path)
+                        info = zipfile.ZipInfo(entry.arcname, time.localtime()[:6])
+                        info.file_size = size
+                except FileNotFoundError:
+                    logger.warning("Photo file %s is missing, skipped in archive", entry.path)
+                    continue
+                extension = os.path.splitext(entry.path)[1].lower()
+                info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                if path is not None:
+                    with open(path, "rb") as source, archive.open(info, "w") as target:
+                        shutil.copyfileobj(source, target, ARCHIVE_CHUNK_SIZE)
+                else:
+                    with archive.open(info, "w") as target:
+                        for chunk in writer.iterate(storage.backend.get(entry.path)):
+                            target.write(chunk)
+        writer.flush()
+        writer.put(None)
+    except _ArchiveCancelled:
+        pass
+    except BaseException as e:
+        if not writer.cancelled.is_set():
+            writer.put(e)
+
+
+class ArchiveSlot:
+    """
+    Место среди ARCHIVE_MAX_JOBS одновременных выгрузок. Освобождается один раз:
+    после отдачи архива, при ошибке до начала ответа или если ответ так и не начался
+    (генератор архива удален, не запустившись).
+    """
+
+    def __init__(self):
+        global _jobs_in_flight
+        _jobs_in_flight += 1
+        self._released = False
+
+    def release(self):
+        global _jobs_in_flight
+        if not self._released:
+            self._released = True
+            _jobs_in_flight -= 1
+
+    def __del__(self):
+        self.release()
+
+
+def reserve() -> ArchiveSlot:
+    """
+    Занимает место до начала ответа, чтобы при перегрузке сразу вернуть 503:
+    одновременные запросы не проходят проверку все вместе, пока ни один архив еще не начат.
+    """
+    if _jobs_in_flight >= ARCHIVE_MAX_JOBS:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many archive downloads, try again later", headers={"Retry-After": "30"})
+    return ArchiveSlot()
+
+
+async def stream_zip(entries: list[ArchiveEntry], slot: ArchiveSlot) -> AsyncIterator[bytes]:
+    """Отдает ZIP-архив из файлов entries по чанкам; slot - место, занятое reserve()."""
+    loop = asyncio.get_running_loop()
+    writer = _ChunkWriter(loop)
+    loop.run_in_executor(_archive_executor, _write_archive, writer, entries)
+    try:
+        while True:
+            item = await writer.queue.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Архив собран или клиент отключился; во втором случае поток остановится на следующей записи
+        writer.cancelled.set()
+        slot.release()
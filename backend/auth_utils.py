@@ -1,16 +1,30 @@
+import asyncio
 import bcrypt
+import os
 import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
 from fastapi import HTTPException, status, Request
 from typing import Optional
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
+from cache import TTLCache
+import metrics
 
 SECRET_KEY = "supersecretkey_change_me"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 CSRF_TOKEN_EXPIRE_HOURS = 1
+# Стоимость bcrypt; при изменении старые хэши пересчитываются при следующем входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+# Сколько хэширований может ждать свободного потока; сверх этого запросы сразу получают 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 32))
+# Кэш проверенных токенов и данных пользователей; срок жизни записи не больше exp токена
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", 300))
 
 # JWT
 
@@ -24,14 +38,60 @@ def create_refresh_token(subject: str) -> str:
     to_encode = {"sub": subject, "exp": expire, "type": "refresh"}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+_token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+metrics.register_cache("auth_tokens", _token_cache.stats)
+
 def decode_token(token: str, token_type: str = None) -> dict:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        if token_type and payload.get("type") != token_type:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token type")
-        return payload
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    # Подпись уже проверенного токена не проверяем повторно, пока он не истек
+    payload = _token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        _token_cache.set(token, payload, ttl=payload.get("exp", 0) - time.time())
+    if token_type and payload.get("type") != token_type:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token type")
+    return payload
+
+def forget_token(token: str):
+    _token_cache.delete(token)
+
+# Кэш данных пользователя (principal) по email из токена
+
+_principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+metrics.register_cache("auth_principals", _principal_cache.stats)
+_principal_email_by_id: dict[int, str] = {}
+# Номер сброса: меняется при каждом invalidate_principal. Пользователь, прочитанный из базы,
+# кэшируется, только если номер не изменился с начала чтения: иначе сброс, пришедший
+# во время чтения, ничего не найдет в кэше, и старые данные пролежат в нем до истечения токена
+_principal_generation = 0
+
+def get_cached_principal(email: str):
+    return _principal_cache.get(email)
+
+def principal_generation() -> int:
+    """Номер сброса; берется перед чтением пользователя из базы и передается в cache_principal."""
+    return _principal_generation
+
+def cache_principal(principal, expires_at: float, generation: int):
+    if generation != _principal_generation:
+        return
+    _principal_cache.set(principal.email, principal, ttl=expires_at - time.time())
+    _principal_email_by_id[principal.id] = principal.email
+    # Индекс по id не должен расти бесконечно вместе с вытесненными записями
+    if len(_principal_email_by_id) > 2 * AUTH_CACHE_SIZE:
+        _principal_email_by_id.clear()
+        _principal_email_by_id.update({cached.id: email for email, cached in _principal_cache.items()})
+
+def invalidate_principal(user_id: Optional[int] = None, email: Optional[str] = None):
+    """Сбрасывает закэшированные данные пользователя после его изменения, удаления или выхода."""
+    global _principal_generation
+    _principal_generation += 1
+    if user_id is not None:
+        email = _principal_email_by_id.pop(user_id, email)
+    if email is not None:
+        _principal_cache.delete(email)
 
 # CSRF
 
@@ -48,13 +108,39 @@ def verify_csrf_token(request: Request, csrf_token: Optional[str] = None):
 
 # hashing
 
+# bcrypt отпускает GIL, поэтому отдельный пул потоков хэширует параллельно и не блокирует event loop
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+# Счетчик меняется только в потоке event loop, блокировка не нужна
+_hash_in_flight = 0
+
+async def _run_hashing(func, *args):
+    global _hash_in_flight
+    if _hash_in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later", headers={"Retry-After": "1"})
+    _hash_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_in_flight -= 1
+
+def _hashpw(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _checkpw(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
 async def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    return await _run_hashing(_hashpw, password, BCRYPT_ROUNDS)
 
 async def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return await _run_hashing(_checkpw, password, hashed_password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Проверяет, посчитан ли хэш с текущей стоимостью bcrypt ($2b$<rounds>$...)."""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 bearer_scheme = HTTPBearer()
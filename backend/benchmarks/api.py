@@ -0,0 +1,270 @@
+"""
+Нагрузочный и регрессионный бенчмарк API.
+
+Приложение запускается в этом же процессе и вызывается через ASGI-транспорт httpx,
+без сети. Перед замером во временный каталог сеется синтетический набор данных:
+пользователи и N фото с маленькими сгенерированными JPEG. Для каждого сценария
+(login, upload, list, get, update, delete) считаются пропускная способность и
+задержки p50/p95/p99.
+
+Запуск из каталога backend:
+    python -m benchmarks.api --photos 5000 --output baseline.json
+    python -m benchmarks.api --photos 5000 --compare baseline.json
+
+В режиме --compare сценарий считается регрессией, если p95 вырос или пропускная
+способность упала больше чем на --threshold; тогда код возврата 1.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SCENARIOS = ("login", "upload", "list", "get", "update", "delete")
+PASSWORD = "Password123"
+INSERT_BATCH_SIZE = 1000
+PARALLELS = "АБВГ"
+
+
+def _jpeg(seed: int, size: int = 32) -> bytes:
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    # Несколько случайных пикселей, чтобы содержимое (и хэш) у всех файлов было разным
+    for _ in range(8):
+        image.putpixel((rng.randrange(size), rng.randrange(size)), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _photo_meta(rng: random.Random) -> dict:
+    return {
+        "date": (datetime(2015, 9, 1) + timedelta(days=rng.randrange(3650))).date().isoformat(),
+        "description": f"Синтетическое фото {rng.randrange(10 ** 6)}",
+        "grade": rng.randint(1, 11),
+        "parallel": rng.choice(PARALLELS),
+    }
+
+
+async def seed(users: int, photos: int) -> dict:
+    """
+    Заполняет базу напрямую, минуя API: так сев не влияет на замеры и идет быстро.
+    Вызывается до запуска приложения: lifespan строит photo_stats и индексы дубликатов
+    и похожих фото по уже засеянным данным.
+    """
+    from sqlalchemy import insert
+    import auth_utils
+    import uploads
+    from database import engine, init_db
+    from models.user_model import User, UserRoles
+    from models.photo_model import Photo
+    from models.photo_file_model import PhotoFile
+
+    rng = random.Random(0)
+    password_hashed = await auth_utils.hash_password(PASSWORD)
+    emails = [f"user{i}@bench.local" for i in range(users)]
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    await init_db()
+
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [
+            {"first_name": "Bench", "last_name": str(i), "email": email, "password_hashed": password_hashed,
+             "role": UserRoles.admin if i == 0 else UserRoles.user, "is_active": True}
+            for i, email in enumerate(emails)
+        ])
+        for offset in range(0, photos, INSERT_BATCH_SIZE):
+            files, rows = [], []
+            for i in range(offset, min(offset + INSERT_BATCH_SIZE, photos)):
+                content = _jpeg(i)
+                checksum = hashlib.sha256(content).hexdigest()
+                path = uploads.storage_path(checksum, ".jpg")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(content)
+                meta = _photo_meta(rng)
+                files.append({"checksum": checksum, "path": path, "size": len(content), "ref_count": 1, "created_at": now})
+                rows.append({**meta, "date": datetime.fromisoformat(meta["date"]), "path": path, "checksum": checksum,
+                             "created_at": now, "updated_at": now})
+            await conn.execute(insert(PhotoFile), files)
+            await conn.execute(insert(Photo), rows)
+    return {"emails": emails, "photo_ids": list(range(1, photos + 1))}
+
+
+def _summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies_ms = [latency * 1000 for latency in latencies]
+    percentiles = statistics.quantiles(latencies_ms, n=100, method="inclusive") if len(latencies_ms) > 1 else latencies_ms * 99
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "throughput_rps": round(len(latencies_ms) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies_ms), 3) if latencies_ms else 0.0,
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+    }
+
+
+async def _run_scenario(client, make_request, requests: int, concurrency: int) -> dict:
+    """Выполняет requests запросов в concurrency параллельных потоков выполнения."""
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            response = await make_request(client, index)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summary(latencies, errors, time.perf_counter() - started)
+
+
+def _scenarios(data: dict, rng: random.Random) -> dict:
+    emails, photo_ids = data["emails"], data["photo_ids"]
+    # Удаляются фото с конца, обновляются и читаются - с начала, чтобы сценарии не мешали друг другу
+    to_delete = photo_ids[len(photo_ids) // 2:]
+    to_read = photo_ids[:len(photo_ids) // 2] or photo_ids
+
+    async def login(client, index):
+        return await client.post("/auth/login", data={"username": emails[index % len(emails)], "password": PASSWORD})
+
+    async def upload(client, index):
+        content = _jpeg(10 ** 7 + index)
+        return await client.post("/photos/", data={"photo_data_json": json.dumps(_photo_meta(rng))},
+                                 files={"file": (f"bench{index}.jpg", content, "image/jpeg")})
+
+    async def list_page(client, index):
+        params = {"limit": 50}
+        if index % 2:
+            params["grade"] = rng.randint(1, 11)
+        return await client.get("/photos/", params=params)
+
+    async def get(client, index):
+        return await client.get(f"/photos/{rng.choice(to_read)}")
+
+    async def update(client, index):
+        return await client.put(f"/photos/{rng.choice(to_read)}", json={**_photo_meta(rng), "date": "2024-05-01T00:00:00"})
+
+    async def delete(client, index):
+        return await client.delete(f"/photos/{to_delete[index % len(to_delete)]}")
+
+    return {"login": login, "upload": upload, "list": list_page, "get": get, "update": update, "delete": delete}
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    # Переменные окружения читаются модулями при импорте, поэтому приложение импортируется только здесь
+    import httpx
+    from main import app
+
+    scenarios = args.scenarios or list(SCENARIOS)
+    if "delete" in scenarios and args.requests > args.photos // 2:
+        raise SystemExit("delete needs --photos at least twice --requests")
+
+    seeding = time.perf_counter()
+    data = await seed(args.users, args.photos)
+    print(f"Seeded {args.users} users and {args.photos} photos in {time.perf_counter() - seeding:.1f} s", file=sys.stderr)
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            requests = _scenarios(data, random.Random(1))
+            for name in scenarios:
+                # Прогрев: пул соединений, кэши, ленивые импорты; удаление не прогревается, чтобы не тратить фото
+                if name != "delete":
+                    for index in range(args.warmup):
+                        await requests[name](client, args.requests + index)
+                results[name] = await _run_scenario(client, requests[name], args.requests, args.concurrency)
+                print(f"{name:>7}: {results[name]}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "users": args.users,
+            "photos": args.photos,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Сценарии, где p95 вырос или пропускная способность упала больше чем на threshold."""
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        throughput_change = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0.0
+        flagged = p95_change > threshold or throughput_change < -threshold
+        print(f"{name:>7}: p95 {previous['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms ({p95_change:+.1%}), "
+              f"throughput {previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} rps ({throughput_change:+.1%})"
+              f"{'  REGRESSION' if flagged else ''}")
+        if flagged:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="Количество пользователей")
+    parser.add_argument("--photos", type=int, default=2000, help="Количество фото в наборе данных")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=8, help="Одновременных запросов")
+    parser.add_argument("--warmup", type=int, default=5, help="Прогревочных запросов перед сценарием")
+    parser.add_argument("--scenario", dest="scenarios", action="append", choices=SCENARIOS, help="Сценарий (можно несколько раз), по умолчанию все")
+    parser.add_argument("--output", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--compare", help="JSON-файл с базовыми результатами для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Допустимое ухудшение, доля (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["PHOTOS_DIR"] = os.path.join(tmp, "photos")
+        report = asyncio.run(run(args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
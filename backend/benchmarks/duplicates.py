@@ -0,0 +1,63 @@
+"""
+Время поиска почти одинаковых фото в индексе перцептивных хэшей.
+
+Хэши синтетические: группы по несколько копий одного снимка (каждая копия отличается
+от исходного хэша на 0-4 бита, как после пересжатия или уменьшения) и случайные хэши
+остальных фото. Замеряются построение индекса и запросы с разным радиусом.
+
+Запуск из каталога backend:
+    python -m benchmarks.duplicates --photos 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+import duplicates
+
+GROUP_SIZE = 4
+MAX_COPY_DISTANCE = 4
+
+
+def _hashes(photos: int, rng: random.Random) -> list[int]:
+    values = []
+    while len(values) < photos:
+        base = rng.getrandbits(duplicates.HASH_BITS)
+        values.append(base)
+        # Примерно каждое десятое фото загружено еще в нескольких копиях
+        if rng.random() < 0.1:
+            for _ in range(GROUP_SIZE - 1):
+                copy = base
+                for bit in rng.sample(range(duplicates.HASH_BITS), rng.randint(0, MAX_COPY_DISTANCE)):
+                    copy ^= 1 << bit
+                values.append(copy)
+    return values[:photos]
+
+
+def main(photos: int, queries: int):
+    rng = random.Random(0)
+    values = _hashes(photos, rng)
+    index = duplicates.HashIndex()
+    started = time.perf_counter()
+    for photo_id, value in enumerate(values, 1):
+        index.add(photo_id, value)
+    print(f"photos={photos}, index built in {time.perf_counter() - started:.2f} s")
+
+    probes = rng.sample(values, queries)
+    for max_distance in (0, duplicates.NEAR_DUPLICATE_DISTANCE, 8, duplicates.MAX_DUPLICATE_DISTANCE):
+        timings, found = [], 0
+        for value in probes:
+            started = time.perf_counter()
+            found += len(index.query(value, max_distance))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"max_distance={max_distance:>2}: p50 {statistics.median(timings):.3f} ms, "
+              f"p99 {timings[int(len(timings) * 0.99)]:.3f} ms, {found / queries:.2f} found per query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=100000, help="Количество фото в индексе")
+    parser.add_argument("--queries", type=int, default=2000, help="Количество запросов на радиус")
+    args = parser.parse_args()
+    main(args.photos, args.queries)
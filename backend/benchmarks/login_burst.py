@@ -0,0 +1,66 @@
+"""
+Задержка event loop во время всплеска входов.
+
+Пока N корутин одновременно проверяют пароль, фоновая корутина каждые 10 мс
+замеряет, насколько позже запланированного она просыпается. Сравниваются
+прямой вызов bcrypt.checkpw в event loop и auth_utils.verify_password.
+
+Запуск из каталога backend:
+    python -m benchmarks.login_burst --logins 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import bcrypt
+
+import auth_utils
+
+TICK = 0.01
+
+
+async def _measure_lag(stop: asyncio.Event, lags: list[float]):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - started - TICK)
+
+
+async def _inline_verify(password: str, hashed: str) -> bool:
+    # Прежняя реализация: async-функция, блокирующая event loop
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+async def _burst(verify, logins: int, hashed: str) -> dict:
+    stop = asyncio.Event()
+    lags: list[float] = []
+    ticker = asyncio.create_task(_measure_lag(stop, lags))
+    await asyncio.sleep(TICK * 3)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify("Password123", hashed) for _ in range(logins)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "rejected": sum(isinstance(result, Exception) for result in results),
+        "lag_p50_ms": round(statistics.median(lags_ms), 2),
+        "lag_max_ms": round(lags_ms[-1], 2),
+    }
+
+
+async def main(logins: int):
+    hashed = await auth_utils.hash_password("Password123")
+    print(f"bcrypt rounds={auth_utils.BCRYPT_ROUNDS}, workers={auth_utils.PASSWORD_HASH_WORKERS}, "
+          f"queue limit={auth_utils.PASSWORD_HASH_QUEUE_LIMIT}, logins={logins}")
+    for name, verify in (("inline", _inline_verify), ("executor", auth_utils.verify_password)):
+        print(f"{name:>9}: {await _burst(verify, logins, hashed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=30, help="Количество одновременных входов")
+    args = parser.parse_args()
+    asyncio.run(main(args.logins))
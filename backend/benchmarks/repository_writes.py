@@ -0,0 +1,114 @@
+"""
+Запись через репозиторий: прежний путь (SELECT + изменение объекта + commit + refresh)
+против одного оператора UPDATE/DELETE ... RETURNING.
+
+Каждая операция выполняется в своей сессии, как в обработчике запроса. Кроме времени
+считается число SQL-операторов на одну операцию (BEGIN/COMMIT не учитываются).
+
+Запуск из каталога backend:
+    python -m benchmarks.repository_writes --rows 2000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import database
+from models.user_model import User, UserRoles
+from repository import UserRepository
+
+
+class _LegacyUserRepository(UserRepository):
+    """Прежняя реализация записи, оставлена только для сравнения."""
+
+    async def update(self, entity_or_id, data=None, session=None):
+        entity = await self.get_by_id(entity_or_id, session)
+        if entity:
+            for key, value in data.items():
+                if value is not None:
+                    setattr(entity, key, value)
+            await session.commit()
+            await session.refresh(entity)
+        return entity
+
+    async def delete(self, id, session):
+        entity = await self.get_by_id(id, session)
+        if entity:
+            await session.delete(entity)
+            await session.commit()
+            return {"message": f"{self.get_model_name()} deleted successfully"}
+        return {"message": f"{self.get_model_name()} not found"}
+
+    async def update_refresh_token_by_email(self, email, refresh_token, session):
+        user = await self.get_by_email(email, session)
+        if not user:
+            return None
+        user.refresh_token = refresh_token
+        await session.commit()
+        await session.refresh(user)
+        return user
+
+
+async def _seed(session_factory, rows: int):
+    async with session_factory() as session:
+        session.add_all(
+            User(first_name="Иван", last_name="Иванов", email=f"user{i}@example.com", password_hashed="x",
+                 role=UserRoles.user, is_active=True)
+            for i in range(rows)
+        )
+        await session.commit()
+
+
+async def _run(session_factory, operation, ids) -> float:
+    started = time.perf_counter()
+    for id in ids:
+        async with session_factory() as session:
+            await operation(session, id)
+    return time.perf_counter() - started
+
+
+def _operations(repository: UserRepository) -> dict:
+    return {
+        "update": lambda session, id: repository.update(id, {"first_name": f"Петр{id}", "is_active": None}, session),
+        "refresh_token": lambda session, id: repository.update_refresh_token_by_email(f"user{id - 1}@example.com", f"token{id}", session),
+        "delete": lambda session, id: repository.delete(id, session),
+    }
+
+
+async def main(rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, repository in (("legacy", _LegacyUserRepository()), ("returning", UserRepository())):
+            engine = database.create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, name)}.db")
+            statements = []
+            event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(1))
+            async with engine.begin() as conn:
+                await conn.run_sync(database.Base.metadata.create_all)
+            session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+            await _seed(session_factory, rows)
+
+            ids = list(range(1, rows + 1))
+            for operation, call in _operations(repository).items():
+                statements.clear()
+                elapsed = await _run(session_factory, call, ids)
+                results.setdefault(operation, {})[name] = (elapsed, len(statements) / rows)
+            await engine.dispose()
+
+    print(f"rows={rows}")
+    for operation, by_path in results.items():
+        legacy_time, legacy_statements = by_path["legacy"]
+        new_time, new_statements = by_path["returning"]
+        print(f"{operation:>13}: legacy {legacy_time / rows * 1e6:8.1f} us/op, {legacy_statements:.0f} stmt/op | "
+              f"returning {new_time / rows * 1e6:8.1f} us/op, {new_statements:.0f} stmt/op | "
+              f"x{legacy_time / new_time:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="Количество строк для каждой операции")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows))
@@ -0,0 +1,99 @@
+"""
+Время полнотекстового поиска по описаниям фото.
+
+Заполняет временную базу N фото: в каждом описании одно событие из короткого школьного
+словаря, класс и несколько слов из большого случайного словаря (имена, места), - и замеряет
+PhotoRepository.search для нескольких типичных запросов. Время растет с числом совпадений:
+bm25 считается для каждого найденного фото, но не больше чем для SEARCH_MAX_CANDIDATES
+самых новых. Запрос из одной буквы («а») - худший случай: префикс раскрывается в тысячи
+слов словаря, и предел bm25 его почти не ускоряет.
+
+Замер на 100 тыс. фото, SEARCH_MAX_CANDIDATES=2000: запросы из одного слова (~4 тыс.
+совпадений) - p50 около 8 мс, из двух слов - около 3 мс, из одной буквы - около 13 мс.
+
+Запуск из каталога backend:
+    python -m benchmarks.search --rows 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import database
+import schemas
+import search
+from models.photo_model import Photo
+from models.photo_file_model import PhotoFile  # noqa: F401 - нужна для внешнего ключа photos.checksum
+from repository import PhotoRepository
+
+WORDS = (
+    "выпускной", "актовый", "зал", "последний", "звонок", "линейка", "первое", "сентября", "экскурсия",
+    "музей", "спортзал", "соревнования", "олимпиада", "концерт", "ёлка", "новогодний", "утренник",
+    "поход", "класс", "учитель", "директор", "награждение", "весна", "осень", "праздник", "субботник",
+)
+QUERIES = ("выпускного", "ёлки", "последний звонок", "экскурс музей", "спорт", "олимпиады награждение", "а")
+VOCABULARY_SIZE = 20000
+LETTERS = "абвгдежзиклмнопрстуфхцчшщэюя"
+INSERT_BATCH_SIZE = 5000
+
+
+async def _seed(engine, rows: int):
+    started = datetime(2015, 9, 1)
+    vocabulary = ["".join(random.choices(LETTERS, k=random.randint(4, 10))) for _ in range(VOCABULARY_SIZE)]
+    async with engine.begin() as conn:
+        for offset in range(0, rows, INSERT_BATCH_SIZE):
+            await conn.execute(insert(Photo), [
+                {
+                    "date": started + timedelta(days=random.randrange(3650)),
+                    "path": f"photos/{i}.jpg",
+                    "description": " ".join([random.choice(WORDS), f"{random.randint(1, 11)}А"] + random.choices(vocabulary, k=random.randint(2, 6))),
+                    "grade": random.randint(1, 11),
+                    "parallel": random.choice("АБВГ"),
+                    "created_at": started,
+                    "updated_at": started,
+                }
+                for i in range(offset, min(offset + INSERT_BATCH_SIZE, rows))
+            ])
+        await conn.exec_driver_sql("INSERT INTO photos_fts(photos_fts) VALUES ('optimize')")
+
+
+async def main(rows: int, repeat: int, limit: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = database.create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'search.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(database.Base.metadata.create_all)
+            await conn.run_sync(search.install)
+        seeding = time.perf_counter()
+        await _seed(engine, rows)
+        print(f"rows={rows}, seeded in {time.perf_counter() - seeding:.1f} s, limit={limit}")
+
+        repository = PhotoRepository()
+        columns = repository.columns_for(schemas.PhotoReadResponse)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as session:
+            for q in QUERIES:
+                match = search.build_match_query(q)
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    found = await repository.search(match, limit, session, columns)
+                    timings.append((time.perf_counter() - started) * 1000)
+                print(f"{q!r:>26} -> {match!r:<32} {len(found):>3} rows, "
+                      f"p50 {statistics.median(timings):6.2f} ms, max {max(timings):6.2f} ms")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="Количество фото в базе")
+    parser.add_argument("--repeat", type=int, default=20, help="Повторов каждого запроса")
+    parser.add_argument("--limit", type=int, default=50, help="Максимум результатов")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat, args.limit))
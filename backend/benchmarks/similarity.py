@@ -0,0 +1,64 @@
+"""
+Время поиска похожих фото по матрице векторов признаков.
+
+Матрица из N случайных векторов единичной длины создается во временном файле,
+классы и параллели раздаются случайно. Замеряются запросы без фильтра, с фильтром
+по классу и по классу и параллели.
+
+Запуск из каталога backend:
+    python -m benchmarks.similarity --photos 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import numpy as np
+
+import image_processing
+import similarity
+
+PARALLELS = "АБВГ"
+
+
+def main(photos: int, queries: int, limit: int):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((photos, image_processing.FEATURE_DIM)).astype(similarity.DTYPE)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    labels = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        matrix = similarity.FeatureMatrix(os.path.join(tmp, "features.f32"))
+        matrix.open()
+        started = time.perf_counter()
+        for photo_id in range(1, photos + 1):
+            matrix.set_labels(photo_id, labels.randint(1, 11), labels.choice(PARALLELS))
+        matrix._matrix[1:photos + 1] = vectors
+        matrix._present[1:photos + 1] = True
+        print(f"photos={photos}, matrix filled in {time.perf_counter() - started:.2f} s, limit={limit}")
+
+        probes = [labels.randint(1, photos) for _ in range(queries)]
+        for name, filters in (("no filter", {}), ("grade", {"grade": 5}), ("grade+parallel", {"grade": 5, "parallel": "Б"})):
+            timings = []
+            for photo_id in probes:
+                started = time.perf_counter()
+                matrix.query(photo_id, limit, **filters)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            print(f"{name:>15}: p50 {statistics.median(timings):.2f} ms, p99 {timings[int(len(timings) * 0.99)]:.2f} ms")
+
+        started = time.perf_counter()
+        for photo_id in probes[:100]:
+            matrix.put(photo_id, vectors[photo_id - 1])
+        print(f"put: {(time.perf_counter() - started) * 10:.3f} ms per vector")
+        matrix.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=100000, help="Количество фото в матрице")
+    parser.add_argument("--queries", type=int, default=200, help="Количество запросов на вариант фильтра")
+    parser.add_argument("--limit", type=int, default=similarity.SIMILAR_DEFAULT_LIMIT, help="Сколько похожих фото искать")
+    args = parser.parse_args()
+    main(args.photos, args.queries, args.limit)
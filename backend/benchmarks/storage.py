@@ -0,0 +1,161 @@
+"""
+Скорость записи и чтения оригиналов в разных хранилищах (storage.py).
+
+S3 заменяет заглушка в памяти процесса с интерфейсом клиента aiobotocore: каждый запрос
+ждет latency и передает тело со скоростью bandwidth, как одно соединение с сервером.
+Так видно, сколько дает параллельная загрузка частей (multipart upload) для больших
+файлов. Заодно проверяется, что прочитанные файл и диапазон совпадают с записанными.
+
+Запуск из каталога backend:
+    python -m benchmarks.storage --size-mb 64 --files 4
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import tempfile
+import time
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class StubS3Error(Exception):
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class StubBody:
+    def __init__(self, data: bytes):
+        self._data = data
+        self._offset = 0
+
+    async def read(self, size: int) -> bytes:
+        chunk = self._data[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class StubS3Client:
+    """Заглушка S3: объекты в словаре, задержка и ограничение скорости на каждый запрос."""
+
+    def __init__(self, latency: float, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.objects: dict[str, bytes] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.requests = 0
+
+    async def _transfer(self, size: int):
+        self.requests += 1
+        await asyncio.sleep(self.latency + size / self.bandwidth)
+
+    async def put_object(self, Bucket, Key, Body):
+        await self._transfer(len(Body))
+        self.objects[Key] = Body
+
+    async def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise StubS3Error("NoSuchKey")
+        data = self.objects[Key]
+        if Range:
+            first, last = Range.removeprefix("bytes=").split("-")
+            data = data[int(first):int(last) + 1 if last else None]
+        await self._transfer(len(data))
+        return {"Body": StubBody(data)}
+
+    async def head_object(self, Bucket, Key):
+        await self._transfer(0)
+        if Key not in self.objects:
+            raise StubS3Error("404")
+        return {"ContentLength": len(self.objects[Key])}
+
+    async def delete_objects(self, Bucket, Delete):
+        await self._transfer(0)
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+
+    async def create_multipart_upload(self, Bucket, Key):
+        await self._transfer(0)
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        await self._transfer(len(Body))
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{PartNumber}"'}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        await self._transfer(0)
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+
+async def _chunks(data: bytes):
+    for offset in range(0, len(data), CHUNK_SIZE):
+        yield data[offset:offset + CHUNK_SIZE]
+
+
+async def _read(backend, key: str, start: int = 0, end=None) -> bytes:
+    return b"".join([chunk async for chunk in backend.get(key, start, end)])
+
+
+async def _run(name: str, backend, files: list[bytes], root: str):
+    keys = [os.path.join(root, f"{index:02x}", f"{index}.jpg") for index in range(len(files))]
+    started = time.perf_counter()
+    for key, data in zip(keys, files):
+        await backend.put(key, _chunks(data))
+    put_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for key, data in zip(keys, files):
+        assert await _read(backend, key) == data
+    get_seconds = time.perf_counter() - started
+
+    middle = len(files[0]) // 2
+    assert await _read(backend, keys[0], middle, middle + 1000) == files[0][middle:middle + 1000]
+    assert await backend.exists(keys[0])
+    await backend.delete(*keys)
+    assert not await backend.exists(keys[0])
+    await backend.close()
+
+    total_mb = sum(len(data) for data in files) / 1024 / 1024
+    print(f"{name:<24} put {total_mb / put_seconds:8.1f} MB/s   get {total_mb / get_seconds:8.1f} MB/s")
+
+
+async def main(size_mb: int, files: int, latency_ms: float, bandwidth_mb: float, concurrency: int):
+    # Импорт после настройки PHOTOS_DIR
+    import storage
+
+    rng = random.Random(0)
+    data = [rng.randbytes(size_mb * 1024 * 1024) for _ in range(files)]
+    print(f"{files} files x {size_mb} MB; S3 stand-in: {latency_ms} ms per request, {bandwidth_mb} MB/s per connection")
+
+    await _run("memory", storage.MemoryStorage(), data, "photos")
+    await _run("local", storage.LocalStorage(), data, os.environ["PHOTOS_DIR"])
+    for parallel in sorted({1, concurrency}):
+        client = StubS3Client(latency_ms / 1000, bandwidth_mb * 1024 * 1024)
+        backend = storage.S3Storage(lambda: contextlib.nullcontext(client), "bench", concurrency=parallel)
+        await _run(f"s3 concurrency={parallel}", backend, data, "photos")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=64, help="Размер одного файла, МБ")
+    parser.add_argument("--files", type=int, default=4, help="Количество файлов")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Задержка запроса к заглушке S3")
+    parser.add_argument("--bandwidth-mb", type=float, default=100, help="Скорость одного соединения с заглушкой S3, МБ/с")
+    parser.add_argument("--concurrency", type=int, default=4, help="Параллельных частей при загрузке в S3")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["PHOTOS_DIR"] = os.path.join(tmp, "photos")
+        asyncio.run(main(args.size_mb, args.files, args.latency_ms, args.bandwidth_mb, args.concurrency))
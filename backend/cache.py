@@ -0,0 +1,209 @@
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+import metrics
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 50000))
+PHOTO_CACHE_TTL_SECONDS = int(os.getenv("PHOTO_CACHE_TTL_SECONDS", 300))
+
+
+class TTLCache:
+    """
+    In-process LRU-кэш с ограничением размера и временем жизни записей.
+    Рассчитан на использование из одного event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохраняет значение; ttl сокращает время жизни записи относительно значения по умолчанию."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class CacheBackend(ABC):
+    """Хранилище для ReadThroughCache. Значения - байты, чтобы их можно было хранить вне процесса."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float):
+        pass
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        pass
+
+
+class LocalCacheBackend(CacheBackend):
+    """Кэш в памяти процесса. При нескольких воркерах каждый видит свои данные до истечения ttl."""
+
+    def __init__(self, maxsize: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=float("inf"))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._cache.delete(key)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Общий для всех воркеров кэш. Принимает любой клиент с интерфейсом redis.asyncio
+    (get, set(name, value, px=...), delete(*names)), в том числе локальную заглушку.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(key, value, px=int(ttl * 1000))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+
+def create_backend() -> CacheBackend:
+    """Выбирает хранилище по переменным окружения CACHE_BACKEND (local | redis) и REDIS_URL."""
+    if CACHE_BACKEND == "redis":
+        import redis.asyncio
+        return RedisCacheBackend(redis.asyncio.from_url(REDIS_URL))
+    return LocalCacheBackend(maxsize=CACHE_MAX_ENTRIES)
+
+
+class ReadThroughCache:
+    """
+    Read-through кэш сериализованных значений поверх произвольного хранилища.
+    Ведет статистику попаданий; ошибки хранилища не ломают чтение, а считаются промахом.
+
+    Рядом со значением хранится версия: invalidate записывает новую, а get_or_load кладет
+    загруженное значение, только если версия не менялась с начала загрузки, и проверяет
+    ее еще раз после записи. Иначе чтение, начатое до коммита изменения, могло бы
+    положить в кэш старые данные уже после invalidate.
+    """
+
+    def __init__(self, backend: CacheBackend, namespace: str, ttl: float):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.stale_skips = 0
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _version_key(self, key: Hashable) -> str:
+        return f"{self.namespace}:version:{key}"
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[bytes]:
+        """Возвращает значение из кэша или вызывает loader и кэширует результат. None не кэшируется."""
+        try:
+            value = await self.backend.get(self._key(key))
+        except Exception:
+            self.errors += 1
+            value = None
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        try:
+            version = await self.backend.get(self._version_key(key))
+        except Exception:
+            # Без версии нельзя отличить устаревшее значение, поэтому не кэшируем
+            self.errors += 1
+            return await loader()
+        value = await loader()
+        if value is not None:
+            try:
+                await self._store(key, value, version)
+            except Exception:
+                self.errors += 1
+        return value
+
+    async def _store(self, key: Hashable, value: bytes, version: Optional[bytes]):
+        if await self.backend.get(self._version_key(key)) != version:
+            self.stale_skips += 1
+            return
+        await self.backend.set(self._key(key), value, self.ttl)
+        # invalidate между проверкой и записью: значение могло устареть, удаляем его
+        if await self.backend.get(self._version_key(key)) != version:
+            self.stale_skips += 1
+            await self.backend.delete(self._key(key))
+
+    async def invalidate(self, *keys: Hashable):
+        """Удаляет значения. Версия записывается до удаления, чтобы идущие загрузки их не вернули."""
+        if not keys:
+            return
+        try:
+            version = uuid.uuid4().hex.encode()
+            for key in keys:
+                await self.backend.set(self._version_key(key), version, self.ttl)
+            await self.backend.delete(*(self._key(key) for key in keys))
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {"namespace": self.namespace, "hits": self.hits, "misses": self.misses, "errors": self.errors,
+                "stale_skips": self.stale_skips}
+
+
+# Метаданные фото (сериализованный PhotoReadResponse) по id
+photo_cache = ReadThroughCache(create_backend(), namespace="photo", ttl=PHOTO_CACHE_TTL_SECONDS)
+metrics.register_cache("photo", photo_cache.stats)
@@ -1,15 +1,87 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import event, inspect, text
 from typing import AsyncGenerator
+import os
+import search
+import metrics
+import slow_queries
 
-# Создаем асинхронный движок для SQLite
-engine = create_async_engine('sqlite+aiosqlite:///database.db', echo=True)
+# Настройки подключения берутся из переменных окружения
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///database.db")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 8))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", 8))
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", 4))
+DB_WRITE_MAX_OVERFLOW = int(os.getenv("DB_WRITE_MAX_OVERFLOW", 0))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
 
-# Настраиваем асинхронную сессию
+# PRAGMA для SQLite, применяются к каждому новому соединению
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # WAL: читатели не ждут писателя и наоборот; режим сохраняется в файле базы
+        cursor.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL NORMAL не теряет целостность, но не делает fsync на каждый коммит
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    # Отрицательное значение - размер в KiB, а не в страницах
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def create_engine(url: str = DATABASE_URL, read_only: bool = False) -> AsyncEngine:
+    """
+    Создает асинхронный движок.
+    read_only=True - движок только для чтения с отдельным пулом соединений,
+    чтобы чтение галереи не вставало в очередь за коммитом загрузки.
+    """
+    kwargs = {}
+    if ":memory:" not in url:
+        kwargs.update(
+            pool_size=DB_READ_POOL_SIZE if read_only else DB_WRITE_POOL_SIZE,
+            max_overflow=DB_READ_MAX_OVERFLOW if read_only else DB_WRITE_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    engine = create_async_engine(url, **kwargs)
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", lambda conn, record: _set_sqlite_pragmas(conn, record, read_only))
+    metrics.instrument_engine(engine, "read" if read_only else "write")
+    # Вместо echo: в лог попадают только медленные запросы, с планом выполнения
+    slow_queries.instrument_engine(engine)
+    return engine
+
+
+if ":memory:" in DATABASE_URL:
+    # База :memory: своя у каждого движка и у каждого соединения, а чтение, запись и фоновые
+    # задачи идут через разные соединения: приложению нужна база в файле
+    raise RuntimeError("In-memory SQLite is not supported: set DATABASE_URL to a database file")
+
+# Движок для записи и отдельный движок только для чтения
+engine = create_engine()
+read_engine = create_engine(read_only=True)
+
+# Настраиваем асинхронные сессии
 async_session = sessionmaker(
-    engine, 
-    class_=AsyncSession, 
+    engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autocommit=False,
+    autoflush=False,
+)
+
+async_read_session = sessionmaker(
+    read_engine,
+    class_=AsyncSession,
     expire_on_commit=False,
     autocommit=False,
     autoflush=False,
@@ -20,9 +92,40 @@ Base = declarative_base()
 
 #import models
 
+def _migrate(sync_conn):
+    """
+    Простая миграция существующей базы: create_all не трогает уже созданные таблицы,
+    поэтому недостающие колонки и индексы добавляем вручную.
+    """
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(sync_conn.dialect)
+                sync_conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate)
+        await conn.run_sync(search.install)
+
+async def dispose_engines():
+    await engine.dispose()
+    await read_engine.dispose()
+
+async def begin_write(session: AsyncSession):
+    """
+    Начинает транзакцию сразу с блокировкой записи (BEGIN IMMEDIATE в SQLite).
+    Вызывается первым запросом в сессии перед чтением, от которого зависит запись:
+    драйвер открывает транзакцию только перед изменением данных, и без этого SELECT
+    может увидеть строки, которые другой запрос меняет до нашего UPDATE.
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        await session.execute(text("BEGIN IMMEDIATE"))
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
@@ -35,9 +138,27 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     finally:
         await session.close()
 
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Зависимость для получения сессии только для чтения.
+    Используется в маршрутах, которые ничего не меняют в базе.
+    """
+    session = async_read_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
 async def get_db_session() -> AsyncSession:
     """
     Функция для прямого получения сессии базы данных.
     Для использования в сервисах без Depends.
     """
-    return async_session()
\ No newline at end of file
+    return async_session()
+
+async def get_db_read_session() -> AsyncSession:
+    """
+    Функция для прямого получения сессии только для чтения.
+    Для использования в сервисах без Depends.
+    """
+    return async_read_session()
@@ -0,0 +1,37 @@
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
+import auth_utils
+from database import get_read_session
+from schemas import UserPrincipal
+from models.user_model import UserRoles
+from service import UserService
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(auth_utils.bearer_scheme),
+                           session: AsyncSession = Depends(get_read_session)) -> UserPrincipal:
+    """
+    Зависимость, возвращающая пользователя по access-токену.
+    В обычном случае не требует ни проверки подписи, ни запроса к базе: оба результата кэшируются
+    до истечения токена и сбрасываются при изменении, удалении пользователя или выходе.
+    """
+    payload = auth_utils.decode_token(credentials.credentials, token_type="access")
+    email = payload["sub"]
+    principal = auth_utils.get_cached_principal(email)
+    if principal is None:
+        generation = auth_utils.principal_generation()
+        user = await UserService().get_user_by_email(email, session=session)
+        if not user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        principal = UserPrincipal.model_validate(user)
+        auth_utils.cache_principal(principal, expires_at=payload["exp"], generation=generation)
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    return principal
+
+
+async def get_current_admin(user: UserPrincipal = Depends(get_current_user)) -> UserPrincipal:
+    """Зависимость для административных маршрутов: пользователь с ролью admin."""
+    if user.role != UserRoles.admin.value:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return user
@@ -0,0 +1,194 @@
+"""
+Фоновая генерация превью для фото.
+Генерация выполняется задачей очереди (см. tasks.py), декодирование изображений -
+в ProcessPoolExecutor, чтобы не занимать event loop и GIL API-процесса.
+
+Досоздание превью для уже загруженных фото:
+    python derivatives.py backfill
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from sqlalchemy import select, update
+from PIL import UnidentifiedImageError
+
+import image_processing
+import storage
+import tasks
+import uploads
+from cache import photo_cache
+from database import get_db_session, get_db_read_session
+from models.photo_model import Photo
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = os.path.join(uploads.PHOTOS_DIR, "derivatives")
+# Имя превью -> максимальная сторона в пикселях
+DERIVATIVE_SIZES = {"thumbnail": 256, "preview": 1024}
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+BACKFILL_BATCH_SIZE = 100
+TASK_KIND = "derivatives"
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: fork процесса с потоками aiosqlite и работающим event loop небезопасен
+        _executor = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def derivative_key(photo_id: int, checksum: Optional[str]) -> str:
+    """
+    Имя, под которым хранятся превью. Фото с одним файлом делят превью по checksum;
+    у фото, загруженных до появления photo_files (без checksum), превью свои, по id.
+    """
+    return checksum or f"photo-{photo_id}"
+
+
+def derivative_path(key: str, name: str) -> str:
+    """Путь к превью в разложенной по подкаталогам структуре, как у оригиналов (uploads.sharded_path)."""
+    return uploads.sharded_path(f"{key}_{DERIVATIVE_SIZES[name]}.webp", DERIVATIVES_DIR)
+
+
+def _resolve_all(*paths: str) -> Optional[list[str]]:
+    """Пути к существующим превью (с учетом переноса, см. uploads.resolve_path) или None, если какого-то нет."""
+    resolved = [uploads.resolve_path(path) for path in paths]
+    return resolved if all(os.path.exists(path) for path in resolved) else None
+
+
+async def _read_photo(photo_id: int):
+    """Строка фото и готовые превью другой строки с тем же файлом (None, если их нет)."""
+    session = await get_db_read_session()
+    try:
+        result = await session.execute(select(Photo.id, Photo.path, Photo.checksum).where(Photo.id == photo_id))
+        photo = result.first()
+        existing = None
+        if photo and photo.checksum:
+            # Для дубликата превью уже есть у другой строки с тем же файлом
+            result = await session.execute(
+                select(Photo.thumbnail_path, Photo.preview_path, Photo.placeholder)
+                .where(Photo.checksum == photo.checksum, Photo.placeholder.is_not(None))
+                .limit(1)
+            )
+            existing = result.first()
+        return photo, existing
+    finally:
+        await session.close()
+
+
+async def generate_for_photo(photo_id: int):
+    """
+    Строит превью для фото и сохраняет пути к ним в строке photos.
+    Соединение с базой на время построения превью не держится: строка читается короткой
+    сессией чтения, а пути записываются отдельной короткой транзакцией.
+    Ошибки пробрасываются: очередь задач повторит попытку или пометит задачу неуспешной.
+    """
+    photo, existing = await _read_photo(photo_id)
+    if not photo:
+        # Фото удалили, пока задача ждала в очереди
+        return
+
+    existing_paths = existing and await asyncio.to_thread(_resolve_all, existing.thumbnail_path, existing.preview_path)
+    if existing_paths:
+        rendered = {"thumbnail": existing_paths[0], "preview": existing_paths[1], "placeholder": existing.placeholder}
+    else:
+        key = derivative_key(photo.id, photo.checksum)
+        targets = {name: (derivative_path(key, name), size) for name, size in DERIVATIVE_SIZES.items()}
+        await asyncio.to_thread(os.makedirs, os.path.dirname(targets["thumbnail"][0]), exist_ok=True)
+        loop = asyncio.get_running_loop()
+        async with storage.local_file(photo.path) as source:
+            rendered = await loop.run_in_executor(get_executor(), image_processing.render_derivatives, source, targets)
+
+    session = await get_db_session()
+    try:
+        # UPDATE по id: фото могли удалить, пока строились превью
+        await session.execute(
+            update(Photo)
+            .where(Photo.id == photo_id)
+            .values(thumbnail_path=rendered["thumbnail"], preview_path=rendered["preview"], placeholder=rendered["placeholder"])
+        )
+        await session.commit()
+    finally:
+        await session.close()
+    await photo_cache.invalidate(photo_id)
+
+
+@tasks.handler(TASK_KIND)
+async def run_task(payload: dict):
+    try:
+        await generate_for_photo(payload["photo_id"])
+    except (FileNotFoundError, UnidentifiedImageError) as e:
+        # Pillow умеет не все RAW-форматы: фото остается без превью, клиент использует оригинал
+        raise tasks.PermanentTaskError(str(e)) from e
+
+
+def paths_for_key(key: str) -> list[str]:
+    """Все возможные пути к превью, включая старую плоскую структуру: их могли еще не перенести."""
+    paths = [derivative_path(key, name) for name in DERIVATIVE_SIZES]
+    return paths + [uploads.other_layout_path(path) for path in paths]
+
+
+async def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+async def backfill(batch_size: int = BACKFILL_BATCH_SIZE):
+    """
+    Генерирует превью для всех фото, у которых их еще нет. Возвращает число фото,
+    которые обработать не удалось: они перечислены в логе.
+    """
+    last_id = 0
+    processed = 0
+    failed = 0
+    # Одновременно строится столько превью, сколько процессов в пуле; остальные фото пачки
+    # ждут здесь, а не в очереди пула, и соединения с базой не занимают
+    semaphore = asyncio.Semaphore(DERIVATIVE_WORKERS)
+
+    async def generate(photo_id: int):
+        async with semaphore:
+            await generate_for_photo(photo_id)
+
+    while True:
+        session = await get_db_session()
+        try:
+            result = await session.execute(
+                select(Photo.id)
+                .where(Photo.id > last_id, Photo.placeholder.is_(None))
+                .order_by(Photo.id)
+                .limit(batch_size)
+            )
+            ids = result.scalars().all()
+        finally:
+            await session.close()
+        if not ids:
+            break
+        # Пачка обрабатывается параллельно всеми процессами пула
+        results = await asyncio.gather(*(generate(photo_id) for photo_id in ids), return_exceptions=True)
+        for photo_id, result in zip(ids, results):
+            if isinstance(result, Exception):
+                failed += 1
+                logger.error("Failed to generate derivatives for photo %s: %s", photo_id, result)
+        last_id = ids[-1]
+        processed += len(ids)
+        print(f"Processed {processed} photos, {failed} failed")
+    await shutdown()
+    return failed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python derivatives.py backfill")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    if asyncio.run(backfill()):
+        sys.exit(1)
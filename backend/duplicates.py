@@ -0,0 +1,202 @@
+"""
+Поиск почти одинаковых фото (пересохраненных, уменьшенных, пересжатых) по перцептивному хэшу.
+
+Хэши всех фото держатся в памяти процесса в индексе с несколькими хэш-таблицами
+(multi-index hashing): 64 бита делятся на INDEX_CHUNKS частей, и если расстояние
+Хэмминга между хэшами не больше r, то хотя бы одна часть отличается не больше чем
+на r // INDEX_CHUNKS бит. Поэтому кандидаты берутся из нескольких таблиц по ключам
+в малом радиусе, а точное расстояние считается только для них. На 100 тысячах фото
+поиск с радиусом по умолчанию занимает около 0.1 мс (python -m benchmarks.duplicates).
+
+Индекс строится из базы при старте приложения и обновляется после коммита загрузки
+и удаления. Хэши для фото, загруженных до появления колонки phash:
+    python duplicates.py backfill
+"""
+import asyncio
+import logging
+import os
+import sys
+from itertools import combinations
+from typing import Iterable, Optional
+from sqlalchemy import select, update
+
+import derivatives
+import image_processing
+import storage
+from database import get_db_session, get_db_read_session
+from models.photo_model import Photo
+
+logger = logging.getLogger(__name__)
+
+# off - не проверять при загрузке, flag - загрузить и вернуть найденные дубликаты, reject - отклонить загрузку (409)
+NEAR_DUPLICATE_POLICY = os.getenv("NEAR_DUPLICATE_POLICY", "flag").lower()
+# Максимальное расстояние Хэмминга между хэшами почти одинаковых фото
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", 6))
+HASH_BITS = image_processing.DHASH_SIZE ** 2
+INDEX_CHUNKS = 4
+# Наибольшее расстояние, которое можно запросить в API: с 12 бит радиус поиска в каждой
+# части ключа становится 3 и число проверяемых ключей растет в пять раз
+MAX_DUPLICATE_DISTANCE = 3 * INDEX_CHUNKS - 1
+CHUNK_BITS = HASH_BITS // INDEX_CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+LOAD_BATCH_SIZE = 10000
+BACKFILL_BATCH_SIZE = 100
+
+
+def to_db(value: int) -> int:
+    """Беззнаковый 64-битный хэш в знаковое число для INTEGER SQLite."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_db(value: int) -> int:
+    return value & ((1 << HASH_BITS) - 1)
+
+
+class HashIndex:
+    """Индекс хэшей фото для поиска в радиусе Хэмминга. Меняется только из потока event loop."""
+
+    def __init__(self):
+        self._hashes: dict[int, int] = {}
+        self._tables: list[dict[int, set[int]]] = [{} for _ in range(INDEX_CHUNKS)]
+        # Маски изменений части ключа по радиусу, считаются один раз
+        self._flips: dict[int, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _chunks(self, value: int) -> Iterable[tuple[int, int]]:
+        for number in range(INDEX_CHUNKS):
+            yield number, (value >> (number * CHUNK_BITS)) & CHUNK_MASK
+
+    def _flip_masks(self, radius: int) -> list[int]:
+        masks = self._flips.get(radius)
+        if masks is None:
+            masks = [sum(1 << bit for bit in bits) for count in range(radius + 1) for bits in combinations(range(CHUNK_BITS), count)]
+            self._flips[radius] = masks
+        return masks
+
+    def get(self, photo_id: int) -> Optional[int]:
+        return self._hashes.get(photo_id)
+
+    def add(self, photo_id: int, value: int):
+        self.remove(photo_id)
+        self._hashes[photo_id] = value
+        for number, key in self._chunks(value):
+            self._tables[number].setdefault(key, set()).add(photo_id)
+
+    def remove(self, photo_id: int):
+        value = self._hashes.pop(photo_id, None)
+        if value is None:
+            return
+        for number, key in self._chunks(value):
+            bucket = self._tables[number][key]
+            bucket.discard(photo_id)
+            if not bucket:
+                del self._tables[number][key]
+
+    def clear(self):
+        self._hashes.clear()
+        for table in self._tables:
+            table.clear()
+
+    def query(self, value: int, max_distance: int = NEAR_DUPLICATE_DISTANCE) -> list[tuple[int, int]]:
+        """(id фото, расстояние) для хэшей не дальше max_distance, от ближайших."""
+        masks = self._flip_masks(max_distance // INDEX_CHUNKS)
+        candidates = set()
+        for number, key in self._chunks(value):
+            table = self._tables[number]
+            for mask in masks:
+                bucket = table.get(key ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for photo_id in candidates:
+            distance = (self._hashes[photo_id] ^ value).bit_count()
+            if distance <= max_distance:
+                found.append((photo_id, distance))
+        found.sort(key=lambda item: (item[1], item[0]))
+        return found
+
+
+index = HashIndex()
+
+
+async def load():
+    """Строит индекс заново по колонке photos.phash (при старте приложения)."""
+    index.clear()
+    last_id = 0
+    session = await get_db_read_session()
+    try:
+        while True:
+            result = await session.execute(
+                select(Photo.id, Photo.phash)
+                .where(Photo.id > last_id, Photo.phash.is_not(None))
+                .order_by(Photo.id)
+                .limit(LOAD_BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            for photo_id, value in rows:
+                index.add(photo_id, from_db(value))
+            last_id = rows[-1].id
+    finally:
+        await session.close()
+    logger.info("Loaded %s perceptual hashes", len(index))
+
+
+async def compute(path: str) -> Optional[int]:
+    """Хэш файла в пуле процессов превью; None, если Pillow не может прочитать файл (например, RAW)."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(derivatives.get_executor(), image_processing.perceptual_hash, path)
+    except Exception as e:
+        logger.warning("Cannot compute perceptual hash for %s: %s", path, e)
+        return None
+
+
+async def compute_stored(path: str) -> Optional[int]:
+    """Хэш оригинала фото по его пути в хранилище."""
+    try:
+        async with storage.local_file(path) as local_path:
+            return await compute(local_path)
+    except FileNotFoundError:
+        logger.warning("Photo file %s is missing", path)
+        return None
+
+
+async def backfill(batch_size: int = BACKFILL_BATCH_SIZE):
+    """Вычисляет хэши для всех фото, у которых их еще нет."""
+    last_id = 0
+    processed = 0
+    while True:
+        session = await get_db_session()
+        try:
+            result = await session.execute(
+                select(Photo.id, Photo.path)
+                .where(Photo.id > last_id, Photo.phash.is_(None))
+                .order_by(Photo.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            values = await asyncio.gather(*(compute_stored(row.path) for row in rows))
+            for row, value in zip(rows, values):
+                if value is not None:
+                    await session.execute(update(Photo).where(Photo.id == row.id).values(phash=to_db(value)))
+            await session.commit()
+        finally:
+            await session.close()
+        last_id = rows[-1].id
+        processed += len(rows)
+        print(f"Processed {processed} photos")
+    await derivatives.shutdown()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python duplicates.py backfill")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(backfill())
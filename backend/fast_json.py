@@ -0,0 +1,49 @@
+"""
+Быстрая сериализация JSON.
+Используется orjson, если он установлен; иначе - стандартный json с тем же форматом вывода.
+"""
+import enum
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Optional, Sequence
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        # Наивные datetime orjson выводит так же, как pydantic: без часового пояса
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """Класс ответа по умолчанию для приложения: тот же application/json, но быстрее кодирует."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def rows_to_dicts(rows: Sequence, extra: Optional[Callable[[dict], dict]] = None) -> list[dict]:
+    """
+    Строки выборки по колонкам (Row) в словари для ответа.
+    Данные из базы уже проверены при записи, поэтому повторно через pydantic не проходят;
+    extra добавляет вычисляемые поля схемы ответа.
+    """
+    items = [row._asdict() for row in rows]
+    if extra is not None:
+        for item in items:
+            item.update(extra(item))
+    return items
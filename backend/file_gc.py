@@ -0,0 +1,75 @@
+"""
+Удаление файлов фото, на которые больше нет ссылок: оригиналов в хранилище и превью.
+
+Удаление фото только ставит задачу очереди (в той же транзакции, что и DELETE), а файлы
+удаляет обработчик задачи. Он берет блокировку записи (database.begin_write), еще раз
+проверяет, что на путь не ссылаются ни photo_files, ни photos, и удаляет файлы, не отпуская
+блокировку. Загрузка того же содержимого (PhotoService._place_file) проверяет наличие
+файла после acquire под той же блокировкой, поэтому файл, загруженный заново между
+удалением фото и сборкой, не теряется: либо сборка видит новую строку photo_files
+и пропускает файл, либо загрузка видит, что файла нет, и записывает его снова.
+"""
+from typing import Optional, Sequence
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import derivatives
+import storage
+import tasks
+import uploads
+from database import begin_write, get_db_session
+from models.photo_file_model import PhotoFile
+from models.photo_model import Photo
+from repository import RELEASE_BATCH_SIZE
+
+TASK_KIND = "file_gc"
+
+
+def enqueue(session: AsyncSession, files: Sequence[tuple[int, Optional[str], str]]):
+    """
+    Ставит в сессию задачу удаления файлов. files - (id фото, checksum или None, путь)
+    для файлов, с которых в этой транзакции снята последняя ссылка.
+    """
+    if files:
+        tasks.enqueue(session, TASK_KIND, {"files": [list(item) for item in files]})
+
+
+async def _referenced(session: AsyncSession, column, values: list) -> set:
+    found = set()
+    for start in range(0, len(values), RELEASE_BATCH_SIZE):
+        result = await session.execute(select(column).where(column.in_(values[start:start + RELEASE_BATCH_SIZE])))
+        found.update(result.scalars())
+    return found
+
+
+@tasks.handler(TASK_KIND)
+async def collect(payload: dict):
+    await remove_unreferenced([tuple(item) for item in payload["files"]])
+
+
+async def remove_unreferenced(files: Sequence[tuple[int, Optional[str], str]]):
+    """
+    Удаляет файлы (id фото, checksum, путь), на которые не ссылается ни одна строка.
+    Вызывается и напрямую: загрузка, откатившая транзакцию, убирает записанный ею файл.
+    """
+    session = await get_db_session()
+    try:
+        await begin_write(session)
+        paths = list({path for _, _, path in files})
+        checksums = list({checksum for _, checksum, _ in files if checksum})
+        referenced_paths = await _referenced(session, PhotoFile.path, paths) | await _referenced(session, Photo.path, paths)
+        referenced_checksums = await _referenced(session, PhotoFile.checksum, checksums)
+
+        orphan_paths = [path for path in paths if path not in referenced_paths]
+        # Превью общие для всех фото с тем же содержимым: пока есть строка photo_files, они нужны
+        derivative_paths = [
+            path
+            for photo_id, checksum, _ in files if checksum not in referenced_checksums
+            for path in derivatives.paths_for_key(derivatives.derivative_key(photo_id, checksum))
+        ]
+        if orphan_paths:
+            await storage.backend.delete(*orphan_paths)
+        await uploads.discard_files(derivative_paths)
+        await session.commit()
+    finally:
+        await session.close()
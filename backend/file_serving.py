@@ -0,0 +1,130 @@
+"""
+Отдача файлов фото с поддержкой условных запросов и HTTP Range.
+Для файлов на локальном диске Range, If-Range и zero-copy отправку (расширение ASGI
+http.response.pathsend, если сервер его поддерживает) обеспечивает FileResponse из Starlette.
+Из остальных хранилищ (storage.py) файл отдается потоком, поддерживается один диапазон.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+import storage
+import uploads
+
+# Содержимое файла фото не меняется, поэтому кэшируем его у клиента надолго
+CACHE_CONTROL = os.getenv("PHOTO_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".tiff": "image/tiff",
+    ".webp": "image/webp",
+    ".raw": "application/octet-stream",
+}
+
+
+def _http_date(value: datetime) -> str:
+    # SQLite не хранит часовой пояс, все даты в базе в UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match использует слабое сравнение
+    candidates = (candidate.strip().removeprefix("W/") for candidate in if_none_match.split(","))
+    return etag in candidates
+
+
+def _not_modified(request: Request, etag: Optional[str], last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag is not None and _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        modified = last_modified if last_modified.tzinfo else last_modified.replace(tzinfo=timezone.utc)
+        return modified.replace(microsecond=0) <= since
+    return False
+
+
+async def photo_file_response(request: Request, path: str, etag: Optional[str], last_modified: datetime) -> Response:
+    """
+    Отдает файл с диска.
+    etag - сильный валидатор (в кавычках) или None, тогда Starlette построит его по stat файла.
+    """
+    headers = {"cache-control": CACHE_CONTROL, "last-modified": _http_date(last_modified)}
+    if etag:
+        headers["etag"] = etag
+    if _not_modified(request, etag, last_modified):
+        # 304 не требует обращения к диску
+        return Response(status_code=304, headers=headers)
+    # Превью могли перенести в другую структуру каталогов (migrate_storage.py)
+    path = await asyncio.to_thread(uploads.resolve_path, path)
+    if not await asyncio.to_thread(os.path.isfile, path):
+        raise HTTPException(status_code=404, detail="File not found")
+    _, extension = os.path.splitext(path)
+    return FileResponse(path, media_type=MEDIA_TYPES.get(extension.lower()), headers=headers)
+
+
+def _byte_range(request: Request, size: int, etag: Optional[str], last_modified: datetime) -> Optional[tuple[int, int]]:
+    """
+    Диапазон [start, end) из заголовка Range; None - отдать файл целиком
+    (нет заголовка, несколько диапазонов, If-Range не совпал).
+    """
+    header = request.headers.get("range", "")
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range != etag and if_range != _http_date(last_modified):
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            # bytes=-N: последние N байт
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"content-range": f"bytes */{size}"})
+    return start, end
+
+
+async def stored_file_response(request: Request, key: str, etag: Optional[str], last_modified: datetime) -> Response:
+    """Отдает оригинал фото из хранилища storage.backend."""
+    path = await storage.backend.local_path(key)
+    if path is not None:
+        return await photo_file_response(request, path, etag, last_modified)
+
+    headers = {"cache-control": CACHE_CONTROL, "last-modified": _http_date(last_modified), "accept-ranges": "bytes"}
+    if etag:
+        headers["etag"] = etag
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    size = await storage.backend.size(key)
+    if size is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    status_code, start, end = 200, 0, size
+    byte_range = _byte_range(request, size, etag, last_modified)
+    if byte_range is not None:
+        status_code, (start, end) = 206, byte_range
+        headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["content-length"] = str(end - start)
+    _, extension = os.path.splitext(key)
+    return StreamingResponse(storage.backend.get(key, start, end), status_code=status_code,
+                             media_type=MEDIA_TYPES.get(extension.lower()), headers=headers)
@@ -0,0 +1,176 @@
+"""
+Обработка изображений. Функции модуля выполняются в дочерних процессах
+ProcessPoolExecutor, поэтому модуль не импортирует ничего, кроме Pillow.
+"""
+import base64
+import io
+import math
+import os
+import uuid
+from array import array
+from datetime import datetime
+from typing import Optional
+from PIL import Image, ImageFilter, ImageOps
+
+PLACEHOLDER_SIZE = 16
+WEBP_QUALITY = 80
+
+# Теги EXIF
+EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+TAG_DATETIME = 0x0132
+TAG_ORIENTATION = 0x0112
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+# dHash: сравниваются соседние пиксели уменьшенной до (DHASH_SIZE + 1) x DHASH_SIZE копии, DHASH_SIZE ** 2 бит
+DHASH_SIZE = 8
+# Вектор признаков для поиска похожих фото: гистограмма цветов FEATURE_COLOR_BINS ** 3
+# и уменьшенная до FEATURE_LAYOUT_SIZE x FEATURE_LAYOUT_SIZE копия в оттенках серого
+FEATURE_COLOR_BINS = 4
+FEATURE_LAYOUT_SIZE = 8
+FEATURE_DIM = FEATURE_COLOR_BINS ** 3 + FEATURE_LAYOUT_SIZE ** 2
+FEATURE_SAMPLE_SIZE = 32
+# Ориентации 5-8 - поворот на 90 градусов: ширина и высота при показе меняются местами
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def _save_webp(image: Image.Image, path: str):
+    # Пишем во временный файл рядом и переименовываем, чтобы не отдать недописанную превью
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=4)
+    os.replace(tmp_path, path)
+
+
+def render_derivatives(source_path: str, targets: dict[str, tuple[str, int]]) -> dict[str, str]:
+    """
+    Строит уменьшенные копии фото и размытую заглушку.
+    targets: {имя: (путь к webp, максимальная сторона)}.
+    Возвращает {имя: путь} и data URI заглушки под ключом "placeholder".
+    """
+    largest = max(size for _, size in targets.values())
+    with Image.open(source_path) as image:
+        # Для JPEG декодер сразу уменьшает картинку в 2-8 раз, это в разы быстрее полного декодирования
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+
+        result = {}
+        for name, (path, size) in sorted(targets.items(), key=lambda item: -item[1][1]):
+            if not os.path.exists(path):
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                _save_webp(image, path)
+            result[name] = path
+
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BILINEAR)
+        placeholder = image.filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        placeholder.save(buffer, "WEBP", quality=30)
+        result["placeholder"] = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+    return result
+
+
+def _exif_text(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    if not isinstance(value, str):
+        return None
+    # Строки EXIF часто дополнены нулями и пробелами до фиксированной длины
+    value = value.strip("\x00 ").strip()
+    return value or None
+
+
+def _exif_datetime(value) -> Optional[datetime]:
+    value = _exif_text(value)
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value[:19], EXIF_DATETIME_FORMAT)
+    except ValueError:
+        # Нулевые даты ("0000:00:00 00:00:00") и нестандартные форматы камер
+        return None
+
+
+def read_metadata(source_path: str) -> dict:
+    """
+    Метаданные фото из EXIF: время съемки, размеры с учетом ориентации, ориентация, камера.
+    Декодирования пикселей не требуется - читается только заголовок файла.
+    """
+    with Image.open(source_path) as image:
+        width, height = image.size
+        exif = image.getexif()
+        exif_ifd = exif.get_ifd(EXIF_IFD)
+
+    taken_at = None
+    for value in (exif_ifd.get(TAG_DATETIME_ORIGINAL), exif_ifd.get(TAG_DATETIME_DIGITIZED), exif.get(TAG_DATETIME)):
+        taken_at = _exif_datetime(value)
+        if taken_at is not None:
+            break
+
+    orientation = exif.get(TAG_ORIENTATION)
+    if not isinstance(orientation, int) or not 1 <= orientation <= 8:
+        orientation = None
+    if orientation in ROTATED_ORIENTATIONS:
+        width, height = height, width
+
+    return {
+        "taken_at": taken_at,
+        "width": width,
+        "height": height,
+        "orientation": orientation,
+        "camera_make": _exif_text(exif.get(TAG_MAKE)),
+        "camera_model": _exif_text(exif.get(TAG_MODEL)),
+    }
+
+
+def perceptual_hash(source_path: str) -> int:
+    """
+    Перцептивный хэш (dHash) фото: 64-битное число, которое почти не меняется при
+    пересжатии, изменении размера и повороте по EXIF. Близость - расстояние Хэмминга.
+    """
+    with Image.open(source_path) as image:
+        image.draft("L", (DHASH_SIZE * 4, DHASH_SIZE * 4))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.Resampling.BOX)
+    pixels = image.tobytes()
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for col in range(DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _unit(values: list[float]) -> list[float]:
+    norm = math.sqrt(sum(value * value for value in values))
+    return [value / norm for value in values] if norm else values
+
+
+def feature_vector(source_path: str) -> bytes:
+    """
+    Вектор признаков фото длины FEATURE_DIM (float32, в байтах) для поиска похожих.
+    Обе части нормированы и взяты с равным весом, длина вектора - 1: скалярное
+    произведение двух векторов - косинусная близость.
+    """
+    with Image.open(source_path) as image:
+        image.draft("RGB", (FEATURE_SAMPLE_SIZE * 2, FEATURE_SAMPLE_SIZE * 2))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB").resize((FEATURE_SAMPLE_SIZE, FEATURE_SAMPLE_SIZE), Image.Resampling.BOX)
+
+    step = 256 // FEATURE_COLOR_BINS
+    histogram = [0.0] * FEATURE_COLOR_BINS ** 3
+    pixels = image.tobytes()
+    for offset in range(0, len(pixels), 3):
+        r, g, b = pixels[offset] // step, pixels[offset + 1] // step, pixels[offset + 2] // step
+        histogram[(r * FEATURE_COLOR_BINS + g) * FEATURE_COLOR_BINS + b] += 1
+    # Корень из долей (расстояние Хеллингера): крупные области одного цвета не забивают остальные
+    histogram = _unit([math.sqrt(count) for count in histogram])
+
+    layout = list(image.convert("L").resize((FEATURE_LAYOUT_SIZE, FEATURE_LAYOUT_SIZE), Image.Resampling.BOX).tobytes())
+    mean = sum(layout) / len(layout)
+    layout = _unit([value - mean for value in layout])
+
+    weight = 1 / math.sqrt(2)
+    return array("f", [value * weight for value in histogram + layout]).tobytes()
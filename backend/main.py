@@ -1,22 +1,40 @@
 from contextlib import asynccontextmanager
 from typing import List
-from fastapi import FastAPI, Path, Depends, HTTPException
+from fastapi import FastAPI, Path, Depends, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 import service as service_module
 import uvicorn
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import init_db, get_db_session
+from database import init_db, dispose_engines, get_db_session
+import derivatives
+import duplicates
+import photo_stats
+import similarity
+import storage
+import tasks
+from fast_json import FastJSONResponse
+import metrics
 import schemas as schemas
 from routers.users_routes import users_router
 from routers.auth_routes import router as auth_router
 from routers.photos_routes import photos_router
+from routers.admin_routes import admin_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await photo_stats.install()
+    await duplicates.load()
+    await similarity.load()
+    tasks.start()
     yield
+    await tasks.stop()
+    similarity.matrix.close()
+    await derivatives.shutdown()
+    await storage.backend.close()
+    await dispose_engines()
 
 app = FastAPI(
     title="MemoryGallery API",
@@ -25,6 +43,7 @@ app = FastAPI(
     openapi_url="/api/v1/openapi.json",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
@@ -42,9 +61,18 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Снаружи CORS, чтобы время ответа включало всю обработку
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(users_router)
 app.include_router(auth_router)
 app.include_router(photos_router)
+app.include_router(admin_router)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/", tags=["Root"])
 async def root():
@@ -0,0 +1,238 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Все счетчики меняются только из потока event loop (обработчики событий SQLAlchemy
+тоже выполняются в нем - внутри greenlet, который наследует contextvars запроса),
+поэтому обновление - обычная арифметика без блокировок.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Optional
+from sqlalchemy import event
+
+# Границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Количество SQL-запросов на HTTP-запрос
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels_text(self.labels, key)} {_format(value)}" for key, value in self._values.items()]
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class CallbackGauge:
+    """Значения снимаются в момент отдачи метрик: callback возвращает {значения меток: число}."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], callback: Callable[[], dict]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_labels_text(self.labels, key)} {_format(value)}" for key, value in self.callback().items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # По ключу меток: [счетчики по корзинам (последняя - +Inf), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        item = self._values.get(label_values)
+        if item is None:
+            item = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _labels_text(self.labels + ("le",), key + (_format(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {_format(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response is fully sent", ("method", "route")))
+http_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being processed"))
+http_in_flight.inc(amount=0)
+db_queries_per_request = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", ("route",), QUERY_COUNT_BUCKETS))
+db_time_per_request = registry.register(Histogram(
+    "db_time_per_request_seconds", "Total SQL execution time per HTTP request", ("route",)))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ("engine",), QUERY_BUCKETS))
+upload_bytes = registry.register(Counter(
+    "photo_upload_bytes_total", "Bytes of photo files received and written to disk"))
+upload_duration = registry.register(Histogram(
+    "photo_upload_duration_seconds", "Photo upload processing time", ("mode",), UPLOAD_BUCKETS))
+task_runs = registry.register(Counter(
+    "background_task_runs_total", "Background task executions by outcome (completed, retried, failed)", ("kind", "outcome")))
+
+
+@dataclass
+class RequestStats:
+    scope: dict
+    queries: int = 0
+    db_time: float = 0.0
+
+
+# Статистика текущего HTTP-запроса; объект изменяемый, поэтому виден и из копий контекста
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine, name: str):
+    """Подключает к движку подсчет SQL-запросов и их длительности."""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        db_query_duration.observe(elapsed, name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("metrics_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", handle_error)
+
+
+def _route(scope: dict) -> Optional[str]:
+    return getattr(scope.get("route"), "path", None)
+
+
+def current_route() -> Optional[str]:
+    """Шаблон пути маршрута, обрабатывающего текущий запрос."""
+    stats = _request_stats.get()
+    return _route(stats.scope) if stats is not None else None
+
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Экспортирует счетчики кэша (hits, misses, errors, size) из его метода stats."""
+    registry.register(CallbackGauge(
+        f"cache_{name}", f"Statistics of the {name} cache", ("stat",),
+        lambda: {(key,): value for key, value in stats().items() if isinstance(value, (int, float))},
+    ))
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: время ответа, коды статуса, запросы в обработке и SQL на запрос.
+    Маршрут берется из шаблона пути (/photos/{photo_id}), чтобы число рядов не росло с данными.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_stats.reset(token)
+            route = _route(scope) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method, route, status_code)
+            http_request_duration.observe(elapsed, method, route)
+            db_queries_per_request.observe(stats.queries, route)
+            db_time_per_request.observe(stats.db_time, route)
@@ -0,0 +1,234 @@
+"""
+Перенос файлов фото из плоского каталога PHOTOS_DIR в структуру с подкаталогами
+(photos/ab/cd/<checksum>.jpg, см. uploads.sharded_path). Превью так же переносятся
+из photos/derivatives в photos/derivatives/ab/cd.
+
+Файлы переносятся пачками. Для каждой пачки:
+    1. на новом месте создается жесткая ссылка на файл (или копия, если ссылки не поддерживаются);
+    2. в одной транзакции меняются пути в photo_files и photos;
+    3. после коммита удаляется старый файл.
+Поэтому в любой момент файл доступен хотя бы по одному пути, а пути, прочитанные до
+коммита (например, из кэша фото), находит uploads.resolve_path. Приложение может работать
+во время переноса. Перенос можно прервать и запустить заново: уже перенесенные строки
+пропускаются, а ссылки, созданные до прерывания, используются повторно.
+
+    python migrate_storage.py [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+from sqlalchemy import or_, select, update
+
+import derivatives
+import storage
+import uploads
+from database import get_db_session, get_db_read_session
+from models.photo_file_model import PhotoFile
+from models.photo_model import Photo
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 500
+
+
+def _link(old: str, new: str) -> bool:
+    """Делает файл доступным по новому пути. False - исходного файла нет."""
+    if os.path.exists(new):
+        # Ссылка осталась от прерванного запуска: файлы адресуются по содержимому
+        return True
+    if not os.path.exists(old):
+        return False
+    os.makedirs(os.path.dirname(new), exist_ok=True)
+    try:
+        os.link(old, new)
+    except OSError:
+        # Другая файловая система или нет поддержки жестких ссылок
+        tmp_path = f"{new}.part"
+        shutil.copy2(old, tmp_path)
+        os.replace(tmp_path, new)
+    return True
+
+
+def _link_all(moves: list[tuple[int, str, str]]) -> list[tuple[int, str, str]]:
+    linked = []
+    for move in moves:
+        _, old, new = move
+        if _link(old, new):
+            linked.append(move)
+        else:
+            logger.warning("File %s is missing, row left as is", old)
+    return linked
+
+
+def _remove_all(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _pending_moves(rows) -> list[tuple[int, str, str]]:
+    return [(row.id, row.path, uploads.sharded_path(os.path.basename(row.path)))
+            for row in rows if not uploads.is_sharded(row.path)]
+
+
+async def _read_batch(statement) -> list:
+    session = await get_db_read_session()
+    try:
+        result = await session.execute(statement)
+        return result.all()
+    finally:
+        await session.close()
+
+
+async def migrate_files(batch_size: int) -> int:
+    """Переносит файлы из photo_files (и пути всех фото, ссылающихся на них)."""
+    last_id = 0
+    moved = 0
+    while True:
+        rows = await _read_batch(
+            select(PhotoFile.id, PhotoFile.checksum, PhotoFile.path)
+            .where(PhotoFile.id > last_id)
+            .order_by(PhotoFile.id)
+            .limit(batch_size)
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        checksums = {row.id: row.checksum for row in rows}
+        linked = await asyncio.to_thread(_link_all, _pending_moves(rows))
+        if not linked:
+            continue
+
+        session = await get_db_session()
+        try:
+            done, stale = [], []
+            for file_id, old, new in linked:
+                # Условие на старый путь: файл могли удалить или перенести, пока создавались ссылки
+                result = await session.execute(
+                    update(PhotoFile).where(PhotoFile.id == file_id, PhotoFile.path == old).values(path=new).returning(PhotoFile.id)
+                )
+                if result.first() is None:
+                    stale.append(new)
+                    continue
+                await session.execute(update(Photo).where(Photo.checksum == checksums[file_id]).values(path=new))
+                done.append(old)
+            await session.commit()
+        finally:
+            await session.close()
+        await asyncio.to_thread(_remove_all, done + stale)
+        moved += len(done)
+        print(f"Moved {moved} files")
+    return moved
+
+
+async def migrate_legacy(batch_size: int) -> int:
+    """Переносит файлы фото, загруженных до появления photo_files (без checksum)."""
+    last_id = 0
+    moved = 0
+    while True:
+        rows = await _read_batch(
+            select(Photo.id, Photo.path)
+            .where(Photo.id > last_id, Photo.checksum.is_(None))
+            .order_by(Photo.id)
+            .limit(batch_size)
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        linked = await asyncio.to_thread(_link_all, _pending_moves(rows))
+        if not linked:
+            continue
+
+        session = await get_db_session()
+        try:
+            done, stale = [], []
+            for photo_id, old, new in linked:
+                result = await session.execute(
+                    update(Photo).where(Photo.id == photo_id, Photo.path == old).values(path=new).returning(Photo.id)
+                )
+                (done if result.first() is not None else stale).append((old, new))
+            await session.commit()
+        finally:
+            await session.close()
+        await asyncio.to_thread(_remove_all, [old for old, _ in done] + [new for _, new in stale])
+        moved += len(done)
+        print(f"Moved {moved} legacy files")
+    return moved
+
+
+async def migrate_derivatives(batch_size: int) -> int:
+    """
+    Переносит превью. Один файл превью общий для всех фото с тем же файлом, поэтому пути
+    меняются во всех строках сразу, а не только в строках пачки.
+    """
+    last_id = 0
+    moved = 0
+    while True:
+        rows = await _read_batch(
+            select(Photo.id, Photo.thumbnail_path, Photo.preview_path)
+            .where(Photo.id > last_id, or_(Photo.thumbnail_path.is_not(None), Photo.preview_path.is_not(None)))
+            .order_by(Photo.id)
+            .limit(batch_size)
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        paths = {path for row in rows for path in (row.thumbnail_path, row.preview_path) if path and not uploads.is_sharded(path)}
+        moves = [(0, path, uploads.other_layout_path(path)) for path in sorted(paths)]
+        linked = await asyncio.to_thread(_link_all, moves)
+        if not linked:
+            continue
+
+        session = await get_db_session()
+        try:
+            for _, old, new in linked:
+                await session.execute(update(Photo).where(Photo.thumbnail_path == old).values(thumbnail_path=new))
+                await session.execute(update(Photo).where(Photo.preview_path == old).values(preview_path=new))
+            await session.commit()
+        finally:
+            await session.close()
+        # Новый путь не удаляется даже без ссылок: его могла записать идущая генерация превью
+        await asyncio.to_thread(_remove_all, [old for _, old, _ in linked])
+        moved += len(linked)
+        print(f"Moved {moved} derivatives")
+    return moved
+
+
+def _sweep(root: str) -> int:
+    """Удаляет из root файлы, уже доступные по новому пути (остались от прерванного запуска)."""
+    removed = 0
+    if not os.path.isdir(root):
+        return 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            target = uploads.sharded_path(entry.name, root)
+            if os.path.exists(target) and os.path.samefile(entry.path, target):
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+async def migrate(batch_size: int = MIGRATION_BATCH_SIZE):
+    files = await migrate_files(batch_size)
+    legacy = await migrate_legacy(batch_size)
+    derived = await migrate_derivatives(batch_size)
+    swept = await asyncio.to_thread(_sweep, uploads.PHOTOS_DIR) + await asyncio.to_thread(_sweep, derivatives.DERIVATIVES_DIR)
+    print(f"Done: {files} files, {legacy} legacy files, {derived} derivatives moved, {swept} leftover links removed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move photo files into the sharded directory layout")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+    if not isinstance(storage.backend, storage.LocalStorage):
+        print("Only the local storage backend (STORAGE_BACKEND=local) keeps files in PHOTOS_DIR")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate(args.batch_size))
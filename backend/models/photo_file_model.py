@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from database import Base
+
+class PhotoFile(Base):
+    """Файл фото в хранилище, адресуемый по SHA-256 содержимого."""
+    __tablename__ = 'photo_files'
+
+    id = Column(Integer, primary_key=True)
+    checksum = Column(String, nullable=False, unique=True)
+    path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    # Количество строк photos, ссылающихся на файл
+    ref_count = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime, nullable=False)
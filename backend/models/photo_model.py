@@ -1,16 +1,44 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, Boolean, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Text, ForeignKey, Boolean, Float, Index
 from database import Base
 
 class Photo(Base):
     __tablename__ = 'photos'
+    __table_args__ = (
+        # Ключ курсорной пагинации и фильтр по диапазону дат
+        Index('ix_photos_date_id', 'date', 'id'),
+        # Фильтры галереи: класс, класс + буква, буква; внутри - тот же порядок (date, id),
+        # поэтому страница читается из индекса без сортировки
+        Index('ix_photos_grade_parallel_date_id', 'grade', 'parallel', 'date', 'id'),
+        Index('ix_photos_grade_date_id', 'grade', 'date', 'id'),
+        Index('ix_photos_parallel_date_id', 'parallel', 'date', 'id'),
+        Index('ix_photos_camera', 'camera_make', 'camera_model'),
+    )
     
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, nullable=False)
     path = Column(String, nullable=False)
+    checksum = Column(String, ForeignKey('photo_files.checksum'), nullable=True, index=True)
 
     description = Column(String, nullable=True)
     grade = Column(Integer, nullable=True)
     parallel = Column(String, nullable=True)
 
+    # Превью генерируются в фоне после загрузки (см. derivatives.py)
+    thumbnail_path = Column(String, nullable=True)
+    preview_path = Column(String, nullable=True)
+    placeholder = Column(Text, nullable=True)
+
+    # Метаданные из EXIF, заполняются фоновой задачей после загрузки (см. tasks.py)
+    taken_at = Column(DateTime, nullable=True, index=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    orientation = Column(Integer, nullable=True)
+    camera_make = Column(String, nullable=True)
+    camera_model = Column(String, nullable=True)
+
+    # Перцептивный хэш (dHash) для поиска почти одинаковых фото, см. duplicates.py
+    phash = Column(BigInteger, nullable=True)
+
     created_at = Column(DateTime, nullable=False)
-    updated_at = Column(DateTime, nullable=False)
+    # Индекс: по max(updated_at) воркеры замечают изменения фото (см. similarity.refresh)
+    updated_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from database import Base
+
+# Старые фото без класса или параллели считаются в отдельной группе. В первичном ключе
+# NULL недопустим, поэтому в таблице такая группа хранится как 0 и "", а в API отдается null
+NO_GRADE = 0
+NO_PARALLEL = ""
+
+class PhotoStat(Base):
+    """
+    Сводка по фото: количество и обложка (самое позднее фото) для года, класса и параллели.
+    Поддерживается в той же транзакции, что и изменения photos (см. PhotoStatRepository.apply).
+    """
+    __tablename__ = 'photo_stats'
+
+    year = Column(Integer, primary_key=True)
+    grade = Column(Integer, primary_key=True)
+    parallel = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    cover_photo_id = Column(Integer, nullable=True)
+    # Дата обложки: новое фото становится обложкой, если оно позднее
+    cover_date = Column(DateTime, nullable=True)
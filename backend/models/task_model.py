@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from database import Base
+
+class Task(Base):
+    """Фоновая задача в очереди (см. tasks.py). Выполненные задачи удаляются."""
+    __tablename__ = 'tasks'
+    __table_args__ = (
+        # Выбор следующей задачи: статус + время запуска
+        Index('ix_tasks_status_run_at', 'status', 'run_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    # Параметры задачи в JSON
+    payload = Column(Text, nullable=False)
+    # pending | running | failed
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    # Не запускать раньше (для повторов с задержкой)
+    run_at = Column(DateTime, nullable=False)
+    # Задача в статусе running, не завершенная к этому времени, считается брошенной и запускается снова
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,44 @@
+"""
+Курсорная (keyset) пагинация.
+Курсор - непрозрачная для клиента строка со значениями ключа сортировки последней отданной записи.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Sequence
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Размер пачки, которой записи читаются из базы при потоковой выдаче
+STREAM_BATCH_SIZE = 500
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], length: int) -> Optional[tuple]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != length:
+            raise ValueError
+        return tuple(_decode_value(value) for value in values)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,48 @@
+"""
+Фоновое извлечение метаданных EXIF (время съемки, размеры, ориентация, камера) в колонки photos.
+Выполняется задачей очереди (см. tasks.py), заголовок файла читается в пуле процессов превью.
+"""
+import asyncio
+from sqlalchemy import select, update
+from PIL import UnidentifiedImageError
+
+import derivatives
+import image_processing
+import storage
+import tasks
+from cache import photo_cache
+from database import get_db_session, get_db_read_session
+from models.photo_model import Photo
+
+TASK_KIND = "exif"
+
+
+@tasks.handler(TASK_KIND)
+async def extract_for_photo(payload: dict):
+    """Соединение с базой на время чтения файла не держится: путь читается и метаданные пишутся короткими сессиями."""
+    photo_id = payload["photo_id"]
+    session = await get_db_read_session()
+    try:
+        result = await session.execute(select(Photo.path).where(Photo.id == photo_id))
+        path = result.scalar()
+    finally:
+        await session.close()
+    if path is None:
+        # Фото удалили раньше, чем дошла очередь
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        async with storage.local_file(path) as local_path:
+            metadata = await loop.run_in_executor(derivatives.get_executor(), image_processing.read_metadata, local_path)
+    except (FileNotFoundError, UnidentifiedImageError) as e:
+        raise tasks.PermanentTaskError(str(e)) from e
+
+    session = await get_db_session()
+    try:
+        # UPDATE по id: фото могли удалить, пока читался файл
+        await session.execute(update(Photo).where(Photo.id == photo_id).values(**metadata))
+        await session.commit()
+    finally:
+        await session.close()
+    await photo_cache.invalidate(photo_id)
@@ -0,0 +1,43 @@
+"""
+Сводка по фото для главной страницы галереи: количество по годам, классам и параллелям
+и обложка каждой группы. Таблица photo_stats меняется в тех же транзакциях, что и photos
+(PhotoStatRepository.apply), поэтому GET /photos/stats читает несколько сотен готовых строк,
+а не всю таблицу фото.
+
+Полный пересчет, если сводка разошлась с photos (например, после правки базы вручную):
+    python photo_stats.py rebuild
+"""
+import asyncio
+import sys
+from sqlalchemy import select
+
+from database import engine, dispose_engines
+from models.photo_model import Photo
+from models.photo_stat_model import PhotoStat
+from repository import PhotoStatRepository
+
+
+async def install():
+    """Заполняет сводку при первом запуске на базе, где фото уже есть (при старте приложения)."""
+    async with engine.begin() as conn:
+        has_stats = (await conn.execute(select(PhotoStat.year).limit(1))).first() is not None
+        has_photos = (await conn.execute(select(Photo.id).limit(1))).first() is not None
+        if has_photos and not has_stats:
+            for statement in PhotoStatRepository.rebuild_statements():
+                await conn.execute(statement)
+
+
+async def rebuild():
+    """Пересчитывает сводку по текущему содержимому photos."""
+    async with engine.begin() as conn:
+        for statement in PhotoStatRepository.rebuild_statements():
+            await conn.execute(statement)
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python photo_stats.py rebuild")
+        sys.exit(1)
+    asyncio.run(rebuild())
+    print("Photo stats rebuilt")
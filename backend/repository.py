@@ -1,31 +1,61 @@
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic, Type, Optional, Dict, Any, Union
-from sqlalchemy import select
+from typing import TypeVar, Generic, Type, Optional, Dict, Any, Union, AsyncIterator, Sequence
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete, tuple_, case, func, table, column, literal_column, cast, or_, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from models.user_model import User
 from models.photo_model import Photo
+from models.photo_file_model import PhotoFile
+from models.task_model import Task
+from models.photo_stat_model import PhotoStat, NO_GRADE, NO_PARALLEL
+import search
 
 # Обобщенный тип для моделей
 T = TypeVar("T")
 
+# Сколько значений передавать в одном IN (...), чтобы не упереться в лимит параметров SQLite
+RELEASE_BATCH_SIZE = 500
+
 class BaseRepository(ABC, Generic[T]):
     """Абстрактный базовый класс для CRUD-операций."""
 
+    # Ключ сортировки для курсорной пагинации; последняя колонка должна быть уникальной
+    page_order: tuple[str, ...] = ("id",)
+
     def __init__(self, model: Type[T]):
         self.model = model
 
-    async def create(self, entity: Union[T, Dict[str, Any]], session: AsyncSession) -> Union[Dict[str, str], T]:
+    async def create(self, entity: Union[T, Dict[str, Any]], session: AsyncSession, commit: bool = True) -> Union[Dict[str, str], T]:
         """
         Создает новую сущность.
         Может принимать объект модели или словарь с данными.
+        commit=False - только flush (первичный ключ заполняется), коммит делает вызывающий код.
         """
         if isinstance(entity, dict):
             entity = self.model(**entity)
         session.add(entity)
+        if not commit:
+            await session.flush()
+            return entity
         await session.commit()
         await session.refresh(entity)
         return entity
 
+    async def create_many(self, entities: list[Union[T, Dict[str, Any]]], session: AsyncSession, commit: bool = True) -> list[T]:
+        """
+        Создает несколько сущностей в одной транзакции.
+        Первичные ключи заполняются при flush, поэтому refresh каждой сущности не нужен.
+        """
+        entities = [self.model(**entity) if isinstance(entity, dict) else entity for entity in entities]
+        session.add_all(entities)
+        if commit:
+            await session.commit()
+        else:
+            await session.flush()
+        return entities
+
     async def get_by_id(self, id: int, session: AsyncSession) -> Optional[T]:
         """Получает сущность по ID."""
         result = await session.execute(select(self.model).where(self.model.id == id))
@@ -36,20 +66,84 @@ class BaseRepository(ABC, Generic[T]):
         result = await session.execute(select(self.model))
         return result.scalars().all()
 
+    def page_key(self, entity: T) -> tuple:
+        """Значения ключа сортировки сущности, из которых строится курсор."""
+        return tuple(getattr(entity, name) for name in self.page_order)
+
+    def columns_for(self, response_schema) -> list:
+        """Колонки модели, соответствующие полям схемы ответа."""
+        return [getattr(self.model, name) for name in response_schema.model_fields]
+
+    async def get_many(self, ids: Sequence[int], session: AsyncSession, columns: Optional[Sequence] = None) -> list:
+        """Сущности (или строки с колонками columns) с данными id, в произвольном порядке."""
+        rows = []
+        for start in range(0, len(ids), RELEASE_BATCH_SIZE):
+            batch = ids[start:start + RELEASE_BATCH_SIZE]
+            if columns:
+                result = await session.execute(select(*columns).where(self.model.id.in_(batch)))
+                rows.extend(result.all())
+            else:
+                result = await session.execute(select(self.model).where(self.model.id.in_(batch)))
+                rows.extend(result.scalars().all())
+        return rows
+
+    async def get_page(self, session: AsyncSession, limit: int, after: Optional[tuple] = None, where: Sequence = (),
+                       columns: Optional[Sequence] = None) -> list:
+        """
+        Получает страницу сущностей, следующих за ключом after, в порядке page_order.
+        Сравнение по кортежу (row value) использует индекс и не зависит от глубины страницы, в отличие от OFFSET.
+        where - дополнительные условия фильтрации.
+        columns - выбрать только эти колонки: вернутся строки (Row) без создания ORM-объектов.
+        """
+        order = [getattr(self.model, name) for name in self.page_order]
+        stmt = select(*columns) if columns else select(self.model)
+        stmt = stmt.where(*where).order_by(*order).limit(limit)
+        if after is not None:
+            stmt = stmt.where(tuple_(*order) > tuple_(*after))
+        result = await session.execute(stmt)
+        return result.all() if columns else result.scalars().all()
+
+    async def iter_batches(self, session: AsyncSession, batch_size: int, where: Sequence = (),
+                           columns: Optional[Sequence] = None) -> AsyncIterator[list]:
+        """
+        Последовательно отдает все сущности пачками.
+        Каждая пачка - отдельный короткий запрос, курсор базы между пачками не держится.
+        """
+        after = None
+        while True:
+            batch = await self.get_page(session, batch_size, after, where, columns)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after = self.page_key(batch[-1])
+            # Отдаем объекты сборщику мусора, identity map не должен расти вместе с таблицей
+            session.expunge_all()
+
     async def update(self, entity_or_id: Union[T, int], data: Optional[Dict[str, Any]] = None, session: AsyncSession = None) -> Optional[T]:
         """
         Обновляет сущность.
         Может принимать объект модели или ID и словарь с данными.
+        По ID обновление выполняется одним UPDATE ... RETURNING, без предварительного SELECT и refresh.
         """
-        entity = entity_or_id
-        
         if isinstance(entity_or_id, int) and data and session:
-            entity = await self.get_by_id(entity_or_id, session)
+            values = {key: value for key, value in data.items() if value is not None}
+            if not values:
+                return await self.get_by_id(entity_or_id, session)
+            result = await session.execute(
+                update(self.model)
+                .where(self.model.id == entity_or_id)
+                .values(**values)
+                .returning(self.model)
+                .execution_options(populate_existing=True)
+            )
+            entity = result.scalars().first()
             if entity:
-                for key, value in data.items():
-                    if value is not None:
-                        setattr(entity, key, value)
-        
+                await session.commit()
+            return entity
+
+        entity = entity_or_id
         if session and entity:
             await session.commit()
             await session.refresh(entity)
@@ -57,14 +151,59 @@ class BaseRepository(ABC, Generic[T]):
         return entity
 
     async def delete(self, id: int, session: AsyncSession) -> dict:
-        """Удаляет сущность по ID."""
-        entity = await self.get_by_id(id, session)
-        if entity:
-            await session.delete(entity)
+        """Удаляет сущность по ID одним DELETE ... RETURNING."""
+        result = await session.execute(delete(self.model).where(self.model.id == id).returning(self.model.id))
+        if result.first():
             await session.commit()
             return {"message": f"{self.get_model_name()} deleted successfully"}
         return {"message": f"{self.get_model_name()} not found"}
 
+    def _bulk_where(self, ids: Optional[Sequence[int]], where: Sequence) -> list:
+        clauses = list(where)
+        if ids is not None:
+            clauses.append(self.model.id.in_(ids))
+        if not clauses:
+            # Защита от случайного изменения всей таблицы
+            raise ValueError("Bulk operation requires ids or filter")
+        return clauses
+
+    async def update_many(self, data: Dict[str, Any], session: AsyncSession, ids: Optional[Sequence[int]] = None,
+                          where: Sequence = (), commit: bool = True, returning: Sequence = ()) -> list:
+        """
+        Обновляет все сущности из списка ids и/или подходящие под условия where одним UPDATE.
+        Возвращает ID измененных сущностей или, если задано returning, строки с этими колонками.
+        """
+        stmt = (
+            update(self.model)
+            .where(*self._bulk_where(ids, where))
+            .values(**data)
+            .returning(*(returning or (self.model.id,)))
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        updated = list(result.all() if returning else result.scalars().all())
+        if commit:
+            await session.commit()
+        return updated
+
+    async def delete_many(self, session: AsyncSession, ids: Optional[Sequence[int]] = None, where: Sequence = (),
+                          returning: Sequence = (), commit: bool = True) -> list:
+        """
+        Удаляет все сущности из списка ids и/или подходящие под условия where одним DELETE.
+        Возвращает строки с колонками returning (по умолчанию только ID).
+        """
+        stmt = (
+            delete(self.model)
+            .where(*self._bulk_where(ids, where))
+            .returning(*(returning or (self.model.id,)))
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        rows = list(result.all())
+        if commit:
+            await session.commit()
+        return rows
+
     @abstractmethod
     def get_model_name(self) -> str:
         """Возвращает имя модели для сообщений."""
@@ -84,18 +223,31 @@ class UserRepository(BaseRepository[User]):
         return result.scalars().first()
     
     async def update_refresh_token(self, user_id: int, refresh_token: str, session: AsyncSession) -> Optional[User]:
-        user = await session.execute(select(self.model).where(self.model.id == user_id))
-        user = user.scalars().first()
+        return await self._update_refresh_token(self.model.id == user_id, refresh_token, session)
+
+    async def update_refresh_token_by_email(self, email: str, refresh_token: str, session: AsyncSession) -> Optional[User]:
+        return await self._update_refresh_token(self.model.email == email, refresh_token, session)
+
+    async def _update_refresh_token(self, condition, refresh_token: Optional[str], session: AsyncSession) -> Optional[User]:
+        # refresh_token может быть None (выход из системы), поэтому общий update с пропуском None не подходит
+        result = await session.execute(
+            update(self.model)
+            .where(condition)
+            .values(refresh_token=refresh_token)
+            .returning(self.model)
+            .execution_options(populate_existing=True)
+        )
+        user = result.scalars().first()
         if not user:
             return None
-        user.refresh_token = refresh_token
         await session.commit()
-        await session.refresh(user)
         return user
 
 class PhotoRepository(BaseRepository[Photo]):
     """Репозиторий для работы с фото."""
 
+    page_order = ("date", "id")
+
     def __init__(self):
         super().__init__(Photo)
 
@@ -113,3 +265,334 @@ class PhotoRepository(BaseRepository[Photo]):
     async def get_by_parallel(self, parallel: str, session: AsyncSession) -> list[Photo]:
         result = await session.execute(select(self.model).where(self.model.parallel == parallel))
         return result.scalars().all()
+
+    def filter_clauses(self, grade: Optional[int] = None, parallel: Optional[str] = None,
+                       date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> list:
+        """Условия для комбинированного фильтра; каждое сочетание покрыто составным индексом."""
+        clauses = []
+        if grade is not None:
+            clauses.append(self.model.grade == grade)
+        if parallel is not None:
+            clauses.append(self.model.parallel == parallel)
+        if date_from is not None:
+            clauses.append(self.model.date >= date_from)
+        if date_to is not None:
+            clauses.append(self.model.date <= date_to)
+        return clauses
+
+    async def search(self, match: str, limit: int, session: AsyncSession, columns: Sequence, where: Sequence = ()) -> list:
+        """
+        Полнотекстовый поиск: строки с колонками columns и rank в порядке bm25.
+        Сортируются только пары (rowid, bm25), строки photos читаются для первых limit:
+        иначе через сортировку проходят полные строки всех совпадений. bm25 считается
+        не больше чем для search.SEARCH_MAX_CANDIDATES самых новых совпадений (FTS5 отдает
+        их в порядке rowid без сортировки); более старые совпадения сверх предела не ранжируются.
+        """
+        fts = literal_column("photos_fts")
+        fts_table = table("photos_fts", column("rowid"))
+        candidates = (
+            select(fts_table.c.rowid.label("id"), func.bm25(fts).label("rank"))
+            .select_from(fts_table)
+            .where(fts.op("MATCH")(match))
+        )
+        if where:
+            candidates = candidates.join(self.model, self.model.id == fts_table.c.rowid).where(*where)
+        candidates = candidates.order_by(fts_table.c.rowid.desc()).limit(search.SEARCH_MAX_CANDIDATES).subquery()
+        top = (
+            select(candidates.c.id, candidates.c.rank)
+            .order_by(candidates.c.rank, candidates.c.id)
+            .limit(limit)
+            .subquery()
+        )
+        query = (
+            select(*columns, top.c.rank)
+            .select_from(top)
+            .join(self.model, self.model.id == top.c.id)
+            .order_by(top.c.rank, self.model.id)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+    def stat_columns(self) -> tuple:
+        """Колонки, по которым считается сводка photo_stats."""
+        return (self.model.id, self.model.date, self.model.grade, self.model.parallel)
+
+    async def get_stat_rows(self, session: AsyncSession, ids: Optional[Sequence[int]] = None, where: Sequence = ()) -> list:
+        """Значения колонок сводки до изменения: UPDATE ... RETURNING отдает только новые."""
+        result = await session.execute(select(*self.stat_columns()).where(*self._bulk_where(ids, where)))
+        return result.all()
+
+    async def get_file_rows(self, session: AsyncSession, where: Sequence = ()) -> list:
+        """Только колонки, нужные для выгрузки файлов, в порядке дат; ORM-объекты не создаются."""
+        query = (
+            select(self.model.id, self.model.path, self.model.date, self.model.grade, self.model.parallel)
+            .where(*where)
+            .order_by(self.model.date, self.model.id)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+
+class PhotoFileRepository(BaseRepository[PhotoFile]):
+    """Репозиторий для файлов фото с подсчетом ссылок. Методы не коммитят сессию."""
+
+    def __init__(self):
+        super().__init__(PhotoFile)
+
+    def get_model_name(self) -> str:
+        return "PhotoFile"
+
+    async def get_path(self, checksum: str, session: AsyncSession) -> Optional[str]:
+        result = await session.execute(select(self.model.path).where(self.model.checksum == checksum))
+        return result.scalar()
+
+    async def acquire(self, checksum: str, path: str, size: int, created_at, session: AsyncSession) -> tuple[str, int]:
+        """
+        Добавляет ссылку на файл с данным хэшем, создавая запись при необходимости.
+        Возвращает путь к файлу и новое значение счетчика ссылок.
+        """
+        stmt = (
+            sqlite_insert(self.model)
+            .values(checksum=checksum, path=path, size=size, ref_count=1, created_at=created_at)
+            .on_conflict_do_update(
+                index_elements=[self.model.checksum],
+                set_={"ref_count": self.model.ref_count + 1},
+            )
+            .returning(self.model.path, self.model.ref_count)
+        )
+        result = await session.execute(stmt)
+        row = result.one()
+        return row.path, row.ref_count
+
+    async def release(self, checksum: str, session: AsyncSession) -> Optional[str]:
+        """
+        Снимает ссылку на файл. Если ссылок не осталось, удаляет запись
+        и возвращает путь к файлу, который нужно удалить с диска после коммита.
+        """
+        result = await session.execute(
+            update(self.model)
+            .where(self.model.checksum == checksum)
+            .values(ref_count=self.model.ref_count - 1)
+            .returning(self.model.path, self.model.ref_count)
+        )
+        row = result.first()
+        if row is None or row.ref_count > 0:
+            return None
+        await session.execute(delete(self.model).where(self.model.checksum == checksum))
+        return row.path
+
+    async def release_many(self, counts: Dict[str, int], session: AsyncSession) -> list[tuple[str, str]]:
+        """
+        Снимает несколько ссылок сразу: counts - {хэш: сколько ссылок снять}.
+        Возвращает (хэш, путь) файлов, на которые ссылок не осталось.
+        """
+        orphans = []
+        checksums = list(counts)
+        for start in range(0, len(checksums), RELEASE_BATCH_SIZE):
+            batch = checksums[start:start + RELEASE_BATCH_SIZE]
+            await session.execute(
+                update(self.model)
+                .where(self.model.checksum.in_(batch))
+                .values(ref_count=self.model.ref_count - case({checksum: counts[checksum] for checksum in batch}, value=self.model.checksum, else_=0))
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(
+                delete(self.model)
+                .where(self.model.checksum.in_(batch), self.model.ref_count <= 0)
+                .returning(self.model.checksum, self.model.path)
+                .execution_options(synchronize_session=False)
+            )
+            orphans.extend((row.checksum, row.path) for row in result)
+        return orphans
+
+
+
+class TaskRepository(BaseRepository[Task]):
+    """Репозиторий очереди фоновых задач. Методы не коммитят сессию."""
+
+    def __init__(self):
+        super().__init__(Task)
+
+    def get_model_name(self) -> str:
+        return "Task"
+
+    async def claim(self, now: datetime, lease: timedelta, session: AsyncSession) -> Optional[Task]:
+        """
+        Забирает одну готовую к запуску задачу: ожидающую или брошенную (истек срок аренды).
+        Выбор и захват - один UPDATE, поэтому два обработчика не получат одну и ту же задачу.
+        """
+        ready = (
+            select(self.model.id)
+            .where(
+                ((self.model.status == "pending") & (self.model.run_at <= now))
+                | ((self.model.status == "running") & (self.model.locked_until < now))
+            )
+            .order_by(self.model.run_at, self.model.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            update(self.model)
+            .where(self.model.id == ready)
+            .values(status="running", locked_until=now + lease, attempts=self.model.attempts + 1, updated_at=now)
+            .returning(self.model)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalars().first()
+
+    async def complete(self, id: int, session: AsyncSession):
+        await session.execute(delete(self.model).where(self.model.id == id).execution_options(synchronize_session=False))
+
+    async def reschedule(self, id: int, run_at: datetime, error: str, session: AsyncSession):
+        """Возвращает задачу в очередь для повторной попытки не раньше run_at."""
+        await session.execute(
+            update(self.model)
+            .where(self.model.id == id)
+            .values(status="pending", run_at=run_at, locked_until=None, last_error=error, updated_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+
+    async def fail(self, id: int, error: str, session: AsyncSession):
+        """Помечает задачу как окончательно неуспешную; она остается в таблице для разбора."""
+        await session.execute(
+            update(self.model)
+            .where(self.model.id == id)
+            .values(status="failed", locked_until=None, last_error=error, updated_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+
+    async def retry(self, id: int, session: AsyncSession) -> Optional[Task]:
+        """Возвращает неуспешную задачу в очередь с обнуленным счетчиком попыток."""
+        now = datetime.now(timezone.utc)
+        result = await session.execute(
+            update(self.model)
+            .where(self.model.id == id, self.model.status == "failed")
+            .values(status="pending", attempts=0, run_at=now, updated_at=now)
+            .returning(self.model)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalars().first()
+
+    async def list(self, session: AsyncSession, status: Optional[str] = None, limit: int = 100) -> list[Task]:
+        query = select(self.model).order_by(self.model.run_at, self.model.id).limit(limit)
+        if status is not None:
+            query = query.where(self.model.status == status)
+        result = await session.execute(query)
+        return result.scalars().all()
+
+    async def stats(self, session: AsyncSession) -> dict[tuple[str, str], int]:
+        """Количество задач по (вид, статус)."""
+        result = await session.execute(
+            select(self.model.kind, self.model.status, func.count()).group_by(self.model.kind, self.model.status)
+        )
+        return {(kind, status): count for kind, status, count in result}
+
+
+class PhotoStatRepository(BaseRepository[PhotoStat]):
+    """Репозиторий сводки по годам, классам и параллелям. Методы не коммитят сессию."""
+
+    def __init__(self):
+        super().__init__(PhotoStat)
+
+    def get_model_name(self) -> str:
+        return "PhotoStat"
+
+    @staticmethod
+    def _key(row) -> tuple[int, int, str]:
+        return (row.date.year, NO_GRADE if row.grade is None else row.grade,
+                NO_PARALLEL if row.parallel is None else row.parallel)
+
+    async def apply(self, removed: Sequence, added: Sequence, session: AsyncSession):
+        """
+        Учитывает в сводке изменение photos в текущей транзакции.
+        removed - строки (id, date, grade, parallel) удаленных фото или значения до изменения,
+        added - новых фото или значения после изменения.
+        """
+        deltas: Counter = Counter()
+        covers: dict[tuple, Any] = {}
+        for row in removed:
+            deltas[self._key(row)] -= 1
+        for row in added:
+            key = self._key(row)
+            deltas[key] += 1
+            if key not in covers or (row.date, row.id) > (covers[key].date, covers[key].id):
+                covers[key] = row
+        if not deltas:
+            return
+
+        stmt = sqlite_insert(self.model)
+        newer = or_(
+            self.model.cover_photo_id.is_(None),
+            tuple_(stmt.excluded.cover_date, stmt.excluded.cover_photo_id) > tuple_(self.model.cover_date, self.model.cover_photo_id),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.model.year, self.model.grade, self.model.parallel],
+            set_={
+                "count": self.model.count + stmt.excluded.count,
+                "cover_photo_id": case((newer, stmt.excluded.cover_photo_id), else_=self.model.cover_photo_id),
+                "cover_date": case((newer, stmt.excluded.cover_date), else_=self.model.cover_date),
+            },
+        )
+        rows = []
+        for (year, grade, parallel), delta in deltas.items():
+            cover = covers.get((year, grade, parallel))
+            rows.append({"year": year, "grade": grade, "parallel": parallel, "count": delta,
+                         "cover_photo_id": cover.id if cover else None, "cover_date": cover.date if cover else None})
+        await session.execute(stmt, rows)
+        await session.execute(delete(self.model).where(self.model.count <= 0).execution_options(synchronize_session=False))
+
+        # Обложка могла быть удалена или перенесена: выбираем ее заново по индексу (grade, parallel, date, id)
+        removed_ids = [row.id for row in removed]
+        for start in range(0, len(removed_ids), RELEASE_BATCH_SIZE):
+            batch = removed_ids[start:start + RELEASE_BATCH_SIZE]
+            cover = (
+                select(Photo.id, Photo.date)
+                .where(
+                    # IS: группа без класса или параллели совпадает с NULL в photos
+                    Photo.grade.is_(func.nullif(self.model.grade, NO_GRADE)),
+                    Photo.parallel.is_(func.nullif(self.model.parallel, NO_PARALLEL)),
+                    Photo.date >= func.printf("%04d-01-01", self.model.year),
+                    Photo.date < func.printf("%04d-01-01", self.model.year + 1),
+                )
+                .order_by(Photo.date.desc(), Photo.id.desc())
+                .limit(1)
+            )
+            await session.execute(
+                update(self.model)
+                .where(self.model.cover_photo_id.in_(batch))
+                .values(
+                    cover_photo_id=cover.with_only_columns(Photo.id).scalar_subquery(),
+                    cover_date=cover.with_only_columns(Photo.date).scalar_subquery(),
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+    async def get_all(self, session: AsyncSession) -> list:
+        result = await session.execute(
+            select(self.model.year, func.nullif(self.model.grade, NO_GRADE).label("grade"),
+                   func.nullif(self.model.parallel, NO_PARALLEL).label("parallel"), self.model.count, self.model.cover_photo_id)
+            .order_by(self.model.year.desc(), self.model.grade, self.model.parallel)
+        )
+        return result.all()
+
+    @staticmethod
+    def rebuild_statements() -> list:
+        """Полный пересчет сводки по photos: очистка и INSERT ... SELECT с оконными функциями."""
+        year = cast(func.strftime("%Y", Photo.date), Integer)
+        grade = func.coalesce(Photo.grade, NO_GRADE)
+        parallel = func.coalesce(Photo.parallel, NO_PARALLEL)
+        group = (year, grade, parallel)
+        ranked = select(
+            year.label("year"), grade.label("grade"), parallel.label("parallel"),
+            func.count().over(partition_by=group).label("count"),
+            Photo.id, Photo.date,
+            func.row_number().over(partition_by=group, order_by=(Photo.date.desc(), Photo.id.desc())).label("position"),
+        ).subquery()
+        return [
+            delete(PhotoStat),
+            sqlite_insert(PhotoStat).from_select(
+                ["year", "grade", "parallel", "count", "cover_photo_id", "cover_date"],
+                select(ranked.c.year, ranked.c.grade, ranked.c.parallel, ranked.c["count"], ranked.c.id, ranked.c.date)
+                .where(ranked.c.position == 1),
+            ),
+        ]
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, Query, Path
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from database import get_session, get_read_session
+from schemas import SlowQueryReport, TaskQueueStats, TaskResponse, TaskStatus
+from dependencies import get_current_admin
+import service
+import slow_queries
+
+admin_router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(get_current_admin)])
+
+@admin_router.get("/slow-queries",
+        response_model=SlowQueryReport,
+        tags=["Admin"],
+        summary="Медленные SQL-запросы",
+        description="Худшие формы SQL-запросов, превысивших порог SLOW_QUERY_THRESHOLD_MS, "
+                    "с планом выполнения и местом вызова. Только для администраторов")
+async def get_slow_queries(limit: int = Query(slow_queries.SLOW_QUERY_TOP_N, ge=1, le=500, description="Сколько форм запросов вернуть")):
+    return {"threshold_ms": slow_queries.SLOW_QUERY_THRESHOLD_MS, "items": slow_queries.top(limit)}
+
+@admin_router.delete("/slow-queries",
+        tags=["Admin"],
+        summary="Сбросить статистику медленных запросов")
+async def reset_slow_queries():
+    slow_queries.reset()
+    return {"message": "Slow query statistics reset"}
+
+@admin_router.get("/tasks/stats",
+        response_model=TaskQueueStats,
+        tags=["Admin"],
+        summary="Состояние очереди фоновых задач",
+        description="Количество ожидающих, выполняющихся и неуспешных задач, всего и по видам")
+async def get_task_stats(session: AsyncSession = Depends(get_read_session)):
+    task_service = service.TaskService()
+    return await task_service.get_stats(session)
+
+@admin_router.get("/tasks",
+        response_model=List[TaskResponse],
+        tags=["Admin"],
+        summary="Фоновые задачи",
+        description="Задачи очереди в порядке запуска, с последней ошибкой. Выполненные задачи из очереди удаляются")
+async def get_tasks(status: Optional[TaskStatus] = Query(None, description="Фильтр по статусу"),
+                    limit: int = Query(100, ge=1, le=1000, description="Сколько задач вернуть"),
+                    session: AsyncSession = Depends(get_read_session)):
+    task_service = service.TaskService()
+    return await task_service.get_tasks(status, limit, session)
+
+@admin_router.post("/tasks/{task_id}/retry",
+        response_model=TaskResponse,
+        tags=["Admin"],
+        summary="Повторить неуспешную задачу",
+        description="Возвращает задачу в статусе failed в очередь с обнуленным счетчиком попыток")
+async def retry_task(task_id: int = Path(..., description="ID задачи"), session: AsyncSession = Depends(get_session)):
+    task_service = service.TaskService()
+    return await task_service.retry_task(task_id, session)
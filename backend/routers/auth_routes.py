@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_session
-from schemas import UserCreateRequest, UserCreateResponse, Token, TokenRefresh, CSRFToken
+from schemas import UserCreateRequest, UserCreateResponse, UserPrincipal, Token, TokenRefresh, CSRFToken
 from service import UserService
 import auth_utils
+from dependencies import get_current_user
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
@@ -53,15 +54,24 @@ async def refresh_token(token_data: TokenRefresh, session: AsyncSession = Depend
 @router.post("/logout",
             tags=["Auth"],
             summary="Выход из системы")
-async def logout(request: Request, session: AsyncSession = Depends(get_session)):
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(auth_utils.bearer_scheme),
+                 current_user: UserPrincipal = Depends(get_current_user),
+                 session: AsyncSession = Depends(get_session)):
     """Выход из системы"""
-    # Получаем пользователя из access_token
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    payload = auth_utils.decode_token(token, token_type="access")
     user_service = UserService()
-    await user_service.update_user_refresh_token(payload["sub"], None, session=session)
+    await user_service.update_user_refresh_token(current_user.email, None, session=session)
+    auth_utils.forget_token(credentials.credentials)
+    auth_utils.invalidate_principal(user_id=current_user.id)
     return {"message": "Logged out"}
 
+@router.get("/me",
+            response_model=UserPrincipal,
+            tags=["Auth"],
+            summary="Текущий пользователь")
+async def me(current_user: UserPrincipal = Depends(get_current_user)):
+    """Данные пользователя, которому принадлежит access-токен"""
+    return current_user
+
 @router.get("/csrf-token",
             response_model=CSRFToken,
             tags=["Auth"],
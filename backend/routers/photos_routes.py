@@ -1,36 +1,185 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_session
+from database import get_session, get_read_session
 import service
 import uuid
 import json
-from schemas import PhotoCreateRequest, PhotoCreateResponse, PhotoReadRequest, PhotoReadResponse, PhotoUpdateRequest, PhotoUpdateResponse, PhotoDeleteRequest, PhotoDeleteResponse, ErrorResponse
+import uploads
+from pydantic import ValidationError
+from fastapi.responses import FileResponse, StreamingResponse
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from file_serving import photo_file_response, stored_file_response
+import archive
+import duplicates
+import similarity
+from urllib.parse import quote
+from typing import Literal, Optional
+from datetime import datetime
+from schemas import PhotoCreateRequest, PhotoCreateResponse, PhotoBulkUploadResponse, PhotoReadRequest, PhotoReadResponse, PhotoPageResponse, PhotoSearchResponse, PhotoDuplicatesResponse, PhotoSimilarResponse, PhotoStatsResponse, PhotoFilter, PhotoUpdateRequest, PhotoUpdateResponse, PhotoDeleteRequest, PhotoDeleteResponse, PhotoBulkUpdateRequest, PhotoBulkDeleteRequest, BulkOperationResponse, ErrorResponse
 
 
 photos_router = APIRouter(prefix="/photos", tags=["Photos"])
 
+def _upload_body(file_field: str, file_schema: dict, metadata_description: str) -> dict:
+    """Описание multipart-тела для OpenAPI: маршруты загрузки читают тело сами, без Form/File."""
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["photo_data_json", file_field],
+        "properties": {
+            "photo_data_json": {"type": "string", "description": metadata_description},
+            file_field: file_schema,
+        },
+    }}}}}
+
+def _parse_metadata(photo_data_dict) -> PhotoCreateRequest | str:
+    """Метаданные одного фото или текст ошибки валидации."""
+    try:
+        return PhotoCreateRequest(**photo_data_dict)
+    except ValidationError as e:
+        return "Invalid metadata: " + "; ".join(error["msg"] for error in e.errors())
+    except TypeError:
+        return "Invalid metadata"
+
+def _load_metadata_json(form: uploads.ReceivedForm):
+    try:
+        return json.loads(form.fields.get("photo_data_json", ""))
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid metadata JSON")
+
 @photos_router.post("/",
         response_model=PhotoCreateResponse,
         tags=["Photos"],
         summary="Загрузить фото",
-        description="Загрузка фото в систему")
-async def upload_photo(photo_data_json: str = Form(...), file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
-    # Парсим JSON обратно в модель для валидации
-    photo_data_dict = json.loads(photo_data_json)
-    photo_data = PhotoCreateRequest(**photo_data_dict)
+        description="Загрузка фото в систему",
+        openapi_extra=_upload_body("file", {"type": "string", "format": "binary"}, "JSON с метаданными фото"))
+async def upload_photo(request: Request, session: AsyncSession = Depends(get_session)):
+    # Тело разбирается потоком: размер и сигнатура файла проверяются на первых байтах
+    async with uploads.receive_form(request, "file", 1, uploads.MAX_UPLOAD_SIZE + uploads.MULTIPART_OVERHEAD, strict=True) as form:
+        if not form.files:
+            raise HTTPException(status_code=400, detail="File is required")
+        photo_data = _parse_metadata(_load_metadata_json(form))
+        if isinstance(photo_data, str):
+            raise HTTPException(status_code=400, detail=photo_data)
 
-    photo_service = service.PhotoService()
-    return await photo_service.upload_photo(photo_data, file=file, session=session)
+        photo_service = service.PhotoService()
+        return await photo_service.upload_photo(photo_data, form.files[0].ingested, session=session)
+
+@photos_router.post("/bulk",
+        response_model=PhotoBulkUploadResponse,
+        tags=["Photos"],
+        summary="Загрузить несколько фото",
+        description="Пакетная загрузка: файлы и JSON-массив метаданных в том же порядке. "
+                    "Все фото сохраняются одной транзакцией, результат возвращается по каждому файлу",
+        openapi_extra=_upload_body("files", {"type": "array", "items": {"type": "string", "format": "binary"}},
+                                   "JSON-массив метаданных фото"))
+async def upload_photos_bulk(request: Request, session: AsyncSession = Depends(get_session)):
+    async with uploads.receive_form(request, "files", uploads.BULK_MAX_FILES, uploads.MAX_BULK_UPLOAD_SIZE, strict=False) as form:
+        photo_data_list = _load_metadata_json(form)
+        if not isinstance(photo_data_list, list) or len(photo_data_list) != len(form.files):
+            raise HTTPException(status_code=400, detail="Metadata must be an array with one item per file")
+
+        items = [(_parse_metadata(photo_data_dict), file) for photo_data_dict, file in zip(photo_data_list, form.files)]
+        photo_service = service.PhotoService()
+        return await photo_service.upload_photos_bulk(items, session=session)
 
 @photos_router.get("/",
-        response_model=list[PhotoReadResponse], 
+        response_model=PhotoPageResponse, 
         tags=["Photos"], 
         summary="Получить все фото", 
-        description="Возвращает список всех фото в системе")
-async def get_photos(session: AsyncSession = Depends(get_session)):
+        description="Возвращает страницу фото, упорядоченных по дате, с фильтром по классу, букве параллели и диапазону дат. "
+                    "Для следующей страницы передайте next_cursor в параметре cursor вместе с теми же фильтрами. "
+                    "С format=ndjson отдает все подходящие фото потоком, по одному JSON-объекту на строку",
+        responses={
+            200: {"content": {"application/x-ndjson": {}}}
+        })
+async def get_photos(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+                    cursor: Optional[str] = Query(None, description="Курсор из next_cursor предыдущей страницы"),
+                    format: Literal["json", "ndjson"] = Query("json", description="Формат ответа"),
+                    grade: Optional[int] = Query(None, ge=1, le=11, description="Класс"),
+                    parallel: Optional[str] = Query(None, description="Буква параллели"),
+                    date_from: Optional[datetime] = Query(None, alias="from", description="Начало диапазона дат включительно"),
+                    date_to: Optional[datetime] = Query(None, alias="to", description="Конец диапазона дат включительно"),
+                    session: AsyncSession = Depends(get_read_session)):
+    filters = PhotoFilter(grade=grade, parallel=parallel, date_from=date_from, date_to=date_to)
+    photo_service = service.PhotoService()
+    if format == "ndjson":
+        return StreamingResponse(photo_service.stream_photos(filters), media_type="application/x-ndjson")
+    return await photo_service.get_photos_page(limit, cursor, filters, session=session)
+
+@photos_router.get("/stats",
+        response_model=PhotoStatsResponse,
+        tags=["Photos"],
+        summary="Сводка по фото",
+        description="Количество фото по годам, классам и параллелям и обложка каждого класса. "
+                    "Сводка поддерживается при каждом изменении фото, поэтому запрос не читает таблицу фото")
+async def get_photo_stats(session: AsyncSession = Depends(get_read_session)):
     photo_service = service.PhotoService()
-    return await photo_service.get_all_photos(session=session)
+    return await photo_service.get_stats(session=session)
+
+@photos_router.get("/search",
+        response_model=PhotoSearchResponse,
+        tags=["Photos"],
+        summary="Поиск фото по описанию",
+        description="Полнотекстовый поиск по описаниям фото. Слова ищутся по началу основы, "
+                    "поэтому «выпускного» находит «Выпускной». Результаты упорядочены по релевантности (bm25), "
+                    "при очень большом числе совпадений ранжируются только самые новые из них. "
+                    "Совпадения в сниппете выделены тегом <mark>")
+async def search_photos(q: str = Query(..., min_length=1, max_length=200, description="Поисковый запрос"),
+                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Максимум результатов"),
+                    grade: Optional[int] = Query(None, ge=1, le=11, description="Класс"),
+                    parallel: Optional[str] = Query(None, description="Буква параллели"),
+                    session: AsyncSession = Depends(get_read_session)):
+    filters = PhotoFilter(grade=grade, parallel=parallel)
+    photo_service = service.PhotoService()
+    return await photo_service.search_photos(q, limit, filters, session=session)
+
+@photos_router.get("/archive",
+        tags=["Photos"],
+        summary="Скачать фото архивом",
+        description="Отдает ZIP-архив с оригиналами фото, подходящих под фильтр. Архив формируется потоком, "
+                    "без временных файлов; уже сжатые форматы кладутся без сжатия. "
+                    "Число одновременных выгрузок ограничено, сверх него возвращается 503",
+        response_class=StreamingResponse,
+        responses={
+            200: {"content": {"application/zip": {}}},
+            404: {"model": ErrorResponse, "description": "Фото не найдены"},
+            503: {"model": ErrorResponse, "description": "Слишком много одновременных выгрузок"}
+        })
+async def get_photos_archive(grade: Optional[int] = Query(None, ge=1, le=11, description="Класс"),
+                    parallel: Optional[str] = Query(None, description="Буква параллели"),
+                    date_from: Optional[datetime] = Query(None, alias="from", description="Начало диапазона дат включительно"),
+                    date_to: Optional[datetime] = Query(None, alias="to", description="Конец диапазона дат включительно"),
+                    session: AsyncSession = Depends(get_read_session)):
+    slot = archive.reserve()
+    filters = PhotoFilter(grade=grade, parallel=parallel, date_from=date_from, date_to=date_to)
+    photo_service = service.PhotoService()
+    try:
+        entries = await photo_service.get_archive_entries(filters, session=session)
+    except BaseException:
+        slot.release()
+        raise
+    filename = "photos" + "".join(f"_{part}" for part in (grade, parallel) if part is not None) + ".zip"
+    return StreamingResponse(archive.stream_zip(entries, slot), media_type="application/zip",
+                             headers={"Content-Disposition": f"attachment; filename=\"photos.zip\"; filename*=UTF-8''{quote(filename)}"})
+
+@photos_router.put("/bulk",
+        response_model=BulkOperationResponse,
+        tags=["Photos"],
+        summary="Обновить несколько фото",
+        description="Обновляет фото из списка ids или подходящие под фильтр одним запросом к базе")
+async def update_photos_bulk(request: PhotoBulkUpdateRequest, session: AsyncSession = Depends(get_session)):
+    photo_service = service.PhotoService()
+    return await photo_service.update_photos_bulk(request, session=session)
+
+@photos_router.post("/bulk/delete",
+        response_model=BulkOperationResponse,
+        tags=["Photos"],
+        summary="Удалить несколько фото",
+        description="Удаляет фото из списка ids или подходящие под фильтр одним запросом к базе")
+async def delete_photos_bulk(request: PhotoBulkDeleteRequest, session: AsyncSession = Depends(get_session)):
+    photo_service = service.PhotoService()
+    return await photo_service.delete_photos_bulk(request, session=session)
 
 @photos_router.get("/{photo_id}",
         response_model=PhotoReadResponse,
@@ -40,9 +189,72 @@ async def get_photos(session: AsyncSession = Depends(get_session)):
         responses={
             404: {"model": ErrorResponse, "description": "Фото не найдено"}
         })
-async def get_photo(photo_id: int = Path(..., title="ID фото", description="Уникальный идентификатор фото"), session: AsyncSession = Depends(get_session)):
+async def get_photo(photo_id: int = Path(..., title="ID фото", description="Уникальный идентификатор фото"), session: AsyncSession = Depends(get_read_session)):
+    photo_service = service.PhotoService()
+    # Ответ берется из кэша уже сериализованным, повторная валидация не нужна
+    return Response(content=await photo_service.get_photo_json(photo_id, session=session), media_type="application/json")
+
+@photos_router.get("/{photo_id}/duplicates",
+        response_model=PhotoDuplicatesResponse,
+        tags=["Photos"],
+        summary="Почти одинаковые фото",
+        description="Фото, перцептивный хэш которых отличается не больше чем на max_distance бит: "
+                    "пересохраненные, уменьшенные или пересжатые копии",
+        responses={
+            404: {"model": ErrorResponse, "description": "Фото не найдено"}
+        })
+async def get_photo_duplicates(photo_id: int = Path(..., title="ID фото", description="Уникальный идентификатор фото"),
+                               max_distance: int = Query(duplicates.NEAR_DUPLICATE_DISTANCE, ge=0, le=duplicates.MAX_DUPLICATE_DISTANCE,
+                                                         description="Максимальное расстояние Хэмминга"),
+                               session: AsyncSession = Depends(get_read_session)):
+    photo_service = service.PhotoService()
+    return await photo_service.get_duplicates(photo_id, max_distance, session=session)
+
+@photos_router.get("/{photo_id}/similar",
+        response_model=PhotoSimilarResponse,
+        tags=["Photos"],
+        summary="Похожие фото",
+        description="Визуально похожие фото по цветам и композиции, с необязательным фильтром по классу и параллели. "
+                    "Пока вектор признаков фото не посчитан фоновой задачей, список пуст",
+        responses={
+            404: {"model": ErrorResponse, "description": "Фото не найдено"}
+        })
+async def get_similar_photos(photo_id: int = Path(..., title="ID фото", description="Уникальный идентификатор фото"),
+                             limit: int = Query(similarity.SIMILAR_DEFAULT_LIMIT, ge=1, le=similarity.SIMILAR_MAX_LIMIT, description="Сколько фото вернуть"),
+                             grade: Optional[int] = Query(None, description="Только фото этого класса"),
+                             parallel: Optional[str] = Query(None, description="Только фото этой параллели"),
+                             session: AsyncSession = Depends(get_read_session)):
+    photo_service = service.PhotoService()
+    return await photo_service.get_similar(photo_id, limit, grade, parallel, session=session)
+
+@photos_router.get("/{photo_id}/file",
+        tags=["Photos"],
+        summary="Скачать фото",
+        description="Отдает оригинал фото. Поддерживает Range, ETag и условные запросы",
+        response_class=FileResponse,
+        responses={
+            404: {"model": ErrorResponse, "description": "Фото не найдено"}
+        })
+async def get_photo_file(request: Request, photo_id: int = Path(..., title="ID фото", description="Уникальный идентификатор фото"), session: AsyncSession = Depends(get_read_session)):
+    photo_service = service.PhotoService()
+    photo, path, etag = await photo_service.get_photo_file(photo_id, "original", session=session)
+    return await stored_file_response(request, path, etag, photo.updated_at)
+
+@photos_router.get("/{photo_id}/file/{variant}",
+        tags=["Photos"],
+        summary="Скачать превью фото",
+        description="Отдает превью фото в формате WebP",
+        response_class=FileResponse,
+        responses={
+            404: {"model": ErrorResponse, "description": "Фото или превью не найдено"}
+        })
+async def get_photo_derivative(request: Request,
+                    photo_id: int = Path(..., title="ID фото", description="Уникальный идентификатор фото"),
+                    variant: Literal["thumbnail", "preview"] = Path(..., title="Вариант превью"),
+                    session: AsyncSession = Depends(get_read_session)):
     photo_service = service.PhotoService()
-    return await photo_service.get_photo_by_id(photo_id, session=session)
+    photo, path, etag = await photo_service.get_photo_file(photo_id, variant, session=session)
+    return await photo_file_response(request, path, etag, photo.updated_at)
 
 @photos_router.put("/{photo_id}",
         response_model=PhotoUpdateResponse,
@@ -83,5 +295,4 @@ async def update_photo(photo_data: PhotoUpdateRequest,
 async def delete_photo(photo_id: int = Path(...,  title="ID фото",
                                         description="Уникальный идентификатор фото"), session: AsyncSession = Depends(get_session)):
     photo_service = service.PhotoService()
-    photo = await photo_service.get_photo_by_id(photo_id, session=session)
-    return await photo_service.delete_photo(photo_id, photo.path, session=session)
\ No newline at end of file
+    return await photo_service.delete_photo(photo_id, session=session)
\ No newline at end of file
@@ -1,20 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_session
+from database import get_session, get_read_session
 import service
-from schemas import UserReadRequest, UserReadResponse, UserUpdateRequest, UserUpdateResponse, UserDeleteRequest, UserDeleteResponse, ErrorResponse
+from typing import Literal, Optional
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from schemas import UserReadRequest, UserReadResponse, UserPageResponse, UserUpdateRequest, UserUpdateResponse, UserDeleteRequest, UserDeleteResponse, UserBulkUpdateRequest, UserBulkDeleteRequest, BulkOperationResponse, ErrorResponse
 
 
 users_router = APIRouter(prefix="/users", tags=["Users"])
 
 @users_router.get("/",
-        response_model=list[UserReadResponse], 
+        response_model=UserPageResponse, 
         tags=["Users"], 
         summary="Получить всех пользователей", 
-        description="Возвращает список всех пользователей в системе")
-async def get_users(session: AsyncSession = Depends(get_session)):
+        description="Возвращает страницу пользователей, упорядоченных по ID. "
+                    "Для следующей страницы передайте next_cursor в параметре cursor. "
+                    "С format=ndjson отдает всех пользователей потоком, по одному JSON-объекту на строку",
+        responses={
+            200: {"content": {"application/x-ndjson": {}}}
+        })
+async def get_users(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+                   cursor: Optional[str] = Query(None, description="Курсор из next_cursor предыдущей страницы"),
+                   format: Literal["json", "ndjson"] = Query("json", description="Формат ответа"),
+                   session: AsyncSession = Depends(get_read_session)):
+    user_service = service.UserService()
+    if format == "ndjson":
+        return StreamingResponse(user_service.stream_users(), media_type="application/x-ndjson")
+    return await user_service.get_users_page(limit, cursor, session=session)
+
+@users_router.put("/bulk",
+        response_model=BulkOperationResponse,
+        tags=["Users"],
+        summary="Обновить несколько пользователей",
+        description="Обновляет пользователей из списка ids или подходящих под фильтр одним запросом к базе")
+async def update_users_bulk(request: UserBulkUpdateRequest, session: AsyncSession = Depends(get_session)):
+    user_service = service.UserService()
+    return await user_service.update_users_bulk(request, session=session)
+
+@users_router.post("/bulk/delete",
+        response_model=BulkOperationResponse,
+        tags=["Users"],
+        summary="Удалить несколько пользователей",
+        description="Удаляет пользователей из списка ids или подходящих под фильтр одним запросом к базе")
+async def delete_users_bulk(request: UserBulkDeleteRequest, session: AsyncSession = Depends(get_session)):
     user_service = service.UserService()
-    return await user_service.get_all_users(session=session)
+    return await user_service.delete_users_bulk(request, session=session)
 
 @users_router.get("/{user_id}",
         response_model=UserReadResponse,
@@ -24,7 +55,7 @@ async def get_users(session: AsyncSession = Depends(get_session)):
         responses={
             404: {"model": ErrorResponse, "description": "Пользователь не найден"}
         })
-async def get_user(user_id: int = Path(..., title="ID пользователя", description="Уникальный идентификатор пользователя"), session: AsyncSession = Depends(get_session)):
+async def get_user(user_id: int = Path(..., title="ID пользователя", description="Уникальный идентификатор пользователя"), session: AsyncSession = Depends(get_read_session)):
     user_service = service.UserService()
     return await user_service.get_user_by_id(user_id, session=session)
 
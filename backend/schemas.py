@@ -1,8 +1,9 @@
-from pydantic import BaseModel, Field, field_validator, ConfigDict
+from pydantic import BaseModel, Field, field_validator, model_validator, computed_field, ConfigDict
 from datetime import datetime
 import re
 from typing import Optional, List, Any, Dict
 import enum
+from models.user_model import UserRoles
 
 #Схемы юзера
 
@@ -172,6 +173,66 @@ class UserReadResponse(BaseModel):
         }
     }
 
+class UserPrincipal(BaseModel):
+    """Аутентифицированный пользователь текущего запроса"""
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int = Field(..., description="Уникальный идентификатор пользователя")
+    first_name: str = Field(..., description="Имя пользователя")
+    last_name: str = Field(..., description="Фамилия пользователя")
+    email: str = Field(..., description="Электронная почта пользователя")
+    role: str = Field(..., description="Роль пользователя")
+    is_active: bool = Field(..., description="Статус активности пользователя")
+
+    @field_validator('role', mode='before')
+    @classmethod
+    def validate_role(cls, v):
+        return v.value if isinstance(v, enum.Enum) else v
+
+class UserPageResponse(BaseModel):
+    items: List[UserReadResponse] = Field(..., description="Пользователи на странице")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы, null если страница последняя")
+
+class UserFilter(BaseModel):
+    """Фильтр пользователей для пакетных операций"""
+    role: Optional[str] = Field(None, description="Роль пользователя")
+    is_active: Optional[bool] = Field(None, description="Статус активности пользователя")
+
+class UserBulkSelector(BaseModel):
+    ids: Optional[List[int]] = Field(None, description="ID пользователей")
+    filter: Optional[UserFilter] = Field(None, description="Фильтр пользователей")
+
+    @model_validator(mode='after')
+    def validate_selector(self):
+        if not self.ids and not (self.filter and self.filter.model_dump(exclude_none=True)):
+            raise ValueError("ids or filter is required")
+        return self
+
+class UserBulkUpdateData(BaseModel):
+    role: Optional[UserRoles] = Field(None, description="Роль пользователя")
+    is_active: Optional[bool] = Field(None, description="Статус активности пользователя")
+
+class UserBulkUpdateRequest(UserBulkSelector):
+    data: UserBulkUpdateData = Field(..., description="Новые значения полей")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "filter": {"role": "user", "is_active": True},
+                "data": {"is_active": False}
+            }
+        }
+    }
+
+class UserBulkDeleteRequest(UserBulkSelector):
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "ids": [3, 4, 5]
+            }
+        }
+    }
+
 class UserDeleteRequest(BaseModel):
     id: int = Field(..., description="Уникальный идентификатор пользователя")
     
@@ -262,8 +323,13 @@ class PhotoCreateRequest(BaseModel):
         }
     }
 
+class NearDuplicate(BaseModel):
+    id: int = Field(..., description="ID похожего фото")
+    distance: int = Field(..., description="Расстояние Хэмминга между перцептивными хэшами")
+
 class PhotoCreateResponse(BaseModel):
     message: str = Field(..., description="Сообщение о результате операции")
+    near_duplicates: Optional[List[NearDuplicate]] = Field(None, description="Почти одинаковые фото, уже загруженные ранее")
     
     model_config = {
         "json_schema_extra": {
@@ -273,6 +339,28 @@ class PhotoCreateResponse(BaseModel):
         }
     }
 
+class PhotoBulkUploadItem(BaseModel):
+    index: int = Field(..., description="Порядковый номер файла в запросе")
+    filename: Optional[str] = Field(None, description="Имя загруженного файла")
+    success: bool = Field(..., description="Загружено ли фото")
+    id: Optional[int] = Field(None, description="ID созданного фото")
+    error: Optional[str] = Field(None, description="Причина ошибки")
+    near_duplicates: Optional[List[NearDuplicate]] = Field(None, description="Почти одинаковые фото, уже загруженные ранее")
+
+class PhotoBulkUploadResponse(BaseModel):
+    results: List[PhotoBulkUploadItem] = Field(..., description="Результат по каждому файлу")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "results": [
+                    {"index": 0, "filename": "IMG_0001.jpg", "success": True, "id": 12},
+                    {"index": 1, "filename": "notes.txt", "success": False, "error": "Invalid photo format"}
+                ]
+            }
+        }
+    }
+
 class PhotoReadRequest(BaseModel):
     id: int = Field(..., description="Уникальный идентификатор фото")
 
@@ -288,12 +376,48 @@ class PhotoReadResponse(BaseModel):
     id: int = Field(..., description="Уникальный идентификатор фото")
     date: datetime = Field(..., description="Дата фото")
     path: str = Field(..., description="Путь к фото")
+    checksum: Optional[str] = Field(None, description="SHA-256 содержимого файла")
     description: str = Field(..., description="Описание фото")
     grade: int = Field(..., description="Класс на фото")
     parallel: str = Field(..., description="Буква параллели класса на фото")
     created_at: datetime = Field(..., description="Дата создания фото")
     updated_at: datetime = Field(..., description="Дата обновления фото")
     
+    thumbnail_path: Optional[str] = Field(None, description="Путь к превью 256 px (WebP)")
+    preview_path: Optional[str] = Field(None, description="Путь к превью 1024 px (WebP)")
+    placeholder: Optional[str] = Field(None, description="Размытая заглушка в виде data URI")
+
+    taken_at: Optional[datetime] = Field(None, description="Время съемки из EXIF")
+    width: Optional[int] = Field(None, description="Ширина в пикселях с учетом ориентации")
+    height: Optional[int] = Field(None, description="Высота в пикселях с учетом ориентации")
+    orientation: Optional[int] = Field(None, description="Ориентация EXIF (1-8)")
+    camera_make: Optional[str] = Field(None, description="Производитель камеры")
+    camera_model: Optional[str] = Field(None, description="Модель камеры")
+
+    @staticmethod
+    def urls(item: dict) -> dict:
+        """Вычисляемые поля по словарю с колонками фото; используется и без создания модели."""
+        return {
+            "file_url": f"/photos/{item['id']}/file",
+            "thumbnail_url": f"/photos/{item['id']}/file/thumbnail" if item["thumbnail_path"] else None,
+            "preview_url": f"/photos/{item['id']}/file/preview" if item["preview_path"] else None,
+        }
+
+    @computed_field(description="URL для скачивания оригинала")
+    @property
+    def file_url(self) -> str:
+        return self.urls(self.__dict__)["file_url"]
+
+    @computed_field(description="URL превью 256 px")
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return self.urls(self.__dict__)["thumbnail_url"]
+
+    @computed_field(description="URL превью 1024 px")
+    @property
+    def preview_url(self) -> Optional[str]:
+        return self.urls(self.__dict__)["preview_url"]
+    
     model_config = {
         "json_schema_extra": {
             "example": {
@@ -304,11 +428,107 @@ class PhotoReadResponse(BaseModel):
                 "grade": 10,
                 "parallel": "A",
                 "created_at": "2025-01-01",
-                "updated_at": "2025-01-23"
+                "updated_at": "2025-01-23",
+                "thumbnail_path": "photos/derivatives/9f86d081_256.webp",
+                "preview_path": "photos/derivatives/9f86d081_1024.webp",
+                "placeholder": "data:image/webp;base64,UklGRkIAAABXRUJQVlA4IDYAAADQAQCdASoQAAwAAUAmJaQAA3AA/v02aAA="
             }
         }
     }
 
+class PhotoFilter(BaseModel):
+    """Комбинированный фильтр списка фото"""
+    grade: Optional[int] = Field(None, description="Класс")
+    parallel: Optional[str] = Field(None, description="Буква параллели")
+    date_from: Optional[datetime] = Field(None, description="Начало диапазона дат включительно")
+    date_to: Optional[datetime] = Field(None, description="Конец диапазона дат включительно")
+
+class PhotoBulkSelector(BaseModel):
+    ids: Optional[List[int]] = Field(None, description="ID фото")
+    filter: Optional[PhotoFilter] = Field(None, description="Фильтр фото")
+
+    @model_validator(mode='after')
+    def validate_selector(self):
+        if not self.ids and not (self.filter and self.filter.model_dump(exclude_none=True)):
+            raise ValueError("ids or filter is required")
+        return self
+
+class PhotoBulkUpdateData(BaseModel):
+    date: Optional[datetime] = Field(None, description="Дата фото")
+    description: Optional[str] = Field(None, description="Описание фото")
+    grade: Optional[int] = Field(None, description="Класс на фото")
+    parallel: Optional[str] = Field(None, description="Буква параллели класса на фото")
+
+    @field_validator('grade')
+    @classmethod
+    def validate_grade(cls, v):
+        return PhotoCreateRequest.validate_grade(v)
+
+    @field_validator('parallel')
+    @classmethod
+    def validate_parallel(cls, v):
+        return PhotoCreateRequest.validate_parallel(v)
+
+class PhotoBulkUpdateRequest(PhotoBulkSelector):
+    data: PhotoBulkUpdateData = Field(..., description="Новые значения полей")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "filter": {"grade": 10, "parallel": "А"},
+                "data": {"grade": 11}
+            }
+        }
+    }
+
+class PhotoBulkDeleteRequest(PhotoBulkSelector):
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "ids": [12, 13, 14]
+            }
+        }
+    }
+
+class PhotoPageResponse(BaseModel):
+    items: List[PhotoReadResponse] = Field(..., description="Фото на странице")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы, null если страница последняя")
+
+class PhotoSearchItem(PhotoReadResponse):
+    rank: float = Field(..., description="Релевантность bm25, чем меньше, тем лучше")
+    snippet: str = Field(..., description="Фрагмент описания, экранированный как HTML, совпадения выделены тегом <mark>")
+
+class PhotoSearchResponse(BaseModel):
+    items: List[PhotoSearchItem] = Field(..., description="Найденные фото, от наиболее релевантных")
+
+class PhotoDuplicateItem(PhotoReadResponse):
+    distance: int = Field(..., description="Расстояние Хэмминга между перцептивными хэшами, 0 - одинаковые")
+
+class PhotoDuplicatesResponse(BaseModel):
+    items: List[PhotoDuplicateItem] = Field(..., description="Почти одинаковые фото, от самых похожих")
+
+class PhotoSimilarItem(PhotoReadResponse):
+    score: float = Field(..., description="Косинусная близость векторов признаков, 1 - одинаковые")
+
+class PhotoSimilarResponse(BaseModel):
+    items: List[PhotoSimilarItem] = Field(..., description="Похожие фото, от самых похожих")
+
+class PhotoStatItem(BaseModel):
+    year: int = Field(..., description="Год фото")
+    grade: Optional[int] = Field(None, description="Класс; null - фото без класса")
+    parallel: Optional[str] = Field(None, description="Буква параллели; null - фото без параллели")
+    count: int = Field(..., description="Количество фото")
+    cover_photo_id: Optional[int] = Field(None, description="ID самого позднего фото группы для обложки")
+
+class PhotoYearCount(BaseModel):
+    year: int = Field(..., description="Год фото")
+    count: int = Field(..., description="Количество фото")
+
+class PhotoStatsResponse(BaseModel):
+    total: int = Field(..., description="Всего фото")
+    years: List[PhotoYearCount] = Field(..., description="Количество по годам, от последнего")
+    items: List[PhotoStatItem] = Field(..., description="По годам, классам и параллелям")
+
 class PhotoUpdateRequest(BaseModel):
     date: datetime = Field(..., description="Дата фото")
     description: str = Field(..., description="Описание фото")
@@ -359,6 +579,19 @@ class PhotoDeleteResponse(BaseModel):
         }
     }
 
+class BulkOperationResponse(BaseModel):
+    message: str = Field(..., description="Сообщение о результате операции")
+    count: int = Field(..., description="Количество затронутых записей")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "message": "Photos updated successfully",
+                "count": 27
+            }
+        }
+    }
+
 class ErrorResponse(BaseModel):
     """Модель для ответов с ошибками"""
     detail: str = Field(..., description="Детальное описание ошибки")
@@ -385,4 +618,49 @@ class TokenPayload(BaseModel):
     type: str
 
 class CSRFToken(BaseModel):
-    csrf_token: str
\ No newline at end of file
+    csrf_token: str
+
+class SlowQueryStat(BaseModel):
+    statement: str = Field(..., description="Форма запроса: текст с параметрами, списки IN свернуты")
+    count: int = Field(..., description="Сколько раз запрос превысил порог")
+    total_ms: float = Field(..., description="Суммарное время, мс")
+    avg_ms: float = Field(..., description="Среднее время, мс")
+    max_ms: float = Field(..., description="Максимальное время, мс")
+    last_caller: Optional[str] = Field(None, description="Метод приложения, выполнивший запрос последним")
+    last_route: Optional[str] = Field(None, description="Маршрут последнего медленного выполнения")
+    plan: Optional[List[str]] = Field(None, description="EXPLAIN QUERY PLAN")
+
+class SlowQueryReport(BaseModel):
+    threshold_ms: float = Field(..., description="Порог медленного запроса, мс")
+    items: List[SlowQueryStat] = Field(..., description="Худшие формы запросов по суммарному времени")
+
+class TaskStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    failed = "failed"
+
+class TaskResponse(BaseModel):
+    id: int = Field(..., description="Идентификатор задачи")
+    kind: str = Field(..., description="Вид задачи")
+    payload: str = Field(..., description="Параметры задачи в JSON")
+    status: TaskStatus = Field(..., description="Статус задачи")
+    attempts: int = Field(..., description="Сделано попыток")
+    max_attempts: int = Field(..., description="Допустимо попыток")
+    run_at: datetime = Field(..., description="Время следующего запуска")
+    locked_until: Optional[datetime] = Field(None, description="До какого времени задачу выполняет обработчик")
+    last_error: Optional[str] = Field(None, description="Ошибка последней попытки")
+    created_at: datetime = Field(..., description="Время постановки в очередь")
+    updated_at: datetime = Field(..., description="Время последнего изменения")
+
+    model_config = ConfigDict(from_attributes=True)
+
+class TaskCount(BaseModel):
+    kind: str = Field(..., description="Вид задачи")
+    status: TaskStatus = Field(..., description="Статус задачи")
+    count: int = Field(..., description="Количество задач")
+
+class TaskQueueStats(BaseModel):
+    pending: int = Field(..., description="Ожидают выполнения")
+    running: int = Field(..., description="Выполняются")
+    failed: int = Field(..., description="Завершились ошибкой после всех попыток")
+    items: List[TaskCount] = Field(..., description="По видам задач")
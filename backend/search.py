@@ -0,0 +1,165 @@
+"""
+Полнотекстовый поиск по описаниям фото (SQLite FTS5).
+
+Таблица photos_fts - внешний индекс над photos: текст хранится только в photos,
+а индекс поддерживают триггеры. Для индексации текст берется из представления
+photos_fts_source, где «ё» заменена на «е»: unicode61 не снимает диакритику с кириллицы.
+Сниппет строится не функцией snippet() FTS5, а из исходного описания (см. snippet):
+так в нем остается «ё», а пользовательский текст экранируется до добавления разметки.
+
+Перестроение индекса для существующих данных:
+    python search.py rebuild
+"""
+import asyncio
+import html
+import os
+import re
+import sys
+import unicodedata
+from typing import Optional
+
+# Минимальная длина основы после отбрасывания окончания
+MIN_STEM_LENGTH = 3
+# Сколько совпадений (самых новых) ранжируется по bm25. Время запроса растет с числом
+# совпадений; на 100 тыс. фото запрос из одного слова с ~4 тыс. совпадений занимает
+# ~12 мс без предела и ~8 мс с пределом 2000 (benchmarks/search.py)
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", 2000))
+# Границы совпадения в сниппете, длина сниппета в словах и сколько слов показать перед первым совпадением
+SNIPPET_OPEN = "<mark>"
+SNIPPET_CLOSE = "</mark>"
+SNIPPET_TOKENS = 12
+SNIPPET_CONTEXT = 2
+
+# Окончания русских существительных и прилагательных, от длинных к коротким
+_RUSSIAN_ENDINGS = sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ой", "ей", "ий", "ый", "ая", "яя",
+    "ое", "ее", "ые", "ие", "ую", "юю", "ов", "ев", "ом", "ем", "ам", "ям", "ах", "ях", "ию", "ия", "ья",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+
+_WORD = re.compile(r"\w+")
+_CYRILLIC_WORD = re.compile(r"[а-я]+")
+# Слово в смысле токенизатора unicode61: буквы и цифры
+_TOKEN = re.compile(r"[^\W_]+")
+
+_FTS_DDL = (
+    """CREATE VIEW IF NOT EXISTS photos_fts_source AS
+        SELECT id, replace(replace(description, 'ё', 'е'), 'Ё', 'Е') AS description FROM photos""",
+    """CREATE VIRTUAL TABLE photos_fts USING fts5(
+        description,
+        content='photos_fts_source',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )""",
+)
+
+_INDEXED = "replace(replace({row}.description, 'ё', 'е'), 'Ё', 'Е')"
+
+_TRIGGERS_DDL = (
+    f"""CREATE TRIGGER IF NOT EXISTS photos_fts_ai AFTER INSERT ON photos BEGIN
+        INSERT INTO photos_fts(rowid, description) VALUES (new.id, {_INDEXED.format(row="new")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS photos_fts_ad AFTER DELETE ON photos BEGIN
+        INSERT INTO photos_fts(photos_fts, rowid, description) VALUES ('delete', old.id, {_INDEXED.format(row="old")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS photos_fts_au AFTER UPDATE OF description ON photos BEGIN
+        INSERT INTO photos_fts(photos_fts, rowid, description) VALUES ('delete', old.id, {_INDEXED.format(row="old")});
+        INSERT INTO photos_fts(rowid, description) VALUES (new.id, {_INDEXED.format(row="new")});
+    END""",
+)
+
+REBUILD_SQL = "INSERT INTO photos_fts(photos_fts) VALUES ('rebuild')"
+
+
+def install(sync_conn):
+    """
+    Создает индекс и триггеры, если их еще нет (вызывается из init_db).
+    Только что созданный индекс сразу заполняется из существующих фото.
+    """
+    if sync_conn.dialect.name != "sqlite":
+        return
+    exists = sync_conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'photos_fts'"
+    ).first()
+    for statement in _FTS_DDL[:1] if exists else _FTS_DDL:
+        sync_conn.exec_driver_sql(statement)
+    for statement in _TRIGGERS_DDL:
+        sync_conn.exec_driver_sql(statement)
+    if not exists:
+        sync_conn.exec_driver_sql(REBUILD_SQL)
+
+
+def stem(word: str) -> str:
+    """Легкий стемминг: отбрасывает одно окончание, оставляя основу не короче MIN_STEM_LENGTH."""
+    if not _CYRILLIC_WORD.fullmatch(word):
+        return word
+    for ending in _RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def query_terms(q: str) -> list[str]:
+    """Основы слов запроса; каждая ищется как префикс слова описания."""
+    return [stem(word) for word in _WORD.findall(q.lower().replace("ё", "е"))]
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """
+    Превращает пользовательский запрос в выражение MATCH: каждое слово ищется как префикс
+    своей основы, все слова должны встретиться. Синтаксис FTS5 из запроса не пропускается.
+    """
+    terms = query_terms(q)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _fold(token: str) -> str:
+    """Слово в том виде, в каком оно лежит в индексе: нижний регистр, «е» вместо «ё», латиница без диакритики."""
+    token = token.lower().replace("ё", "е")
+    return "".join(unicodedata.normalize("NFD", char)[0] if ord(char) < 0x250 else char for char in token)
+
+
+def snippet(description: Optional[str], terms: list[str]) -> str:
+    """
+    Фрагмент исходного описания до SNIPPET_TOKENS слов, совпадения с terms обернуты
+    в SNIPPET_OPEN/SNIPPET_CLOSE. Описание пишут пользователи, поэтому текст экранируется
+    как HTML, и разметка в ответе - только выделение совпадений.
+    """
+    text = description or ""
+    tokens = list(_TOKEN.finditer(text))
+    matched = [any(_fold(token.group()).startswith(term) for term in terms) for token in tokens]
+    first = matched.index(True) if True in matched else 0
+    start = max(0, min(first - SNIPPET_CONTEXT, len(tokens) - SNIPPET_TOKENS))
+    end = min(len(tokens), start + SNIPPET_TOKENS)
+
+    parts = ["…"] if start > 0 else []
+    position = tokens[start].start() if start > 0 else 0
+    for token, hit in zip(tokens[start:end], matched[start:end]):
+        word = html.escape(token.group())
+        parts.append(html.escape(text[position:token.start()]))
+        parts.append(f"{SNIPPET_OPEN}{word}{SNIPPET_CLOSE}" if hit else word)
+        position = token.end()
+    parts.append("…" if end < len(tokens) else html.escape(text[position:]))
+    return "".join(parts)
+
+
+async def rebuild():
+    """Перестраивает индекс по текущему содержимому photos."""
+    from database import engine, dispose_engines
+
+    async with engine.begin() as conn:
+        await conn.run_sync(install)
+        await conn.exec_driver_sql(REBUILD_SQL)
+        await conn.exec_driver_sql("INSERT INTO photos_fts(photos_fts) VALUES ('optimize')")
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python search.py rebuild")
+        sys.exit(1)
+    asyncio.run(rebuild())
+    print("Search index rebuilt")
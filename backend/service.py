@@ -2,15 +2,65 @@ from models.user_model import User
 from models.photo_model import Photo
 import repository as repository
 import schemas as schemas
-from fastapi import HTTPException, File, UploadFile
+from fastapi import HTTPException
+from collections import Counter
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
-from auth_utils import hash_password, verify_password
-from repository import UserRepository, PhotoRepository
+from auth_utils import hash_password, verify_password, password_needs_rehash, invalidate_principal
+from repository import UserRepository, PhotoRepository, PhotoFileRepository, PhotoStatRepository, TaskRepository
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-import os
-import uuid
+import asyncio
+from typing import AsyncIterator, Callable, Optional, Sequence, Union
+import uploads
+import derivatives
+import file_gc
+import duplicates
+import photo_metadata
+import similarity
+import storage
+import tasks
+import archive
+import search
+import pagination
+from database import begin_write, get_db_read_session
+from cache import photo_cache
+import fast_json
+import metrics
+import time
+from fast_json import FastJSONResponse, rows_to_dicts
+
+
+async def paginate(repository, response_schema, session: AsyncSession, limit: int, cursor: Optional[str],
+                   where: Sequence = (), extra: Optional[Callable[[dict], dict]] = None) -> FastJSONResponse:
+    """
+    Страница сущностей с курсором на следующую.
+    Из базы читаются только колонки схемы ответа, а готовый ответ минует повторную проверку response_model.
+    extra - вычисляемые поля схемы ответа.
+    """
+    after = pagination.decode_cursor(cursor, len(repository.page_order))
+    # Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница
+    rows = await repository.get_page(session, limit + 1, after, where, repository.columns_for(response_schema))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_cursor(repository.page_key(rows[-1]))
+    return FastJSONResponse({"items": rows_to_dicts(rows, extra), "next_cursor": next_cursor})
+
+async def stream_ndjson(repository, response_schema, where: Sequence = (),
+                        extra: Optional[Callable[[dict], dict]] = None) -> AsyncIterator[bytes]:
+    """
+    Потоково отдает все сущности в формате NDJSON.
+    Записи читаются из базы пачками, поэтому память не растет вместе с таблицей.
+    Сессия своя: сессия запроса может закрыться раньше, чем будет отправлен ответ.
+    """
+    session = await get_db_read_session()
+    columns = repository.columns_for(response_schema)
+    try:
+        async for batch in repository.iter_batches(session, pagination.STREAM_BATCH_SIZE, where, columns):
+            yield b"".join(fast_json.dumps(item) + b"\n" for item in rows_to_dicts(batch, extra))
+    finally:
+        await session.close()
 
 
 class UserService:
@@ -37,6 +87,12 @@ class UserService:
     
     async def get_all_users(self, session: AsyncSession):
         return await self.repository.get_all(session)
+
+    async def get_users_page(self, limit: int, cursor: Optional[str], session: AsyncSession):
+        return await paginate(self.repository, schemas.UserReadResponse, session, limit, cursor)
+
+    def stream_users(self) -> AsyncIterator[bytes]:
+        return stream_ndjson(self.repository, schemas.UserReadResponse)
     
     async def get_user_by_id(self, user_id: int, session: AsyncSession):
         user = await self.repository.get_by_id(user_id, session)
@@ -56,6 +112,7 @@ class UserService:
             updated_user = await self.repository.update(user_id, update_data, session)
             if not updated_user:
                 raise HTTPException(status_code=404, detail="User not found")
+            invalidate_principal(user_id=user_id)
             return {"message": f"{self.repository.get_model_name()} updated successfully"}
         except IntegrityError as e:
             error_msg = str(e.orig)
@@ -68,13 +125,35 @@ class UserService:
         result = await self.repository.delete(user_id, session)
         if result["message"] == f"{self.repository.get_model_name()} not found":
             raise HTTPException(status_code=404, detail="User not found")
+        invalidate_principal(user_id=user_id)
         return result
 
+    def _bulk_where(self, selector: schemas.UserBulkSelector) -> list:
+        where = []
+        if selector.filter:
+            if selector.filter.role is not None:
+                where.append(User.role == selector.filter.role)
+            if selector.filter.is_active is not None:
+                where.append(User.is_active == selector.filter.is_active)
+        return where
+
+    async def update_users_bulk(self, request: schemas.UserBulkUpdateRequest, session: AsyncSession):
+        update_data = request.data.model_dump(exclude_none=True)
+        if not update_data:
+            raise HTTPException(status_code=400, detail="Nothing to update")
+        updated_ids = await self.repository.update_many(update_data, session, ids=request.ids, where=self._bulk_where(request))
+        for user_id in updated_ids:
+            invalidate_principal(user_id=user_id)
+        return {"message": "Users updated successfully", "count": len(updated_ids)}
+
+    async def delete_users_bulk(self, request: schemas.UserBulkDeleteRequest, session: AsyncSession):
+        deleted = await self.repository.delete_many(session, ids=request.ids, where=self._bulk_where(request))
+        for row in deleted:
+            invalidate_principal(user_id=row.id)
+        return {"message": "Users deleted successfully", "count": len(deleted)}
+
     async def update_user_refresh_token(self, email: str, refresh_token: str, session: AsyncSession):
-        user = await self.repository.get_by_email(email, session)
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        updated_user = await self.repository.update_refresh_token(user.id, refresh_token, session)
+        updated_user = await self.repository.update_refresh_token_by_email(email, refresh_token, session)
         if not updated_user:
             raise HTTPException(status_code=404, detail="User not found")
         return {"message": "Refresh token updated successfully"}
@@ -85,6 +164,9 @@ class UserService:
             raise HTTPException(status_code=404, detail="User not found")
         if not await verify_password(password, user.password_hashed):
             raise HTTPException(status_code=404, detail="User not found")
+        # Пароль известен только при входе, поэтому хэш со старой стоимостью обновляем здесь
+        if password_needs_rehash(user.password_hashed):
+            await self.repository.update(user.id, {"password_hashed": await hash_password(password)}, session)
         return user
 
     async def get_user_by_email(self, email: str, session: AsyncSession):
@@ -93,42 +175,199 @@ class UserService:
 class PhotoService:
     def __init__(self):
         self.repository = PhotoRepository()
+        self.file_repository = PhotoFileRepository()
+        self.stats_repository = PhotoStatRepository()
 
-    async def upload_photo(self, photo_data: schemas.PhotoCreateRequest, file: UploadFile, session: AsyncSession):
-        # Проверка на правильность расширения файла
-        extensions = [".png", ".jpg", ".jpeg", ".raw", ".tiff"]
-        _, file_extension = os.path.splitext(file.filename)
-        for ext in extensions:
-            if file_extension.lower() == ext:
-                break
-        else:
-            raise HTTPException(status_code=400, detail=f"Invalid photo format")
-        
-        # Создание пути к файлу и сохранение его на сервер
-        file_name = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join("photos", file_name)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+    async def _store_file(self, ingested: uploads.IngestedFile) -> tuple[str, bool]:
+        """
+        Сохраняет файл в хранилище до транзакции: передача в S3 может идти долго, и блокировка
+        записи SQLite на это время не берется. Ключ зависит только от содержимого, поэтому
+        уже сохраненный файл повторно не передается.
+        Возвращает путь к файлу и признак того, что файл записан этой загрузкой.
+        """
+        session = await get_db_read_session()
+        try:
+            file_path = await self.file_repository.get_path(ingested.checksum, session)
+        finally:
+            await session.close()
+        file_path = file_path or uploads.storage_path(ingested.checksum, ingested.extension)
+        if await storage.backend.exists(file_path):
+            return file_path, False
+        await storage.backend.put_file(file_path, ingested.tmp_path)
+        return file_path, True
+
+    async def _place_file(self, ingested: uploads.IngestedFile, stored_path: str, stored_new: bool, now: datetime, session: AsyncSession) -> str:
+        """
+        Добавляет ссылку на уже сохраненный файл в текущей транзакции; возвращает путь к файлу.
+        acquire берет блокировку записи. Новую запись photo_files проверяем под ней: между
+        записью файла и acquire его могла удалить сборка file_gc (последнее фото с тем же
+        содержимым удаляли), тогда файл записывается снова из временного.
+        """
+        # Одинаковые файлы хранятся один раз: для дубликата только увеличиваем счетчик ссылок
+        file_path, ref_count = await self.file_repository.acquire(ingested.checksum, stored_path, ingested.size, now, session)
+        if ref_count == 1 and not await storage.backend.exists(file_path):
+            await storage.backend.put_file(file_path, ingested.tmp_path)
+        if file_path != stored_path and stored_new:
+            # Запись photo_files появилась после проверки и указывает на другой путь: наша копия лишняя
+            file_gc.enqueue(session, [(0, ingested.checksum, stored_path)])
+        return file_path
 
-        photo = Photo(
+    async def _hash(self, ingested: uploads.IngestedFile) -> tuple[Optional[int], list[dict]]:
+        """
+        Перцептивный хэш загруженного файла и уже загруженные почти одинаковые фото.
+        При политике reject найденные дубликаты - ошибка 409.
+        """
+        phash = await duplicates.compute(ingested.tmp_path)
+        if phash is None or duplicates.NEAR_DUPLICATE_POLICY == "off":
+            return phash, []
+        near = [{"id": photo_id, "distance": distance} for photo_id, distance in duplicates.index.query(phash)]
+        if near and duplicates.NEAR_DUPLICATE_POLICY == "reject":
+            raise HTTPException(status_code=409, detail=f"Near duplicate of photo {', '.join(str(item['id']) for item in near)}")
+        return phash, near
+
+    def _build_photo(self, photo_data: schemas.PhotoCreateRequest, file_path: str, checksum: str, phash: Optional[int], now: datetime) -> Photo:
+        return Photo(
             date = photo_data.date,
             path = file_path,
+            checksum = checksum,
+            phash = duplicates.to_db(phash) if phash is not None else None,
             description = photo_data.description,
             grade = photo_data.grade,
             parallel = photo_data.parallel,
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
+            created_at=now,
+            updated_at=now
         )
+
+    def _enqueue_processing(self, photo_id: int, session: AsyncSession):
+        """Фоновая обработка нового фото; задачи сохраняются тем же коммитом, что и строка photos."""
+        tasks.enqueue(session, photo_metadata.TASK_KIND, {"photo_id": photo_id})
+        tasks.enqueue(session, derivatives.TASK_KIND, {"photo_id": photo_id})
+        tasks.enqueue(session, similarity.TASK_KIND, {"photo_id": photo_id})
+
+    async def upload_photo(self, photo_data: schemas.PhotoCreateRequest, ingested: uploads.IngestedFile, session: AsyncSession):
+        """Загрузка одного фото. ingested - принятый uploads.receive_form файл, его удаляет вызывающий."""
+        started = time.perf_counter()
+        metrics.upload_bytes.inc(amount=ingested.size)
+        phash, near_duplicates = await self._hash(ingested)
+        stored_path, stored_new = await self._store_file(ingested)
+        now = datetime.now(timezone.utc)
         try:
-            await self.repository.create(photo, session)
-            return {"message": "Photo uploaded successfully"}
-        except IntegrityError as e:
-            os.remove(file_path)
-            error_msg = str(e.orig)
-            raise HTTPException(status_code=400, detail=f"Error uploading photo: {error_msg}")
+            file_path = await self._place_file(ingested, stored_path, stored_new, now, session)
+            photo = self._build_photo(photo_data, file_path, ingested.checksum, phash, now)
+            await self.repository.create(photo, session, commit=False)
+            await self.stats_repository.apply((), [photo], session)
+            self._enqueue_processing(photo.id, session)
+            await session.commit()
+        except BaseException as e:
+            await session.rollback()
+            if stored_new:
+                # Файл мог понадобиться параллельной загрузке того же содержимого: удаляется только без ссылок
+                await file_gc.remove_unreferenced([(0, ingested.checksum, stored_path)])
+            if isinstance(e, IntegrityError):
+                raise HTTPException(status_code=400, detail=f"Error uploading photo: {e.orig}")
+            raise
+        await photo_cache.invalidate(photo.id)
+        if phash is not None:
+            duplicates.index.add(photo.id, phash)
+        similarity.matrix.set_labels(photo.id, photo.grade, photo.parallel)
+        tasks.wake()
+        metrics.upload_duration.observe(time.perf_counter() - started, "single")
+        response = {"message": "Photo uploaded successfully"}
+        if near_duplicates:
+            response["near_duplicates"] = near_duplicates
+        return response
+
+    async def upload_photos_bulk(self, items: list[tuple[Union[schemas.PhotoCreateRequest, str], uploads.ReceivedFile]], session: AsyncSession):
+        """
+        Пакетная загрузка. items - пары (метаданные или текст ошибки их валидации, принятый файл).
+        Хэши и передача в хранилище идут параллельно с ограничением BULK_UPLOAD_CONCURRENCY,
+        все строки photos вставляются одной транзакцией. Результат - по каждому элементу.
+        Временные файлы всех элементов удаляются по завершении, в том числе при ошибке.
+        """
+        started = time.perf_counter()
+        results = [{"index": index, "filename": file.filename, "success": False} for index, (_, file) in enumerate(items)]
+        semaphore = asyncio.Semaphore(uploads.BULK_UPLOAD_CONCURRENCY)
+
+        async def ingest(index: int, ingested: uploads.IngestedFile) -> Optional[tuple[uploads.IngestedFile, Optional[int], str, bool]]:
+            async with semaphore:
+                try:
+                    phash, near_duplicates = await self._hash(ingested)
+                except HTTPException as e:
+                    results[index]["error"] = e.detail
+                    return None
+                # Передача в хранилище идет параллельно и до транзакции
+                stored_path, stored_new = await self._store_file(ingested)
+            if near_duplicates:
+                results[index]["near_duplicates"] = near_duplicates
+            return ingested, phash, stored_path, stored_new
+
+        for index, (photo_data, file) in enumerate(items):
+            if not isinstance(photo_data, schemas.PhotoCreateRequest):
+                results[index]["error"] = photo_data
+            elif file.error is not None:
+                results[index]["error"] = file.error
+            else:
+                metrics.upload_bytes.inc(amount=file.ingested.size)
+        try:
+            # Все задачи доходят до конца даже при ошибке одной из них: иначе оставшиеся
+            # продолжают писать в хранилище, а их файлы уже никто не уберет
+            outcomes = await asyncio.gather(*(
+                ingest(index, file.ingested) if "error" not in results[index] else asyncio.sleep(0)
+                for index, (_, file) in enumerate(items)
+            ), return_exceptions=True)
+            pending = [(index, *item) for index, item in enumerate(outcomes) if isinstance(item, tuple)]
+            stored = [(0, ingested.checksum, stored_path) for _, ingested, _, stored_path, stored_new in pending if stored_new]
+            failures = [item for item in outcomes if isinstance(item, BaseException)]
+            if failures:
+                if stored:
+                    await file_gc.remove_unreferenced(stored)
+                raise failures[0]
+
+            now = datetime.now(timezone.utc)
+            photos = []
+            try:
+                for index, ingested, phash, stored_path, stored_new in pending:
+                    file_path = await self._place_file(ingested, stored_path, stored_new, now, session)
+                    photos.append((index, phash, self._build_photo(items[index][0], file_path, ingested.checksum, phash, now)))
+                await self.repository.create_many([photo for _, _, photo in photos], session, commit=False)
+                await self.stats_repository.apply((), [photo for _, _, photo in photos], session)
+                for _, _, photo in photos:
+                    self._enqueue_processing(photo.id, session)
+                await session.commit()
+            except BaseException as e:
+                await session.rollback()
+                # Файлы, записанные этой загрузкой, удаляются, если на них не сослалась параллельная
+                if stored:
+                    await file_gc.remove_unreferenced(stored)
+                if not isinstance(e, IntegrityError):
+                    raise
+                error_msg = f"Error uploading photo: {e.orig}"
+                for index, *_ in pending:
+                    results[index]["error"] = error_msg
+                return {"results": results}
+        finally:
+            await uploads.discard_files([file.ingested.tmp_path for _, file in items if file.ingested is not None])
+
+        for index, phash, photo in photos:
+            results[index].update(success=True, id=photo.id)
+            await photo_cache.invalidate(photo.id)
+            if phash is not None:
+                duplicates.index.add(photo.id, phash)
+            similarity.matrix.set_labels(photo.id, photo.grade, photo.parallel)
+        tasks.wake()
+        metrics.upload_duration.observe(time.perf_counter() - started, "bulk")
+        return {"results": results}
     
     async def get_all_photos(self, session: AsyncSession):
         return await self.repository.get_all(session)
+
+    async def get_photos_page(self, limit: int, cursor: Optional[str], filters: schemas.PhotoFilter, session: AsyncSession):
+        where = self.repository.filter_clauses(**filters.model_dump())
+        return await paginate(self.repository, schemas.PhotoReadResponse, session, limit, cursor, where, schemas.PhotoReadResponse.urls)
+
+    def stream_photos(self, filters: schemas.PhotoFilter) -> AsyncIterator[bytes]:
+        where = self.repository.filter_clauses(**filters.model_dump())
+        return stream_ndjson(self.repository, schemas.PhotoReadResponse, where, schemas.PhotoReadResponse.urls)
     
     async def get_photo_by_id(self, photo_id: int, session: AsyncSession):
         photo = await self.repository.get_by_id(photo_id, session)
@@ -136,6 +375,105 @@ class PhotoService:
             raise HTTPException(status_code=404, detail="Photo not found")
         return photo
 
+    async def get_photo_json(self, photo_id: int, session: AsyncSession) -> bytes:
+        """Сериализованный PhotoReadResponse через read-through кэш."""
+        async def load():
+            photo = await self.repository.get_by_id(photo_id, session)
+            if not photo:
+                return None
+            return schemas.PhotoReadResponse.model_validate(photo, from_attributes=True).model_dump_json().encode("utf-8")
+
+        data = await photo_cache.get_or_load(photo_id, load)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        return data
+
+    async def get_photo_cached(self, photo_id: int, session: AsyncSession) -> schemas.PhotoReadResponse:
+        return schemas.PhotoReadResponse.model_validate_json(await self.get_photo_json(photo_id, session))
+
+    async def get_photo_file(self, photo_id: int, variant: str, session: AsyncSession):
+        """Возвращает путь к файлу фото (оригинал или превью) и его сильный ETag."""
+        photo = await self.get_photo_cached(photo_id, session)
+        if variant == "original":
+            path = photo.path
+        else:
+            path = getattr(photo, f"{variant}_path")
+            if not path:
+                raise HTTPException(status_code=404, detail="File not found")
+        # Файлы адресуются по хэшу содержимого, он и служит ETag
+        etag = f'"{photo.checksum}-{variant}"' if photo.checksum else None
+        return photo, path, etag
+
+    async def search_photos(self, q: str, limit: int, filters: schemas.PhotoFilter, session: AsyncSession) -> FastJSONResponse:
+        """
+        Полнотекстовый поиск; читаются только колонки ответа, ORM-объекты не создаются.
+        Сниппет строится из исходного описания с экранированием (search.snippet).
+        """
+        match = search.build_match_query(q)
+        if match is None:
+            return FastJSONResponse({"items": []})
+        rows = await self.repository.search(
+            match, limit, session, self.repository.columns_for(schemas.PhotoReadResponse),
+            self.repository.filter_clauses(**filters.model_dump()),
+        )
+        terms = search.query_terms(q)
+
+        def extra(item: dict) -> dict:
+            return {**schemas.PhotoReadResponse.urls(item), "snippet": search.snippet(item["description"], terms)}
+
+        return FastJSONResponse({"items": rows_to_dicts(rows, extra)})
+
+    async def get_duplicates(self, photo_id: int, max_distance: int, session: AsyncSession) -> FastJSONResponse:
+        """Почти одинаковые фото по индексу перцептивных хэшей; из базы читаются только найденные строки."""
+        phash = duplicates.index.get(photo_id)
+        if phash is None:
+            # Хэша нет у фото, которое Pillow не прочитал, или фото не существует
+            if not await self.repository.get_many([photo_id], session, [Photo.id]):
+                raise HTTPException(status_code=404, detail="Photo not found")
+            return FastJSONResponse({"items": []})
+        distances = {found_id: distance for found_id, distance in duplicates.index.query(phash, max_distance) if found_id != photo_id}
+        rows = await self.repository.get_many(list(distances), session, self.repository.columns_for(schemas.PhotoReadResponse))
+        items = rows_to_dicts(rows, lambda item: {**schemas.PhotoReadResponse.urls(item), "distance": distances[item["id"]]})
+        items.sort(key=lambda item: (item["distance"], item["id"]))
+        return FastJSONResponse({"items": items})
+
+    async def get_similar(self, photo_id: int, limit: int, grade: Optional[int], parallel: Optional[str], session: AsyncSession) -> FastJSONResponse:
+        """Визуально похожие фото; из базы читаются только найденные строки."""
+        await similarity.refresh(session)
+        found = similarity.matrix.query(photo_id, limit, grade, parallel)
+        if found is None or not similarity.matrix.known(photo_id):
+            # Вектора еще нет (задача в очереди) или Pillow не смог прочитать файл
+            if not await self.repository.get_many([photo_id], session, [Photo.id]):
+                raise HTTPException(status_code=404, detail="Photo not found")
+            return FastJSONResponse({"items": []})
+        scores = dict(found)
+        rows = await self.repository.get_many(list(scores), session, self.repository.columns_for(schemas.PhotoReadResponse))
+        items = rows_to_dicts(rows, lambda item: {**schemas.PhotoReadResponse.urls(item), "score": scores[item["id"]]})
+        items.sort(key=lambda item: (-item["score"], item["id"]))
+        return FastJSONResponse({"items": items})
+
+    async def get_stats(self, session: AsyncSession):
+        """Сводка для главной страницы галереи: готовые строки photo_stats."""
+        rows = await self.stats_repository.get_all(session)
+        years: dict[int, int] = {}
+        for row in rows:
+            years[row.year] = years.get(row.year, 0) + row.count
+        return {
+            "total": sum(years.values()),
+            "years": [{"year": year, "count": count} for year, count in years.items()],
+            "items": rows_to_dicts(rows),
+        }
+
+    async def get_archive_entries(self, filters: schemas.PhotoFilter, session: AsyncSession) -> list[archive.ArchiveEntry]:
+        """Файлы для ZIP-выгрузки; внутри архива фото разложены по классам."""
+        rows = await self.repository.get_file_rows(session, self.repository.filter_clauses(**filters.model_dump()))
+        if not rows:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        return [
+            archive.ArchiveEntry(path=row.path, arcname=f"{row.grade}{row.parallel}/{row.date:%Y-%m-%d}_{row.id}{uploads.get_extension(row.path)}")
+            for row in rows
+        ]
+
     async def get_photo_by_grade(self, grade: int, session: AsyncSession):
         photo = await self.repository.get_by_grade(grade, session)
         if not photo:
@@ -149,15 +487,111 @@ class PhotoService:
         return photo
 
     async def update_photo(self, photo_id: int, photo_data: schemas.PhotoUpdateRequest, session: AsyncSession):
+        # Старые значения нужны сводке: фото могло перейти в другой год, класс или параллель.
+        # Читаются под блокировкой записи, иначе параллельное изменение того же фото собьет сводку
+        await begin_write(session)
         update_data = {"date": photo_data.date, "description": photo_data.description, "grade": photo_data.grade, "parallel": photo_data.parallel, "updated_at": datetime.now(timezone.utc)}
-        updated_photo = await self.repository.update(photo_id, update_data, session)
-        if not updated_photo:
+        before = await self.repository.get_stat_rows(session, ids=[photo_id])
+        if not before:
             raise HTTPException(status_code=404, detail="Photo not found")
+        after = await self.repository.update_many(update_data, session, ids=[photo_id], commit=False, returning=self.repository.stat_columns())
+        await self.stats_repository.apply(before, after, session)
+        await session.commit()
+        await photo_cache.invalidate(photo_id)
+        similarity.matrix.set_labels(photo_id, photo_data.grade, photo_data.parallel)
         return {"message": "Photo updated successfully"}
 
-    async def delete_photo(self, photo_id: int, path: str, session: AsyncSession):
-        result = await self.repository.delete(photo_id, session)
-        if result["message"] == "Photo not found":
+    async def delete_photo(self, photo_id: int, session: AsyncSession):
+        # DELETE ... RETURNING сразу отдает хэш и путь файла, предварительный SELECT не нужен
+        deleted = await self.repository.delete_many(
+            session, ids=[photo_id], returning=(*self.repository.stat_columns(), Photo.checksum, Photo.path), commit=False,
+        )
+        if not deleted:
             raise HTTPException(status_code=404, detail="Photo not found")
-        os.remove(path)
-        return result
+        checksum, path = deleted[0].checksum, deleted[0].path
+        # Файл удаляется только вместе с последней ссылкой на него, задачей после коммита (см. file_gc.py)
+        orphan_path = await self.file_repository.release(checksum, session) if checksum else path
+        if orphan_path:
+            file_gc.enqueue(session, [(photo_id, checksum, orphan_path)])
+        await self.stats_repository.apply(deleted, (), session)
+        await session.commit()
+        if orphan_path:
+            tasks.wake()
+        await photo_cache.invalidate(photo_id)
+        duplicates.index.remove(photo_id)
+        similarity.matrix.remove(photo_id)
+        return {"message": f"{self.repository.get_model_name()} deleted successfully"}
+
+    def _bulk_where(self, selector: schemas.PhotoBulkSelector) -> list:
+        return self.repository.filter_clauses(**selector.filter.model_dump()) if selector.filter else []
+
+    async def update_photos_bulk(self, request: schemas.PhotoBulkUpdateRequest, session: AsyncSession):
+        update_data = request.data.model_dump(exclude_none=True)
+        if not update_data:
+            raise HTTPException(status_code=400, detail="Nothing to update")
+        where = self._bulk_where(request)
+        if update_data.keys() & {"date", "grade", "parallel"}:
+            await begin_write(session)
+            update_data["updated_at"] = datetime.now(timezone.utc)
+            before = await self.repository.get_stat_rows(session, ids=request.ids, where=where)
+            after = await self.repository.update_many(update_data, session, ids=request.ids, where=where, commit=False,
+                                                      returning=self.repository.stat_columns())
+            await self.stats_repository.apply(before, after, session)
+            await session.commit()
+            updated_ids = [row.id for row in after]
+        else:
+            update_data["updated_at"] = datetime.now(timezone.utc)
+            updated_ids = await self.repository.update_many(update_data, session, ids=request.ids, where=where)
+        await photo_cache.invalidate(*updated_ids)
+        for photo_id in updated_ids:
+            similarity.matrix.set_labels(photo_id, update_data.get("grade"), update_data.get("parallel"))
+        return {"message": "Photos updated successfully", "count": len(updated_ids)}
+
+    async def delete_photos_bulk(self, request: schemas.PhotoBulkDeleteRequest, session: AsyncSession):
+        """
+        Удаляет фото одним DELETE и снимает ссылки на файлы в той же транзакции.
+        Файлы без ссылок удаляет одна задача очереди после коммита (см. file_gc.py).
+        """
+        deleted = await self.repository.delete_many(
+            session, ids=request.ids, where=self._bulk_where(request),
+            returning=(*self.repository.stat_columns(), Photo.checksum, Photo.path), commit=False,
+        )
+        orphans = [(row.id, None, row.path) for row in deleted if not row.checksum]
+        photo_ids = {row.checksum: row.id for row in deleted if row.checksum}
+        released = await self.file_repository.release_many(Counter(row.checksum for row in deleted if row.checksum), session)
+        orphans.extend((photo_ids[checksum], checksum, path) for checksum, path in released)
+        file_gc.enqueue(session, orphans)
+        await self.stats_repository.apply(deleted, (), session)
+        await session.commit()
+
+        if orphans:
+            tasks.wake()
+        await photo_cache.invalidate(*(row.id for row in deleted))
+        for row in deleted:
+            duplicates.index.remove(row.id)
+            similarity.matrix.remove(row.id)
+        return {"message": "Photos deleted successfully", "count": len(deleted)}
+
+
+class TaskService:
+    def __init__(self):
+        self.repository = TaskRepository()
+
+    async def get_stats(self, session: AsyncSession):
+        counts = await self.repository.stats(session)
+        totals = {status.value: 0 for status in schemas.TaskStatus}
+        for (_, status), count in counts.items():
+            totals[status] = totals.get(status, 0) + count
+        items = [{"kind": kind, "status": status, "count": count} for (kind, status), count in sorted(counts.items())]
+        return {**totals, "items": items}
+
+    async def get_tasks(self, status: Optional[schemas.TaskStatus], limit: int, session: AsyncSession):
+        return await self.repository.list(session, status=status.value if status else None, limit=limit)
+
+    async def retry_task(self, task_id: int, session: AsyncSession):
+        task = await self.repository.retry(task_id, session)
+        if not task:
+            raise HTTPException(status_code=404, detail="Failed task not found")
+        await session.commit()
+        tasks.wake()
+        return task
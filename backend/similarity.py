@@ -0,0 +1,349 @@
+"""
+Поиск визуально похожих фото по векторам признаков (см. image_processing.feature_vector).
+
+Векторы хранятся в файле-матрице float32, отображенном в память (numpy.memmap):
+строка с номером id - вектор фото с этим id, поэтому добавление и удаление меняют одну
+строку и не требуют перестройки. Запрос - одно умножение матрицы на вектор и
+argpartition для top-k. Класс и параллель всех фото держатся в памяти рядом с матрицей,
+так что фильтр - маска того же размера.
+
+Файл матрицы общий для всех воркеров, а метки и отметки о наличии векторов у каждого
+процесса свои. Перед запросом (refresh) они сверяются с файлом и базой: векторы, которые
+записал другой воркер, и фото, измененные или удаленные через другой воркер, учитываются.
+
+Векторы считает задача очереди после загрузки. Для фото, загруженных раньше
+(пока приложение остановлено - запущенное приложение не увидит новые строки):
+    python similarity.py backfill
+"""
+import asyncio
+import logging
+import os
+import sys
+from typing import Optional
+import numpy as np
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from PIL import UnidentifiedImageError
+
+import derivatives
+import image_processing
+import storage
+import tasks
+import uploads
+from database import get_db_read_session
+from models.photo_model import Photo
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_FEATURES_PATH = os.getenv("SIMILARITY_FEATURES_PATH", os.path.join(uploads.PHOTOS_DIR, "features.f32"))
+SIMILAR_DEFAULT_LIMIT = 20
+SIMILAR_MAX_LIMIT = 100
+# На сколько строк минимум расширяется файл матрицы
+GROW_ROWS = 4096
+LOAD_BATCH_SIZE = 10000
+BACKFILL_BATCH_SIZE = 100
+TASK_KIND = "features"
+
+DTYPE = np.float32
+ROW_BYTES = image_processing.FEATURE_DIM * np.dtype(DTYPE).itemsize
+# Если под фильтр попадает меньше 1/SUBSET_RATIO строк, умножаются только они
+SUBSET_RATIO = 4
+# Значение класса в маске для фото, которого нет в базе
+NO_GRADE = -1
+
+
+class FeatureMatrix:
+    """Матрица векторов по id фото с метками класса и параллели. Меняется только из потока event loop."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._matrix: Optional[np.memmap] = None
+        # Есть ли вектор в строке
+        self._present = np.zeros(0, dtype=bool)
+        self._grades = np.zeros(0, dtype=np.int16)
+        self._parallels = np.zeros(0, dtype=np.int32)
+        # Буква параллели -> код в _parallels; 0 - фото нет
+        self._parallel_codes: dict[str, int] = {}
+        # Строки после последнего известного id не участвуют в запросах: файл растет с запасом
+        self._used = 0
+
+    @property
+    def rows(self) -> int:
+        return 0 if self._matrix is None else self._matrix.shape[0]
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < ROW_BYTES:
+            with open(self.path, "wb") as f:
+                f.truncate(GROW_ROWS * ROW_BYTES)
+        rows = os.path.getsize(self.path) // ROW_BYTES
+        self._matrix = np.memmap(self.path, dtype=DTYPE, mode="r+", shape=(rows, image_processing.FEATURE_DIM))
+        # Нулевая строка - вектора нет: у настоящего вектора длина 1
+        self._present = np.any(self._matrix != 0, axis=1)
+        present = np.flatnonzero(self._present)
+        self._used = int(present[-1]) + 1 if present.size else 0
+        self._grades = np.full(rows, NO_GRADE, dtype=np.int16)
+        self._parallels = np.zeros(rows, dtype=np.int32)
+
+    def close(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+
+    def _ensure(self, photo_id: int):
+        rows = self.rows
+        if photo_id < rows:
+            return
+        capacity = max(photo_id + 1, rows * 2, rows + GROW_ROWS)
+        self._resize(capacity)
+
+    def _resize(self, capacity: int):
+        """Перестраивает отображение на capacity строк. Файл только растет: его мог расширить другой воркер."""
+        rows = self.rows
+        self._matrix.flush()
+        self._matrix = None
+        with open(self.path, "r+b") as f:
+            on_disk = os.fstat(f.fileno()).st_size // ROW_BYTES
+            if on_disk < capacity:
+                f.truncate(capacity * ROW_BYTES)
+            capacity = max(capacity, on_disk)
+        self._matrix = np.memmap(self.path, dtype=DTYPE, mode="r+", shape=(capacity, image_processing.FEATURE_DIM))
+        extra = capacity - rows
+        self._present = np.concatenate([self._present, np.zeros(extra, dtype=bool)])
+        self._grades = np.concatenate([self._grades, np.full(extra, NO_GRADE, dtype=np.int16)])
+        self._parallels = np.concatenate([self._parallels, np.zeros(extra, dtype=np.int32)])
+
+    def _parallel_code(self, parallel: str) -> int:
+        return self._parallel_codes.setdefault(parallel, len(self._parallel_codes) + 1)
+
+    def set_labels(self, photo_id: int, grade: Optional[int] = None, parallel: Optional[str] = None):
+        """Запоминает класс и параллель фото; None - оставить прежнее значение."""
+        self._ensure(photo_id)
+        self._used = max(self._used, photo_id + 1)
+        if grade is not None:
+            self._grades[photo_id] = grade
+        if parallel is not None:
+            self._parallels[photo_id] = self._parallel_code(parallel)
+
+    def put(self, photo_id: int, vector: np.ndarray):
+        self._ensure(photo_id)
+        self._used = max(self._used, photo_id + 1)
+        self._matrix[photo_id] = vector
+        self._matrix.flush()
+        self._present[photo_id] = True
+
+    def sync(self):
+        """
+        Подхватывает векторы, записанные в файл другими процессами: расширение файла
+        и векторы фото, для которых в этом процессе вектора еще не было.
+        """
+        if os.path.getsize(self.path) // ROW_BYTES > self.rows:
+            self._resize(self.rows)
+        used = self._used
+        missing = np.flatnonzero(~self._present[:used] & (self._grades[:used] != NO_GRADE))
+        if missing.size:
+            self._present[missing] = np.any(np.asarray(self._matrix[missing]) != 0, axis=1)
+
+    def labeled(self) -> int:
+        """Сколько фото с известными метками."""
+        return int(np.count_nonzero(self._grades[:self._used] != NO_GRADE))
+
+    def clear_labels(self):
+        self._grades[:] = NO_GRADE
+        self._parallels[:] = 0
+
+    def has(self, photo_id: int) -> bool:
+        """Есть ли вектор для фото."""
+        return photo_id < self.rows and bool(self._present[photo_id])
+
+    def known(self, photo_id: int) -> bool:
+        """Есть ли фото в базе (известны ли его метки)."""
+        return photo_id < self.rows and self._grades[photo_id] != NO_GRADE
+
+    def remove(self, photo_id: int):
+        if photo_id >= self.rows:
+            return
+        if self._present[photo_id]:
+            self._matrix[photo_id] = 0
+            self._matrix.flush()
+            self._present[photo_id] = False
+        self._grades[photo_id] = NO_GRADE
+        self._parallels[photo_id] = 0
+
+    def query(self, photo_id: int, limit: int, grade: Optional[int] = None, parallel: Optional[str] = None) -> Optional[list[tuple[int, float]]]:
+        """
+        (id фото, косинусная близость) самых похожих на фото photo_id, от самых похожих.
+        None - для фото нет вектора.
+        """
+        if not self.has(photo_id):
+            return None
+        used = self._used
+        mask = self._present[:used] & (self._grades[:used] != NO_GRADE)
+        if grade is not None:
+            mask &= self._grades[:used] == grade
+        if parallel is not None:
+            code = self._parallel_codes.get(parallel)
+            if code is None:
+                return []
+            mask &= self._parallels[:used] == code
+        mask[photo_id] = False
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+
+        vector = np.asarray(self._matrix[photo_id])
+        if candidates.size * SUBSET_RATIO < mask.size:
+            # Узкий фильтр: дешевле собрать нужные строки, чем умножать всю матрицу
+            scores = np.asarray(self._matrix[candidates]) @ vector
+        else:
+            scores = (np.asarray(self._matrix[:used]) @ vector)[candidates]
+        k = min(limit, candidates.size)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[index]), float(scores[index])) for index in top]
+
+
+matrix = FeatureMatrix(SIMILARITY_FEATURES_PATH)
+# Состояние photos при последней сверке меток: (число фото, max id, max updated_at)
+_labels_state: Optional[tuple] = None
+
+
+async def _labels_snapshot(session: AsyncSession) -> tuple:
+    # count(grade): фото без класса в матрице не участвуют, см. FeatureMatrix.set_labels
+    result = await session.execute(select(func.count(Photo.grade), func.max(Photo.id), func.max(Photo.updated_at)))
+    return tuple(result.one())
+
+
+async def _read_labels(session: AsyncSession, *where) -> list:
+    labels = []
+    last_id = 0
+    while True:
+        result = await session.execute(
+            select(Photo.id, Photo.grade, Photo.parallel)
+            .where(Photo.id > last_id, *where)
+            .order_by(Photo.id)
+            .limit(LOAD_BATCH_SIZE)
+        )
+        rows = result.all()
+        if not rows:
+            return labels
+        labels.extend(rows)
+        last_id = rows[-1].id
+
+
+def _apply_labels(rows: list, replace: bool = False):
+    # Без await между очисткой и заполнением: параллельный запрос не увидит пустые метки
+    if replace:
+        matrix.clear_labels()
+    for photo_id, grade, parallel in rows:
+        matrix.set_labels(photo_id, grade, parallel)
+
+
+async def load():
+    """Открывает матрицу и загружает метки всех фото из базы (при старте приложения)."""
+    global _labels_state
+    matrix.open()
+    session = await get_db_read_session()
+    try:
+        _labels_state = await _labels_snapshot(session)
+        _apply_labels(await _read_labels(session))
+    finally:
+        await session.close()
+
+
+async def refresh(session: AsyncSession):
+    """
+    Сверяет матрицу с файлом и базой перед запросом. Если photos не менялась с прошлой
+    сверки, это один запрос по индексам. Иначе перечитываются новые и измененные фото,
+    а если число фото с метками разошлось с базой (фото удаляли) - метки всех фото.
+    """
+    global _labels_state
+    matrix.sync()
+    state = await _labels_snapshot(session)
+    if state == _labels_state:
+        return
+    if _labels_state is not None:
+        _, last_id, last_updated_at = _labels_state
+        changed = [Photo.id > (last_id or 0)]
+        if last_updated_at is not None:
+            changed.append(Photo.updated_at >= last_updated_at)
+        _apply_labels(await _read_labels(session, or_(*changed)))
+    if _labels_state is None or matrix.labeled() != state[0]:
+        _apply_labels(await _read_labels(session), replace=True)
+    _labels_state = state
+    # Векторы фото, о которых процесс узнал только сейчас
+    matrix.sync()
+
+
+async def compute(path: str) -> np.ndarray:
+    """Вектор признаков оригинала фото по его пути в хранилище."""
+    loop = asyncio.get_running_loop()
+    async with storage.local_file(path) as local_path:
+        data = await loop.run_in_executor(derivatives.get_executor(), image_processing.feature_vector, local_path)
+    return np.frombuffer(data, dtype=DTYPE)
+
+
+async def _get_photo(photo_id: int, *columns):
+    session = await get_db_read_session()
+    try:
+        result = await session.execute(select(*columns).where(Photo.id == photo_id))
+        return result.first()
+    finally:
+        await session.close()
+
+
+@tasks.handler(TASK_KIND)
+async def compute_for_photo(payload: dict):
+    photo_id = payload["photo_id"]
+    photo = await _get_photo(photo_id, Photo.path)
+    if photo is None:
+        return
+    try:
+        vector = await compute(photo.path)
+    except (FileNotFoundError, UnidentifiedImageError) as e:
+        raise tasks.PermanentTaskError(str(e)) from e
+    # Фото могли удалить, пока считался вектор. Проверяется база, а не метки в памяти:
+    # задачу может выполнять воркер, который о фото еще не знает
+    photo = await _get_photo(photo_id, Photo.grade, Photo.parallel)
+    if photo is None:
+        return
+    matrix.set_labels(photo_id, photo.grade, photo.parallel)
+    matrix.put(photo_id, vector)
+
+
+async def backfill(batch_size: int = BACKFILL_BATCH_SIZE):
+    """Считает векторы для всех фото, у которых их еще нет."""
+    matrix.open()
+    last_id = 0
+    processed = 0
+    while True:
+        session = await get_db_read_session()
+        try:
+            result = await session.execute(
+                select(Photo.id, Photo.path).where(Photo.id > last_id).order_by(Photo.id).limit(batch_size)
+            )
+            rows = result.all()
+        finally:
+            await session.close()
+        if not rows:
+            break
+        missing = [row for row in rows if not matrix.has(row.id)]
+        vectors = await asyncio.gather(*(compute(row.path) for row in missing), return_exceptions=True)
+        for row, vector in zip(missing, vectors):
+            if isinstance(vector, Exception):
+                logger.error("Failed to compute features for photo %s: %s", row.id, vector)
+            else:
+                matrix.put(row.id, vector)
+        last_id = rows[-1].id
+        processed += len(rows)
+        print(f"Processed {processed} photos")
+    matrix.close()
+    await derivatives.shutdown()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python similarity.py backfill")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(backfill())
@@ -0,0 +1,138 @@
+"""
+Журнал медленных SQL-запросов вместо echo.
+
+Запросы дольше SLOW_QUERY_THRESHOLD_MS пишутся в лог с параметрами, маршрутом,
+методом приложения, из которого выполнен запрос, и планом SQLite (EXPLAIN QUERY PLAN).
+Статистика по «формам» запросов (текст без конкретного числа параметров в IN)
+хранится в памяти; худшие формы отдает административный маршрут.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from typing import Optional
+import greenlet
+from sqlalchemy import event
+
+import metrics
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 100))
+SLOW_QUERY_TOP_N = int(os.getenv("SLOW_QUERY_TOP_N", 20))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+# Сколько разных форм запросов помнить; при переполнении вытесняются самые дешевые
+SLOW_QUERY_MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES", 500))
+# Ограничение длины параметров в логе
+MAX_PARAMS_LENGTH = 500
+
+logger = logging.getLogger("slow_query")
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_MODULES = {__name__, "metrics", "database"}
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+# Форма запроса -> статистика; меняется только из потока event loop
+_shapes: dict[str, dict] = {}
+
+
+def statement_shape(statement: str) -> str:
+    """Нормализует текст запроса: пробелы и списки параметров в IN (...) разной длины сводятся к одному виду."""
+    return _PLACEHOLDER_LIST.sub("?, ...", _WHITESPACE.sub(" ", statement).strip())
+
+
+def _frames():
+    """
+    Стек вызова с продолжением в родительских greenlet: SQLAlchemy выполняет синхронную часть
+    запроса в отдельном greenlet, а вызвавшая его корутина остается в стеке родителя.
+    """
+    frame = sys._getframe(2)
+    current = greenlet.getcurrent()
+    while current is not None:
+        while frame is not None:
+            yield frame
+            frame = frame.f_back
+        current = current.parent
+        frame = current.gr_frame if current is not None else None
+
+
+def _caller() -> Optional[str]:
+    """Ближайший метод приложения в стеке."""
+    for frame in _frames():
+        module = frame.f_globals.get("__name__", "")
+        filename = frame.f_code.co_filename
+        if module not in _SKIP_MODULES and filename.startswith(_APP_DIR) and "site-packages" not in filename:
+            return f"{module}.{frame.f_code.co_qualname}:{frame.f_lineno}"
+    return None
+
+
+def _explain(conn, statement: str, parameters) -> list[str]:
+    try:
+        # Отдельный курсор того же соединения: результаты исходного запроса еще не прочитаны
+        explain_cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            explain_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return [row[-1] for row in explain_cursor.fetchall()]
+        finally:
+            explain_cursor.close()
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+
+
+def _record(shape: str, elapsed_ms: float, caller: Optional[str], route: Optional[str], plan: Optional[list[str]]):
+    item = _shapes.get(shape)
+    if item is None:
+        if len(_shapes) >= SLOW_QUERY_MAX_SHAPES:
+            del _shapes[min(_shapes, key=lambda key: _shapes[key]["total_ms"])]
+        item = _shapes[shape] = {"statement": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0}
+    item["count"] += 1
+    item["total_ms"] += elapsed_ms
+    item["max_ms"] = max(item["max_ms"], elapsed_ms)
+    item["last_caller"] = caller
+    item["last_route"] = route
+    if plan is not None:
+        item["plan"] = plan
+
+
+def instrument_engine(engine):
+    """Подключает к движку журнал медленных запросов."""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["slow_query_started"].pop()) * 1000
+        if elapsed_ms < SLOW_QUERY_THRESHOLD_MS:
+            return
+        caller = _caller()
+        route = metrics.current_route()
+        plan = None
+        if SLOW_QUERY_EXPLAIN and not executemany and conn.dialect.name == "sqlite" \
+                and statement.lstrip()[:6].upper().startswith(_EXPLAINABLE):
+            plan = _explain(conn, statement, parameters)
+        _record(statement_shape(statement), elapsed_ms, caller, route, plan)
+        logger.warning(
+            "Slow query %.1f ms route=%s caller=%s\n%s\nparams: %s%s",
+            elapsed_ms, route, caller, statement, repr(parameters)[:MAX_PARAMS_LENGTH],
+            "".join(f"\nplan: {line}" for line in plan) if plan else "",
+        )
+
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("slow_query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", handle_error)
+
+
+def top(limit: int = SLOW_QUERY_TOP_N) -> list[dict]:
+    """Худшие формы запросов по суммарному времени."""
+    items = sorted(_shapes.values(), key=lambda item: item["total_ms"], reverse=True)[:limit]
+    return [{**item, "avg_ms": item["total_ms"] / item["count"]} for item in items]
+
+
+def reset():
+    _shapes.clear()
@@ -0,0 +1,392 @@
+"""
+Хранилище оригиналов фото.
+
+Ключ файла - строка из photos.path / photo_files.path. Сервисы работают с оригиналами
+только через backend этого модуля: put (потоковая запись), get (потоковое чтение
+диапазона байт), delete, exists и size. Превью (derivatives.py) и временные файлы
+загрузки всегда лежат на локальном диске.
+
+Хранилище выбирается переменной STORAGE_BACKEND:
+    local  - файлы на диске в PHOTOS_DIR (по умолчанию);
+    memory - в памяти процесса, для тестов и бенчмарков;
+    s3     - S3-совместимое объектное хранилище (AWS S3, MinIO), нужен пакет aiobotocore.
+             Учетные данные берутся из стандартных переменных AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Callable, Optional
+
+import uploads
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", 1024 * 1024))
+S3_BUCKET = os.getenv("S3_BUCKET", "memory-gallery")
+# Адрес S3-совместимого сервера (например, http://localhost:9000 для MinIO); пусто - AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+# Файлы больше порога загружаются частями (multipart upload); минимальный размер части в S3 - 5 МБ
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024))
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024))
+# Сколько частей одного файла отправляется параллельно
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", 4))
+# Максимум ключей в одном запросе DeleteObjects
+S3_DELETE_BATCH = 1000
+
+
+async def file_chunks(path: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Читает локальный файл по чанкам в пуле потоков; end - не включая."""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        if start:
+            await asyncio.to_thread(f.seek, start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = STORAGE_CHUNK_SIZE if remaining is None else min(STORAGE_CHUNK_SIZE, remaining)
+            chunk = await asyncio.to_thread(f.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+class StorageBackend(ABC):
+    """Хранилище файлов по строковым ключам."""
+
+    @abstractmethod
+    async def put(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        """Сохраняет поток чанков под ключом key (заменяя прежнее содержимое). Возвращает размер."""
+
+    @abstractmethod
+    def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Асинхронный генератор чанков файла с байта start до end (не включая).
+        Если файла нет - FileNotFoundError при первом чтении.
+        """
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """Размер файла в байтах; None - файла нет."""
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        """Удаляет файлы; отсутствующие ключи не ошибка."""
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def put_file(self, key: str, path: str):
+        """Сохраняет локальный файл path под ключом key. Файл path остается, его удаляет вызывающий код."""
+        await self.put(key, file_chunks(path))
+
+    async def local_path(self, key: str) -> Optional[str]:
+        """Путь к файлу на локальном диске, если хранилище его дает (для zero-copy отдачи и Pillow)."""
+        return None
+
+    async def close(self):
+        pass
+
+
+def _move_into(source: str, target: str):
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    os.replace(source, target)
+
+
+def _link_into(source: str, target: str):
+    """Копирует source в target без копирования данных: жесткая ссылка под временным именем и os.replace."""
+    os.makedirs(uploads.UPLOAD_TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(uploads.UPLOAD_TMP_DIR, f"{uuid.uuid4()}.part")
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        # Файловая система без жестких ссылок
+        shutil.copyfile(source, tmp_path)
+    try:
+        _move_into(tmp_path, target)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class LocalStorage(StorageBackend):
+    """
+    Файлы на локальном диске; ключ - путь к файлу. Блокирующие вызовы выполняются в пуле потоков.
+    Чтение находит файл и в старой плоской структуре PHOTOS_DIR (см. uploads.resolve_path).
+    """
+
+    async def put(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        # Запись во временный файл и os.replace: читатели не увидят файл недописанным
+        await asyncio.to_thread(os.makedirs, uploads.UPLOAD_TMP_DIR, exist_ok=True)
+        tmp_path = os.path.join(uploads.UPLOAD_TMP_DIR, f"{uuid.uuid4()}.part")
+        size = 0
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                size += len(chunk)
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(_move_into, tmp_path, key)
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            await uploads.discard_file(tmp_path)
+            raise
+        return size
+
+    async def put_file(self, key: str, path: str):
+        # Временные файлы загрузки лежат на той же ФС: ссылка без копирования данных
+        await asyncio.to_thread(_link_into, path, key)
+
+    async def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        path = await self.local_path(key)
+        async for chunk in file_chunks(path, start, end):
+            yield chunk
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return (await asyncio.to_thread(os.stat, await self.local_path(key))).st_size
+        except FileNotFoundError:
+            return None
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, await self.local_path(key))
+
+    async def delete(self, *keys: str):
+        await uploads.discard_files(list(keys))
+
+    async def local_path(self, key: str) -> str:
+        return await asyncio.to_thread(uploads.resolve_path, key)
+
+
+class MemoryStorage(StorageBackend):
+    """Файлы в памяти процесса - для тестов и бенчмарков."""
+
+    def __init__(self):
+        self._files: dict[str, bytes] = {}
+
+    async def put(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        data = b"".join([chunk async for chunk in chunks])
+        self._files[key] = data
+        return len(data)
+
+    async def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        data = self._files.get(key)
+        if data is None:
+            raise FileNotFoundError(key)
+        view = memoryview(data)[start:end]
+        for offset in range(0, len(view), STORAGE_CHUNK_SIZE):
+            yield bytes(view[offset:offset + STORAGE_CHUNK_SIZE])
+
+    async def size(self, key: str) -> Optional[int]:
+        data = self._files.get(key)
+        return None if data is None else len(data)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._files.pop(key, None)
+
+
+def _is_not_found(error: Exception) -> bool:
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class _MultipartUpload:
+    """
+    Загрузка одного объекта частями. До concurrency частей отправляются параллельно;
+    send ждет свободного места, поэтому чтение источника не убегает вперед и в памяти
+    не больше concurrency + 1 частей.
+    """
+
+    def __init__(self, client, bucket: str, key: str, upload_id: str, concurrency: int):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = upload_id
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: list[asyncio.Task] = []
+
+    async def _upload_part(self, number: int, body: bytes) -> dict:
+        try:
+            response = await self.client.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body,
+            )
+            return {"ETag": response["ETag"], "PartNumber": number}
+        finally:
+            self._semaphore.release()
+
+    async def send(self, body: bytes):
+        await self._semaphore.acquire()
+        # Если какая-то часть уже не загрузилась, дальше читать источник незачем
+        for task in self._tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                self._semaphore.release()
+                raise task.exception()
+        self._tasks.append(asyncio.create_task(self._upload_part(len(self._tasks) + 1, body)))
+
+    async def complete(self):
+        parts = await asyncio.gather(*self._tasks)
+        await self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts},
+        )
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            # Незавершенные загрузки удалит правило жизненного цикла бакета
+            logger.warning("Cannot abort multipart upload %s for %s: %s", self.upload_id, self.key, e)
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-совместимое объектное хранилище; ключ объекта - путь из photos.path.
+    client_factory возвращает асинхронный контекстный менеджер клиента с интерфейсом aiobotocore
+    (put_object, get_object, head_object, delete_objects и методы multipart upload), в том числе
+    локальной заглушки. Файлы больше multipart_threshold загружаются частями по part_size,
+    до concurrency частей параллельно.
+    """
+
+    def __init__(self, client_factory: Callable, bucket: str, part_size: int = S3_PART_SIZE,
+                 multipart_threshold: int = S3_MULTIPART_THRESHOLD, concurrency: int = S3_UPLOAD_CONCURRENCY):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        self.part_size = part_size
+        self.multipart_threshold = max(multipart_threshold, part_size)
+        self.concurrency = concurrency
+        self._context = None
+        self._client = None
+        self._lock = asyncio.Lock()
+
+    async def _get_client(self):
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    context = self.client_factory()
+                    self._client = await context.__aenter__()
+                    self._context = context
+        return self._client
+
+    async def close(self):
+        if self._context is not None:
+            context, self._context, self._client = self._context, None, None
+            await context.__aexit__(None, None, None)
+
+    async def put(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        client = await self._get_client()
+        buffer = bytearray()
+        size = 0
+        upload: Optional[_MultipartUpload] = None
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                if upload is None:
+                    if len(buffer) < self.multipart_threshold:
+                        continue
+                    response = await client.create_multipart_upload(Bucket=self.bucket, Key=key)
+                    upload = _MultipartUpload(client, self.bucket, key, response["UploadId"], self.concurrency)
+                while len(buffer) >= self.part_size:
+                    await upload.send(bytes(buffer[:self.part_size]))
+                    del buffer[:self.part_size]
+            if upload is None:
+                await client.put_object(Bucket=self.bucket, Key=key, Body=bytes(buffer))
+                return size
+            if buffer:
+                await upload.send(bytes(buffer))
+            await upload.complete()
+        except BaseException:
+            if upload is not None:
+                await upload.abort()
+            raise
+        return size
+
+    async def get(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        if end is not None and end <= start:
+            return
+        client = await self._get_client()
+        params = {}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        try:
+            response = await client.get_object(Bucket=self.bucket, Key=key, **params)
+        except Exception as e:
+            if _is_not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        body = response["Body"]
+        try:
+            while chunk := await body.read(STORAGE_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    async def size(self, key: str) -> Optional[int]:
+        client = await self._get_client()
+        try:
+            response = await client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+        return response["ContentLength"]
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        client = await self._get_client()
+        for offset in range(0, len(keys), S3_DELETE_BATCH):
+            objects = [{"Key": key} for key in keys[offset:offset + S3_DELETE_BATCH]]
+            await client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+
+def create_backend() -> StorageBackend:
+    """Выбирает хранилище по переменной окружения STORAGE_BACKEND (local | memory | s3)."""
+    if STORAGE_BACKEND == "s3":
+        from aiobotocore.session import get_session
+        session = get_session()
+        return S3Storage(lambda: session.create_client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION), S3_BUCKET)
+    if STORAGE_BACKEND == "memory":
+        return MemoryStorage()
+    return LocalStorage()
+
+
+backend = create_backend()
+
+
+@asynccontextmanager
+async def local_file(key: str) -> AsyncIterator[str]:
+    """
+    Путь к локальной копии файла для кода, которому нужен файл на диске (Pillow в пуле процессов).
+    Для локального хранилища - сам файл, для остальных - временная копия, удаляемая после выхода.
+    """
+    path = await backend.local_path(key)
+    if path is not None:
+        yield path
+        return
+    await asyncio.to_thread(os.makedirs, uploads.UPLOAD_TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(uploads.UPLOAD_TMP_DIR, f"{uuid.uuid4()}{uploads.get_extension(key)}")
+    try:
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in backend.get(key):
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        yield tmp_path
+    finally:
+        await uploads.discard_file(tmp_path)
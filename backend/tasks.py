@@ -0,0 +1,172 @@
+"""
+Очередь фоновых задач в той же базе SQLite.
+
+Задача - строка таблицы tasks: вид, параметры в JSON, статус и время следующего запуска.
+enqueue добавляет задачу в сессию вызывающего кода, поэтому она сохраняется в той же
+транзакции, что и данные, к которым относится: после коммита загрузки задача не потеряется
+даже при падении процесса. Обработчики выполняют TASK_WORKERS корутин в API-процессе.
+
+Захват задачи выдает аренду на TASK_LEASE_SECONDS; если процесс упал, не завершив задачу,
+после истечения аренды ее заберет другой обработчик. Поэтому обработчики должны быть
+идемпотентными. Ошибка - повтор с экспоненциальной задержкой, после TASK_MAX_ATTEMPTS
+попыток (или сразу при PermanentTaskError) задача остается в статусе failed.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import metrics
+from database import get_db_session
+from models.task_model import Task
+from repository import TaskRepository
+
+logger = logging.getLogger(__name__)
+
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", 2))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", 5))
+TASK_BACKOFF_BASE_SECONDS = float(os.getenv("TASK_BACKOFF_BASE_SECONDS", 5))
+TASK_BACKOFF_MAX_SECONDS = float(os.getenv("TASK_BACKOFF_MAX_SECONDS", 3600))
+# Как часто проверять очередь, если новых задач в этом процессе не ставили
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", 5))
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", 300))
+# Сколько ждать выполняющиеся задачи при остановке; незавершенные вернутся в очередь по аренде
+TASK_SHUTDOWN_TIMEOUT = float(os.getenv("TASK_SHUTDOWN_TIMEOUT", 10))
+# Ограничение длины текста ошибки, сохраняемого в задаче
+MAX_ERROR_LENGTH = 2000
+
+Handler = Callable[[dict], Awaitable[Any]]
+
+_handlers: dict[str, Handler] = {}
+_workers: list[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+
+
+class PermanentTaskError(Exception):
+    """Ошибка, которую повтор не исправит (например, файл не является изображением)."""
+
+
+def handler(kind: str):
+    """Декоратор: регистрирует async-функцию обработчиком задач вида kind; она получает параметры задачи."""
+    def register(func: Handler) -> Handler:
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(session: AsyncSession, kind: str, payload: dict, max_attempts: int = TASK_MAX_ATTEMPTS) -> Task:
+    """
+    Добавляет задачу в сессию; сохраняется она коммитом вызывающего кода.
+    После коммита стоит вызвать wake(), чтобы обработчики не ждали очередного опроса.
+    """
+    now = datetime.now(timezone.utc)
+    task = Task(kind=kind, payload=json.dumps(payload), status="pending", attempts=0, max_attempts=max_attempts,
+                run_at=now, created_at=now, updated_at=now)
+    session.add(task)
+    return task
+
+
+def wake():
+    """Будит обработчики этого процесса."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def backoff(attempts: int) -> float:
+    """Задержка перед следующей попыткой, секунды: экспонента с разбросом, чтобы повторы не шли пачкой."""
+    delay = min(TASK_BACKOFF_MAX_SECONDS, TASK_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def _finish(task: Task, error: Optional[BaseException], repository: TaskRepository):
+    session = await get_db_session()
+    try:
+        if error is None:
+            await repository.complete(task.id, session)
+            outcome = "completed"
+        else:
+            message = f"{type(error).__name__}: {error}"[:MAX_ERROR_LENGTH]
+            if isinstance(error, PermanentTaskError) or task.attempts >= task.max_attempts:
+                await repository.fail(task.id, message, session)
+                outcome = "failed"
+                logger.error("Task %s (%s) failed after %s attempts: %s", task.id, task.kind, task.attempts, message)
+            else:
+                run_at = datetime.now(timezone.utc) + timedelta(seconds=backoff(task.attempts))
+                await repository.reschedule(task.id, run_at, message, session)
+                outcome = "retried"
+                logger.warning("Task %s (%s) attempt %s failed, retry at %s: %s", task.id, task.kind, task.attempts, run_at, message)
+        await session.commit()
+    finally:
+        await session.close()
+    metrics.task_runs.inc(task.kind, outcome)
+
+
+async def run_next(repository: Optional[TaskRepository] = None) -> bool:
+    """Выполняет одну готовую задачу. False - очередь пуста."""
+    repository = repository or TaskRepository()
+    session = await get_db_session()
+    try:
+        task = await repository.claim(datetime.now(timezone.utc), timedelta(seconds=TASK_LEASE_SECONDS), session)
+        await session.commit()
+    finally:
+        await session.close()
+    if task is None:
+        return False
+
+    func = _handlers.get(task.kind)
+    error = None
+    try:
+        if func is None:
+            raise PermanentTaskError(f"No handler for task kind {task.kind!r}")
+        await func(json.loads(task.payload))
+    except asyncio.CancelledError:
+        # Остановка приложения: задача вернется в очередь, когда истечет аренда
+        raise
+    except Exception as e:
+        error = e
+    await _finish(task, error, repository)
+    return True
+
+
+async def _worker():
+    repository = TaskRepository()
+    while not _stopping:
+        # Сброс до выборки: wake() во время выборки не потеряется
+        _wakeup.clear()
+        try:
+            if await run_next(repository):
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Task worker error")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), TASK_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start():
+    """Запускает обработчики в текущем event loop (из lifespan приложения)."""
+    global _wakeup, _stopping
+    _stopping = False
+    _wakeup = asyncio.Event()
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(TASK_WORKERS))
+
+
+async def stop():
+    """Дает выполняющимся задачам завершиться за TASK_SHUTDOWN_TIMEOUT, остальные прерывает."""
+    global _stopping
+    _stopping = True
+    wake()
+    if _workers:
+        _, still_running = await asyncio.wait(_workers, timeout=TASK_SHUTDOWN_TIMEOUT)
+        for worker in still_running:
+            worker.cancel()
+        await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,33 @@
+"""
+Общие настройки тестов. Модули приложения читают переменные окружения при импорте,
+поэтому база и каталог фото указываются во временном каталоге до первого импорта.
+"""
+import contextlib
+import io
+import os
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="memorygallery-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ["PHOTOS_DIR"] = os.path.join(_TMP_DIR, "photos")
+
+
+def jpeg(seed: int, size: int = 16) -> bytes:
+    """Маленький JPEG с разным для разных seed содержимым."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (seed % 256, seed * 7 % 256, seed * 13 % 256)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@contextlib.asynccontextmanager
+async def app_client():
+    """Приложение с выполненным lifespan и клиент к нему через ASGI-транспорт, без сети."""
+    import httpx
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
@@ -0,0 +1,205 @@
+"""
+Тесты кэша (cache.py). Запуск из каталога backend:
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from cache import LocalCacheBackend, ReadThroughCache, RedisCacheBackend, TTLCache
+
+
+class FakeRedis:
+    """Заглушка клиента redis.asyncio: get, set(px=...), delete."""
+
+    def __init__(self):
+        self.data: dict[str, bytes] = {}
+        self.ttls: dict[str, int] = {}
+
+    async def get(self, name):
+        return self.data.get(name)
+
+    async def set(self, name, value, px=None):
+        self.data[name] = value
+        self.ttls[name] = px
+
+    async def delete(self, *names):
+        for name in names:
+            self.data.pop(name, None)
+
+
+class FailingBackend(LocalCacheBackend):
+    async def get(self, key):
+        raise ConnectionError("down")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("down")
+
+
+class InvalidatingBackend(LocalCacheBackend):
+    """Вызывает invalidate сразу после первой записи значения: изменение между проверкой версии и set."""
+
+    def __init__(self):
+        super().__init__(maxsize=100)
+        self.cache = None
+        self.triggered = False
+
+    async def set(self, key, value, ttl):
+        await super().set(key, value, ttl)
+        if not self.triggered and ":version:" not in key:
+            self.triggered = True
+            await self.cache.invalidate(1)
+
+
+def _loader(values: list):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return values[len(calls) - 1]
+    return load, calls
+
+
+@pytest.mark.parametrize("backend", [LocalCacheBackend(maxsize=100), RedisCacheBackend(FakeRedis())])
+def test_read_through(backend):
+    cache = ReadThroughCache(backend, namespace="photo", ttl=60)
+    load, calls = _loader([b"v1", b"v2"])
+
+    async def run():
+        assert await cache.get_or_load(1, load) == b"v1"
+        assert await cache.get_or_load(1, load) == b"v1"
+        await cache.invalidate(1)
+        assert await cache.get_or_load(1, load) == b"v2"
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.stats() == {"namespace": "photo", "hits": 1, "misses": 2, "errors": 0, "stale_skips": 0}
+
+
+def test_none_is_not_cached():
+    cache = ReadThroughCache(LocalCacheBackend(maxsize=100), namespace="photo", ttl=60)
+    load, calls = _loader([None, b"v"])
+
+    async def run():
+        assert await cache.get_or_load(1, load) is None
+        assert await cache.get_or_load(1, load) == b"v"
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_invalidate_during_load_skips_stale_value():
+    cache = ReadThroughCache(LocalCacheBackend(maxsize=100), namespace="photo", ttl=60)
+    calls = []
+
+    async def stale_load():
+        # Строка прочитана до коммита изменения, а invalidate пришел, пока шла загрузка
+        calls.append(1)
+        await cache.invalidate(1)
+        return b"old"
+
+    async def fresh_load():
+        calls.append(1)
+        return b"new"
+
+    async def run():
+        assert await cache.get_or_load(1, stale_load) == b"old"
+        assert await cache.get_or_load(1, fresh_load) == b"new"
+        assert await cache.get_or_load(1, fresh_load) == b"new"
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.stale_skips == 1
+
+
+def test_invalidate_after_check_removes_written_value():
+    backend = InvalidatingBackend()
+    cache = ReadThroughCache(backend, namespace="photo", ttl=60)
+    backend.cache = cache
+    load, calls = _loader([b"old", b"new"])
+
+    async def run():
+        assert await cache.get_or_load(1, load) == b"old"
+        assert await cache.get_or_load(1, load) == b"new"
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.stale_skips == 1
+
+
+def test_concurrent_loads_of_other_keys_are_cached():
+    cache = ReadThroughCache(LocalCacheBackend(maxsize=100), namespace="photo", ttl=60)
+
+    async def load_slowly(value: bytes):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def run():
+        first = asyncio.gather(*(cache.get_or_load(key, lambda key=key: load_slowly(str(key).encode())) for key in range(5)))
+        await asyncio.sleep(0)
+        await cache.invalidate(2)
+        await first
+        return [await cache.backend.get(cache._key(key)) for key in range(5)]
+
+    assert asyncio.run(run()) == [b"0", b"1", None, b"3", b"4"]
+
+
+def test_backend_errors_count_as_misses():
+    cache = ReadThroughCache(FailingBackend(maxsize=100), namespace="photo", ttl=60)
+    load, calls = _loader([b"v1", b"v2"])
+
+    async def run():
+        assert await cache.get_or_load(1, load) == b"v1"
+        assert await cache.get_or_load(1, load) == b"v2"
+        await cache.invalidate(1)
+
+    asyncio.run(run())
+    assert cache.stats()["errors"] == 5
+    assert cache.stats()["misses"] == 2
+
+
+def test_redis_backend_sets_ttl_in_milliseconds():
+    client = FakeRedis()
+    cache = ReadThroughCache(RedisCacheBackend(client), namespace="photo", ttl=1.5)
+
+    async def run():
+        await cache.get_or_load(7, lambda: asyncio.sleep(0, b"v"))
+
+    asyncio.run(run())
+    assert client.data["photo:7"] == b"v"
+    assert client.ttls["photo:7"] == 1500
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" вытеснен как давно не использованный
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 2, "misses": 2}
+
+
+def test_principal_loaded_before_invalidation_is_not_cached():
+    import time
+    from types import SimpleNamespace
+
+    import auth_utils
+
+    principal = SimpleNamespace(id=9001, email="race@example.com", is_active=True)
+    generation = auth_utils.principal_generation()
+    # Пользователя деактивировали, пока его строка читалась из базы
+    auth_utils.invalidate_principal(user_id=principal.id)
+    auth_utils.cache_principal(principal, expires_at=time.time() + 60, generation=generation)
+    assert auth_utils.get_cached_principal(principal.email) is None
+
+    auth_utils.cache_principal(principal, expires_at=time.time() + 60, generation=auth_utils.principal_generation())
+    assert auth_utils.get_cached_principal(principal.email) is principal
+    auth_utils.invalidate_principal(user_id=principal.id)
+    assert auth_utils.get_cached_principal(principal.email) is None
@@ -0,0 +1,138 @@
+"""Сводка photo_stats должна совпадать с содержимым photos после любых изменений."""
+import asyncio
+import json
+import random
+
+from conftest import app_client, jpeg
+
+PARALLELS = "АБВ"
+
+
+async def _all_photos(client) -> list[dict]:
+    photos, cursor = [], None
+    while True:
+        response = await client.get("/photos/", params={"limit": 100, **({"cursor": cursor} if cursor else {})})
+        page = response.json()
+        photos += page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return photos
+
+
+async def _assert_stats_match(client):
+    expected: dict[tuple, tuple] = {}
+    photos = await _all_photos(client)
+    for photo in photos:
+        key = (int(photo["date"][:4]), photo["grade"], photo["parallel"])
+        count, cover = expected.get(key, (0, None))
+        candidate = (photo["date"], photo["id"])
+        expected[key] = (count + 1, max(cover, candidate) if cover else candidate)
+    stats = (await client.get("/photos/stats")).json()
+    actual = {(item["year"], item["grade"], item["parallel"]): (item["count"], item["cover_photo_id"]) for item in stats["items"]}
+    assert actual == {key: (count, cover[1]) for key, (count, cover) in expected.items()}
+    assert stats["total"] == len(photos)
+
+
+def _meta(rng: random.Random) -> dict:
+    return {
+        "date": f"{rng.choice([2019, 2020, 2021])}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+        "description": "Фото",
+        "grade": rng.choice([9, 10, 11]),
+        "parallel": rng.choice(PARALLELS),
+    }
+
+
+async def _upload(client, rng: random.Random, seed: int) -> int:
+    response = await client.post("/photos/", data={"photo_data_json": json.dumps(_meta(rng))},
+                                 files={"file": (f"{seed}.jpg", jpeg(seed), "image/jpeg")})
+    assert response.status_code == 200, response.text
+    return max(photo["id"] for photo in await _all_photos(client))
+
+
+def test_stats_follow_changes():
+    rng = random.Random(1)
+
+    async def run():
+        async with app_client() as client:
+            ids = [await _upload(client, rng, seed) for seed in range(10)]
+            await _assert_stats_match(client)
+
+            stats = (await client.get("/photos/stats")).json()
+            cover = stats["items"][0]["cover_photo_id"]
+            # Обложка группы переходит в другую группу
+            response = await client.put(f"/photos/{cover}", json={"date": "2017-05-05", "description": "x", "grade": 9, "parallel": "А"})
+            assert response.status_code == 200
+            await _assert_stats_match(client)
+
+            response = await client.put("/photos/bulk", json={"filter": {"grade": 10}, "data": {"parallel": "Г"}})
+            assert response.status_code == 200
+            await _assert_stats_match(client)
+
+            assert (await client.delete(f"/photos/{ids[0]}")).status_code == 200
+            response = await client.post("/photos/bulk/delete", json={"ids": ids[1:4]})
+            assert response.status_code == 200
+            await _assert_stats_match(client)
+
+    asyncio.run(run())
+
+
+def test_concurrent_updates_of_one_photo():
+    rng = random.Random(2)
+
+    async def run():
+        async with app_client() as client:
+            photo_id = await _upload(client, rng, 100)
+            # Каждое изменение переносит фото в новую группу: старые значения должны читаться
+            # после предыдущего изменения, иначе счетчики групп разойдутся с photos
+            updates = [
+                client.put(f"/photos/{photo_id}", json={"date": f"20{10 + index}-01-01", "description": "x", "grade": 1 + index % 11, "parallel": "А"})
+                for index in range(12)
+            ]
+            bulk = [client.put("/photos/bulk", json={"ids": [photo_id], "data": {"parallel": parallel}}) for parallel in PARALLELS]
+            responses = await asyncio.gather(*updates, *bulk)
+            assert all(response.status_code == 200 for response in responses)
+            await _assert_stats_match(client)
+
+    asyncio.run(run())
+
+
+def test_photos_without_grade_or_parallel():
+    from sqlalchemy import text
+    from database import engine
+    from photo_stats import install
+
+    async def insert_legacy(date: str, grade, parallel) -> int:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text("INSERT INTO photos (date, path, grade, parallel, created_at, updated_at) "
+                     "VALUES (:date, 'photos/legacy.jpg', :grade, :parallel, :date, :date) RETURNING id"),
+                {"date": date, "grade": grade, "parallel": parallel},
+            )
+            return result.scalar_one()
+
+    async def run():
+        async with app_client() as client:
+            await _upload(client, random.Random(3), 200)
+            # Строки, загруженные до появления класса и параллели; сводка строится заново, как при первом запуске
+            legacy = [await insert_legacy("2015-06-01 00:00:00", None, None),
+                      await insert_legacy("2015-07-01 00:00:00", None, None),
+                      await insert_legacy("2015-08-01 00:00:00", 7, None)]
+            async with engine.begin() as conn:
+                await conn.execute(text("DELETE FROM photo_stats"))
+            await install()
+            await _assert_stats_match(client)
+            stats = (await client.get("/photos/stats")).json()
+            no_grade = [item for item in stats["items"] if item["grade"] is None]
+            assert no_grade == [{"year": 2015, "grade": None, "parallel": None, "count": 2, "cover_photo_id": legacy[1]}]
+
+            # Удаление обложки группы без класса: обложка выбирается заново среди NULL-строк
+            assert (await client.delete(f"/photos/{legacy[1]}")).status_code == 200
+            await _assert_stats_match(client)
+            # Перенос в обычную группу и обратно учитывается в apply
+            response = await client.put(f"/photos/{legacy[0]}", json={"date": "2015-06-01", "description": "x", "grade": 7, "parallel": "А"})
+            assert response.status_code == 200
+            await _assert_stats_match(client)
+            assert (await client.delete(f"/photos/{legacy[2]}")).status_code == 200
+            await _assert_stats_match(client)
+
+    asyncio.run(run())
@@ -0,0 +1,56 @@
+"""Сниппет поиска строится из исходного описания: пользовательская разметка экранируется, «ё» сохраняется."""
+import asyncio
+import json
+
+from conftest import app_client, jpeg
+
+
+def test_snippet_escapes_description_and_keeps_yo():
+    description = "Ёлка <img src=x onerror=alert(1)> выпускной"
+
+    async def run():
+        async with app_client() as client:
+            response = await client.post(
+                "/photos/",
+                data={"photo_data_json": json.dumps({"date": "2022-12-25", "description": description, "grade": 3, "parallel": "Б"})},
+                files={"file": ("tree.jpg", jpeg(301), "image/jpeg")},
+            )
+            assert response.status_code == 200, response.text
+
+            items = (await client.get("/photos/search", params={"q": "ёлки"})).json()["items"]
+            assert [item["description"] for item in items] == [description]
+            assert items[0]["snippet"] == "<mark>Ёлка</mark> &lt;img src=x onerror=alert(1)&gt; выпускной"
+
+    asyncio.run(run())
+
+
+def test_snippet_window():
+    import search
+
+    words = [f"слово{index}" for index in range(30)]
+    words[20] = "Выпускной"
+    snippet = search.snippet(" ".join(words), search.query_terms("выпускного"))
+    assert snippet.startswith("…слово18 слово19 <mark>Выпускной</mark> слово21")
+    assert snippet.endswith("слово29")
+    assert snippet.count(" ") == search.SNIPPET_TOKENS - 1
+    assert search.snippet(None, ["x"]) == ""
+
+
+def test_filter_applies_before_candidate_limit(monkeypatch):
+    import search
+
+    async def run():
+        async with app_client() as client:
+            for seed, grade in ((310, 6), (311, 7), (312, 7)):
+                response = await client.post(
+                    "/photos/",
+                    data={"photo_data_json": json.dumps({"date": "2023-05-25", "description": "Последний звонок", "grade": grade, "parallel": "А"})},
+                    files={"file": (f"{seed}.jpg", jpeg(seed), "image/jpeg")},
+                )
+                assert response.status_code == 200, response.text
+            # Предел меньше числа совпадений: фильтр по классу должен отбирать кандидатов до него
+            monkeypatch.setattr(search, "SEARCH_MAX_CANDIDATES", 1)
+            items = (await client.get("/photos/search", params={"q": "звонок", "grade": 6})).json()["items"]
+            assert [item["grade"] for item in items] == [6]
+
+    asyncio.run(run())
@@ -0,0 +1,192 @@
+"""
+Тесты хранилищ оригиналов (storage.py): в памяти, на диске и S3 через заглушку клиента
+из benchmarks/storage.py. Маленький part_size, чтобы большие файлы шли частями.
+"""
+import asyncio
+import contextlib
+import os
+import random
+
+import pytest
+
+import storage
+import uploads
+from benchmarks.storage import StubS3Client
+
+PART_SIZE = 1024
+DATA = random.Random(0).randbytes(10 * PART_SIZE + 123)
+
+
+class FailingPartClient(StubS3Client):
+    """Заглушка S3, у которой не загружается часть с номером failing_part."""
+
+    def __init__(self, failing_part: int):
+        super().__init__(latency=0, bandwidth=float("inf"))
+        self.failing_part = failing_part
+        self.aborted: list[str] = []
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.failing_part:
+            raise ConnectionError("part failed")
+        return await super().upload_part(Bucket, Key, UploadId, PartNumber, Body)
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        await super().abort_multipart_upload(Bucket, Key, UploadId)
+
+
+def _s3(client=None) -> storage.S3Storage:
+    client = client or StubS3Client(latency=0, bandwidth=float("inf"))
+    return storage.S3Storage(lambda: contextlib.nullcontext(client), "test", part_size=PART_SIZE,
+                             multipart_threshold=PART_SIZE, concurrency=3)
+
+
+def _backends():
+    return [
+        pytest.param(storage.MemoryStorage, id="memory"),
+        pytest.param(storage.LocalStorage, id="local"),
+        pytest.param(_s3, id="s3"),
+    ]
+
+
+def _key(name: str) -> str:
+    return uploads.storage_path(name * 64, ".jpg")
+
+
+async def _chunks(data: bytes, size: int = 700):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+async def _read(backend, key: str, start: int = 0, end=None) -> bytes:
+    return b"".join([chunk async for chunk in backend.get(key, start, end)])
+
+
+@pytest.mark.parametrize("make_backend", _backends())
+def test_put_get_exists_delete(make_backend):
+    backend = make_backend()
+    key = _key("a")
+
+    async def run():
+        assert not await backend.exists(key)
+        assert await backend.put(key, _chunks(DATA)) == len(DATA)
+        assert await backend.exists(key)
+        assert await backend.size(key) == len(DATA)
+        assert await _read(backend, key) == DATA
+        await backend.delete(key, _key("b"))
+        assert not await backend.exists(key)
+        assert await backend.size(key) is None
+        with pytest.raises(FileNotFoundError):
+            await _read(backend, key)
+        await backend.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("make_backend", _backends())
+@pytest.mark.parametrize("start, end", [(0, 1), (0, 100), (PART_SIZE - 1, 3 * PART_SIZE + 5), (5000, None),
+                                        (len(DATA) - 1, None), (100, len(DATA) + 1000), (10, 10)])
+def test_byte_ranges(make_backend, start, end):
+    backend = make_backend()
+    key = _key("c")
+
+    async def run():
+        await backend.put(key, _chunks(DATA))
+        assert await _read(backend, key, start, end) == DATA[start:end]
+        await backend.delete(key)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("make_backend", _backends())
+def test_put_file_keeps_source(make_backend):
+    backend = make_backend()
+    key = _key("d")
+    os.makedirs(uploads.UPLOAD_TMP_DIR, exist_ok=True)
+    source = os.path.join(uploads.UPLOAD_TMP_DIR, "source.upload")
+    with open(source, "wb") as f:
+        f.write(DATA)
+
+    async def run():
+        await backend.put_file(key, source)
+        assert await _read(backend, key) == DATA
+        await backend.delete(key)
+
+    asyncio.run(run())
+    # Временный файл загрузки удаляет вызывающий код: он нужен, если файл придется записать снова
+    assert os.path.exists(source)
+    os.remove(source)
+
+
+def test_s3_small_file_is_one_request():
+    client = StubS3Client(latency=0, bandwidth=float("inf"))
+    backend = _s3(client)
+
+    async def run():
+        await backend.put(_key("e"), _chunks(DATA[:PART_SIZE - 1]))
+
+    asyncio.run(run())
+    assert client.requests == 1
+    assert client.objects[_key("e")] == DATA[:PART_SIZE - 1]
+
+
+def test_s3_multipart_upload():
+    client = StubS3Client(latency=0, bandwidth=float("inf"))
+    backend = _s3(client)
+
+    async def run():
+        await backend.put(_key("f"), _chunks(DATA))
+
+    asyncio.run(run())
+    assert client.objects[_key("f")] == DATA
+    assert not client.uploads
+    # create + 11 частей + complete
+    assert client.requests == 13
+
+
+def test_s3_multipart_aborted_when_part_fails():
+    client = FailingPartClient(failing_part=3)
+    backend = _s3(client)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await backend.put(_key("g"), _chunks(DATA))
+
+    asyncio.run(run())
+    assert len(client.aborted) == 1
+    assert not client.uploads
+    assert _key("g") not in client.objects
+
+
+def test_s3_multipart_aborted_when_source_fails():
+    client = FailingPartClient(failing_part=0)
+    backend = _s3(client)
+
+    async def failing_source():
+        yield DATA[:3 * PART_SIZE]
+        raise OSError("client disconnected")
+
+    async def run():
+        with pytest.raises(OSError):
+            await backend.put(_key("h"), failing_source())
+
+    asyncio.run(run())
+    assert len(client.aborted) == 1
+    assert not client.uploads
+    assert _key("h") not in client.objects
+
+
+def test_s3_local_file_is_removed_after_use(monkeypatch):
+    backend = _s3()
+    monkeypatch.setattr(storage, "backend", backend)
+    key = _key("i")
+
+    async def run():
+        await backend.put(key, _chunks(DATA))
+        async with storage.local_file(key) as path:
+            assert path.startswith(uploads.UPLOAD_TMP_DIR)
+            with open(path, "rb") as f:
+                assert f.read() == DATA
+        return path
+
+    assert not os.path.exists(asyncio.run(run()))
@@ -0,0 +1,70 @@
+"""Потоковый прием загрузок: проверки на первых байтах тела и удаление временных файлов."""
+import asyncio
+import json
+import os
+
+from conftest import app_client, jpeg
+
+BOUNDARY = "test-boundary"
+META = {"date": "2021-05-20", "description": "Загрузка", "grade": 4, "parallel": "В"}
+
+
+def _tmp_files() -> list[str]:
+    import uploads
+
+    return os.listdir(uploads.UPLOAD_TMP_DIR) if os.path.isdir(uploads.UPLOAD_TMP_DIR) else []
+
+
+def test_bad_signature_rejected_before_rest_of_body():
+    chunks_read = []
+
+    async def body():
+        chunks_read.append(1)
+        yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"photo_data_json\"\r\n\r\n{json.dumps(META)}\r\n"
+               f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n\r\n").encode() + b"GIF89a" * 10
+        chunks_read.append(2)
+        yield b"0" * 1024 + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+    async def run():
+        async with app_client() as client:
+            response = await client.post("/photos/", content=body(),
+                                         headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+            assert response.status_code == 400
+            assert response.json()["detail"] == "Invalid photo format"
+        assert chunks_read == [1]
+        assert _tmp_files() == []
+
+    asyncio.run(run())
+
+
+def test_bulk_reports_errors_per_file():
+    files = [
+        ("files", ("ok.jpg", jpeg(101), "image/jpeg")),
+        ("files", ("bad.gif", b"GIF89a", "image/gif")),
+        ("files", ("fake.jpg", b"not a jpeg at all", "image/jpeg")),
+        ("files", ("meta.jpg", jpeg(102), "image/jpeg")),
+    ]
+    metadata = [META, META, META, {"grade": "x"}]
+
+    async def run():
+        async with app_client() as client:
+            response = await client.post("/photos/bulk", data={"photo_data_json": json.dumps(metadata)}, files=files)
+            assert response.status_code == 200, response.text
+            results = response.json()["results"]
+            assert [result["success"] for result in results] == [True, False, False, False]
+            assert results[1]["error"] == results[2]["error"] == "Invalid photo format"
+            assert results[3]["error"].startswith("Invalid metadata")
+        assert _tmp_files() == []
+
+    asyncio.run(run())
+
+
+def test_metadata_must_match_files():
+    async def run():
+        async with app_client() as client:
+            response = await client.post("/photos/bulk", data={"photo_data_json": json.dumps([META, META])},
+                                         files=[("files", ("one.jpg", jpeg(103), "image/jpeg"))])
+            assert response.status_code == 400
+        assert _tmp_files() == []
+
+    asyncio.run(run())
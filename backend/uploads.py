@@ -0,0 +1,402 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+PHOTOS_DIR = os.getenv("PHOTOS_DIR", "photos")
+# Временные файлы лежат внутри PHOTOS_DIR, чтобы os.replace оставался атомарным (одна ФС)
+UPLOAD_TMP_DIR = os.path.join(PHOTOS_DIR, ".tmp")
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 200 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# Запас на заголовки multipart и JSON с метаданными
+MULTIPART_OVERHEAD = 64 * 1024
+# Текстовое поле формы (JSON с метаданными, для пакетной загрузки - массив)
+MAX_FORM_FIELD_SIZE = int(os.getenv("MAX_FORM_FIELD_SIZE", 1024 * 1024))
+# Пакетная загрузка: число файлов, общий размер запроса и число файлов, принимаемых параллельно
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", 500))
+MAX_BULK_UPLOAD_SIZE = int(os.getenv("MAX_BULK_UPLOAD_SIZE", 10 * 1024 * 1024 * 1024))
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", 4))
+
+# Файлы раскладываются по подкаталогам photos/ab/cd/ по первым символам хэша,
+# чтобы в одном каталоге не было сотен тысяч файлов
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".raw", ".tiff"}
+
+_JPEG = (b"\xff\xd8\xff",)
+_PNG = (b"\x89PNG\r\n\x1a\n",)
+_TIFF = (b"II*\x00", b"MM\x00*")
+# RAW-форматы камер: большинство основано на TIFF (CR2, NEF, ARW, DNG), остальные со своими сигнатурами
+_RAW = _TIFF + (b"IIRO", b"IIRS", b"IIU\x00", b"FUJIFILMCCD-RAW", b"FOVb")
+
+# Сколько первых байт файла нужно для проверки сигнатуры (CR3: ftypcrx со смещения 4)
+MAGIC_HEADER_SIZE = 16
+
+MAGIC_NUMBERS = {
+    ".jpg": _JPEG,
+    ".jpeg": _JPEG,
+    ".png": _PNG,
+    ".tiff": _TIFF,
+    ".raw": _RAW,
+}
+
+
+@dataclass
+class IngestedFile:
+    """Результат потокового приёма файла."""
+    tmp_path: str
+    size: int
+    checksum: str
+    extension: str
+
+
+def get_extension(filename: str) -> str:
+    _, file_extension = os.path.splitext(filename or "")
+    return file_extension.lower()
+
+
+def _is_checksum(value: str) -> bool:
+    return len(value) == 64 and all(char in "0123456789abcdef" for char in value)
+
+
+def _shard_key(name: str) -> str:
+    stem, _ = os.path.splitext(name)
+    if _is_checksum(stem[:64]) and stem[64:65] in ("", "_"):
+        # Файл фото (<checksum>.jpg) или его превью (<checksum>_256.webp)
+        return stem[:64]
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+
+def sharded_path(name: str, root: Optional[str] = None) -> str:
+    """
+    Путь к файлу с именем name в разложенной по подкаталогам структуре внутри root
+    (по умолчанию PHOTOS_DIR). Имя файла начинается с хэша содержимого, подкаталоги
+    берутся из него; для старых файлов с другими именами (uuid) - из SHA-256 имени.
+    """
+    key = _shard_key(name)
+    shards = [key[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(SHARD_LEVELS)]
+    return os.path.join(PHOTOS_DIR if root is None else root, *shards, name)
+
+
+def flat_path(name: str) -> str:
+    """Путь к файлу в старой структуре: все файлы прямо в PHOTOS_DIR."""
+    return os.path.join(PHOTOS_DIR, name)
+
+
+def storage_path(checksum: str, extension: str) -> str:
+    """Путь для нового файла фото."""
+    return sharded_path(f"{checksum}{extension}")
+
+
+def _shard_root(path: str) -> str:
+    """Каталог, внутри которого лежат подкаталоги шардов, если path - путь в новой структуре."""
+    root = os.path.dirname(path)
+    for _ in range(SHARD_LEVELS):
+        root = os.path.dirname(root)
+    return root
+
+
+def is_sharded(path: str) -> bool:
+    return os.path.normpath(path) == os.path.normpath(sharded_path(os.path.basename(path), _shard_root(path)))
+
+
+def other_layout_path(path: str) -> str:
+    """Путь того же файла в другой структуре: плоский для разложенного и наоборот."""
+    name = os.path.basename(path)
+    if is_sharded(path):
+        return os.path.join(_shard_root(path), name)
+    return sharded_path(name, os.path.dirname(path))
+
+
+def resolve_path(path: str) -> str:
+    """
+    Путь к существующему файлу (фото или превью): сохраненный в базе или, если файл
+    уже перенесен (или еще не перенесен) migrate_storage.py, путь в другой структуре.
+    Функция блокирующая - вызывается из пула потоков.
+    """
+    if os.path.exists(path):
+        return path
+    candidate = other_layout_path(path)
+    return candidate if os.path.exists(candidate) else path
+
+
+def check_magic(extension: str, header: bytes) -> bool:
+    """Проверяет, что первые байты файла соответствуют заявленному расширению."""
+    if any(header.startswith(magic) for magic in MAGIC_NUMBERS.get(extension, ())):
+        return True
+    # Canon CR3 - контейнер ISO BMFF
+    return extension == ".raw" and header[4:12] == b"ftypcrx "
+
+
+def _check_content_length(request: Request, limit: int):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail="File too large")
+
+
+def _write_chunk(f, checksum, chunk: bytes):
+    # hashlib отпускает GIL на больших буферах, поэтому хэш считаем в том же потоке, что и запись
+    checksum.update(chunk)
+    f.write(chunk)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _open_temp(path: str):
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    return open(path, "wb")
+
+
+def _close_and_remove(f, path: str):
+    f.close()
+    _remove_quietly(path)
+
+
+def _decode(value: bytes) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+class _TempFileWriter:
+    """
+    Временный файл одной части запроса. Сигнатура проверяется, как только пришли первые
+    MAGIC_HEADER_SIZE байт, размер - на каждом куске. Данные копятся до UPLOAD_CHUNK_SIZE
+    и пишутся в пуле потоков вместе с подсчетом SHA-256.
+    """
+
+    def __init__(self, extension: str):
+        self.extension = extension
+        self.tmp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}.part")
+        self.size = 0
+        self._checksum = hashlib.sha256()
+        self._pending = bytearray()
+        self._file = None
+        self._magic_checked = False
+
+    def _check_magic(self):
+        if not check_magic(self.extension, bytes(self._pending[:MAGIC_HEADER_SIZE])):
+            raise HTTPException(status_code=400, detail="Invalid photo format")
+        self._magic_checked = True
+
+    async def _flush(self):
+        if not self._magic_checked:
+            self._check_magic()
+        if self._file is None:
+            self._file = await asyncio.to_thread(_open_temp, self.tmp_path)
+        data, self._pending = bytes(self._pending), bytearray()
+        await asyncio.to_thread(_write_chunk, self._file, self._checksum, data)
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail="File too large")
+        self._pending += data
+        if not self._magic_checked and len(self._pending) >= MAGIC_HEADER_SIZE:
+            self._check_magic()
+        if len(self._pending) >= UPLOAD_CHUNK_SIZE:
+            await self._flush()
+
+    async def finish(self) -> IngestedFile:
+        await self._flush()
+        await asyncio.to_thread(self._file.close)
+        return IngestedFile(tmp_path=self.tmp_path, size=self.size, checksum=self._checksum.hexdigest(), extension=self.extension)
+
+    async def abort(self):
+        if self._file is not None:
+            await asyncio.to_thread(_close_and_remove, self._file, self.tmp_path)
+
+
+@dataclass
+class ReceivedFile:
+    """Файл из запроса: принятый во временный файл или текст ошибки (в пакетном режиме)."""
+    filename: str
+    ingested: Optional[IngestedFile] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class ReceivedForm:
+    fields: dict[str, str]
+    files: list[ReceivedFile]
+
+
+_HEADERS, _DATA, _END = range(3)
+
+
+class _MultipartReceiver:
+    """
+    Разбор multipart-тела по мере чтения запроса, без предварительного сохранения всего тела.
+    Колбэки python-multipart синхронные и только копят события; после каждого куска тела
+    события обрабатываются здесь же, с записью файлов в пуле потоков.
+
+    В строгом режиме (strict) ошибка файла - HTTPException сразу, остаток тела не читается.
+    В пакетном ошибка записывается в ReceivedFile, остаток этой части пропускается.
+    Ошибки всего запроса (размер, число файлов, формат тела) - HTTPException в обоих режимах.
+    """
+
+    def __init__(self, file_field: str, max_files: int, strict: bool):
+        self.file_field = file_field
+        self.max_files = max_files
+        self.strict = strict
+        self.fields: dict[str, str] = {}
+        self.files: list[ReceivedFile] = []
+        self._events: list[tuple[int, bytes]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._file_count = 0
+        self._field_name: Optional[str] = None
+        self._field_data = bytearray()
+        self._current: Optional[ReceivedFile] = None
+        self._writer: Optional[_TempFileWriter] = None
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self):
+        self._events.append((_HEADERS, self._disposition))
+        self._disposition = b""
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append((_DATA, data[start:end]))
+
+    def _on_part_end(self):
+        self._events.append((_END, b""))
+
+    def _reject(self, exc: HTTPException):
+        if self.strict:
+            raise exc
+        self._current.error = exc.detail
+
+    async def _file_step(self, step):
+        """Операция с текущим файлом; ошибка файла удаляет его временный файл."""
+        try:
+            return await step
+        except HTTPException as e:
+            writer, self._writer = self._writer, None
+            await writer.abort()
+            self._reject(e)
+
+    def _begin_part(self, disposition: bytes):
+        _, options = parse_options_header(disposition)
+        if b"filename" not in options:
+            self._field_name = _decode(options.get(b"name", b""))
+            self._field_data = bytearray()
+            return
+        if _decode(options.get(b"name", b"")) != self.file_field:
+            raise HTTPException(status_code=400, detail=f"Files are expected in the '{self.file_field}' field")
+        self._file_count += 1
+        if self._file_count > self.max_files:
+            raise HTTPException(status_code=413, detail=f"Too many files, maximum is {self.max_files}")
+        self._current = ReceivedFile(filename=_decode(options[b"filename"]))
+        extension = get_extension(self._current.filename)
+        if extension in ALLOWED_EXTENSIONS:
+            self._writer = _TempFileWriter(extension)
+        else:
+            self._reject(HTTPException(status_code=400, detail="Invalid photo format"))
+
+    async def _handle(self, kind: int, data: bytes):
+        if kind == _HEADERS:
+            self._begin_part(data)
+        elif kind == _DATA:
+            if self._field_name is not None:
+                self._field_data += data
+                if len(self._field_data) > MAX_FORM_FIELD_SIZE:
+                    raise HTTPException(status_code=413, detail="Form field too large")
+            elif self._writer is not None:
+                await self._file_step(self._writer.write(data))
+        elif self._field_name is not None:
+            self.fields[self._field_name] = _decode(bytes(self._field_data))
+            self._field_name = None
+        elif self._current is not None:
+            if self._writer is not None:
+                self._current.ingested = await self._file_step(self._writer.finish())
+                self._writer = None
+            self.files.append(self._current)
+            self._current = None
+
+    async def receive(self, request: Request, max_size: int):
+        content_type, params = parse_options_header(request.headers.get("content-type"))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+        _check_content_length(request, max_size)
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+        received = 0
+        async for chunk in request.stream():
+            # Content-Length может не быть (chunked), поэтому считаются прочитанные байты
+            received += len(chunk)
+            if received > max_size:
+                raise HTTPException(status_code=413, detail="File too large")
+            try:
+                parser.write(chunk)
+            except FormParserError:
+                raise HTTPException(status_code=400, detail="Invalid multipart data")
+            events, self._events = self._events, []
+            for kind, data in events:
+                await self._handle(kind, data)
+        if self._current is not None or self._field_name is not None:
+            raise HTTPException(status_code=400, detail="Invalid multipart data")
+
+    async def discard(self):
+        if self._writer is not None:
+            await self._writer.abort()
+        await discard_files([file.ingested.tmp_path for file in self.files if file.ingested is not None])
+
+
+@asynccontextmanager
+async def receive_form(request: Request, file_field: str, max_files: int, max_size: int, strict: bool) -> AsyncIterator[ReceivedForm]:
+    """
+    Принимает multipart-запрос загрузки потоком: файлы из поля file_field пишутся во временные
+    файлы по мере чтения тела, текстовые поля возвращаются строками. Запрос больше max_size
+    байт отклоняется (413) по Content-Length или на первом куске сверх лимита, файл с неверной
+    сигнатурой - на первых байтах. Временные файлы удаляются при выходе из контекста.
+    """
+    receiver = _MultipartReceiver(file_field, max_files, strict)
+    try:
+        await receiver.receive(request, max_size)
+        yield ReceivedForm(fields=receiver.fields, files=receiver.files)
+    finally:
+        await receiver.discard()
+
+
+async def discard_file(path: str):
+    await asyncio.to_thread(_remove_quietly, path)
+
+
+def _remove_many_quietly(paths: list[str]):
+    for path in paths:
+        _remove_quietly(path)
+
+
+async def discard_files(paths: list[str]):
+    """Удаляет пачку файлов одним заданием в пуле потоков."""
+    await asyncio.to_thread(_remove_many_quietly, paths)